@@ -135,8 +135,8 @@ export async function chat(messages) {
   return response.data;
 }
 
-export async function summarize(text) {
-  const response = await apiCall("post", "/summarize", { text });
+export async function summarize(text, noteId = null) {
+  const response = await apiCall("post", "/summarize", { text, noteId });
   return response.data;
 }
 
@@ -178,6 +178,13 @@ export async function addMediaToNote(noteId, mediaId) {
 // ----- Transcription API ----- //
 
 export async function transcribeRecording(mediaId) {
-  const response = await apiCall("post", `/transcribe/${mediaId}`);
-  return response.data;
+  // Transcription runs as a background job on the server, poll until it has finished
+  let response = await apiCall("post", "/transcriptions", { mediaId });
+  let job = response.data;
+  while (job.status === "pending" || job.status === "running") {
+    await new Promise((resolve) => setTimeout(resolve, 1000));
+    response = await apiCall("get", `/transcriptions/${job.id}`);
+    job = response.data;
+  }
+  return job;
 }
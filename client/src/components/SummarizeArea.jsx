@@ -9,7 +9,7 @@ export default function SummarizeArea({ note }) {
 
   const generateSummary = () => {
     setThinking(true);
-    summarize(note.content).then(({ summary }) => {
+    summarize(note.content, note.id).then(({ summary }) => {
       setSummary(summary);
       setThinking(false);
     });
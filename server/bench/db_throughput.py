@@ -0,0 +1,189 @@
+"""Measure database read throughput while notes are being written concurrently.
+
+Runs the same workload against a SQLite database twice: once with the previous engine
+setup (no connection pool, rollback journal) and once with the engine options and
+pragmas from the [database] section of a config file. Reader threads fetch single notes
+and pages of the note list, while writer threads update notes and commit, like
+`open_note` and `update_note` do. Prints the results as JSON.
+
+Usage: python bench/db_throughput.py [--config config.toml] [--notes 10000]
+    [--readers 8] [--writers 2] [--duration 10]
+"""
+
+import argparse
+import datetime
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import tomllib
+
+from sqlalchemy import (
+    Column,
+    DateTime,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    Text,
+    create_engine,
+    select,
+    update,
+)
+from sqlalchemy.pool import NullPool
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from src.database import engine_options, tune_sqlite  # noqa: E402
+
+metadata = MetaData()
+note = Table(
+    "note",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("title", String(80), nullable=False),
+    Column("content", Text, nullable=False),
+    Column("last_modified", DateTime, nullable=False, index=True),
+    Column("last_opened", DateTime),
+)
+
+
+def seed(engine, n_notes: int):
+    metadata.create_all(engine)
+    now = datetime.datetime.now()
+    with engine.begin() as conn:
+        conn.execute(
+            note.insert(),
+            [
+                {
+                    "title": f"Note {i}",
+                    "content": f"Content of note {i}. " * 20,
+                    "last_modified": now - datetime.timedelta(minutes=i),
+                }
+                for i in range(n_notes)
+            ],
+        )
+
+
+def run_workload(engine, n_notes: int, readers: int, writers: int, duration: float):
+    stop = threading.Event()
+    reads = [0] * readers
+    writes = [0] * writers
+    errors = [0]
+    latencies: list[float] = []
+    lock = threading.Lock()
+
+    def reader(i: int):
+        rng = random.Random(i)
+        local = []
+        while not stop.is_set():
+            start = time.perf_counter()
+            try:
+                with engine.connect() as conn:
+                    if rng.random() < 0.5:
+                        conn.execute(
+                            select(note).where(note.c.id == rng.randint(1, n_notes))
+                        ).fetchall()
+                    else:
+                        conn.execute(
+                            select(note.c.id, note.c.title)
+                            .order_by(note.c.last_modified.desc())
+                            .limit(20)
+                        ).fetchall()
+                reads[i] += 1
+                local.append(time.perf_counter() - start)
+            except Exception:
+                errors[0] += 1
+        with lock:
+            latencies.extend(local)
+
+    def writer(i: int):
+        rng = random.Random(1000 + i)
+        while not stop.is_set():
+            try:
+                with engine.begin() as conn:
+                    now = datetime.datetime.now()
+                    conn.execute(
+                        update(note)
+                        .where(note.c.id == rng.randint(1, n_notes))
+                        .values(last_opened=now, last_modified=now)
+                    )
+                writes[i] += 1
+            except Exception:
+                errors[0] += 1
+
+    threads = [threading.Thread(target=reader, args=(i,)) for i in range(readers)]
+    threads += [threading.Thread(target=writer, args=(i,)) for i in range(writers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    latencies.sort()
+
+    def percentile(p: float) -> float | None:
+        if not latencies:
+            return None
+        return round(latencies[min(int(p * len(latencies)), len(latencies) - 1)] * 1000, 3)
+
+    return {
+        "reads_per_second": round(sum(reads) / duration, 1),
+        "writes_per_second": round(sum(writes) / duration, 1),
+        "errors": errors[0],
+        "read_latency_ms": {
+            "p50": percentile(0.50),
+            "p95": percentile(0.95),
+            "p99": percentile(0.99),
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--config", default="config.toml")
+    parser.add_argument("--notes", type=int, default=10000)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--writers", type=int, default=2)
+    parser.add_argument("--duration", type=float, default=10.0)
+    args = parser.parse_args()
+
+    with open(args.config, "rb") as f:
+        db_config = tomllib.load(f)["database"]
+
+    results = {}
+    for name in ["baseline", "tuned"]:
+        with tempfile.TemporaryDirectory() as tmp:
+            uri = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+            if name == "baseline":
+                engine = create_engine(uri, poolclass=NullPool)
+            else:
+                config = {**db_config, "uri": uri}
+                engine = create_engine(uri, **engine_options(config))
+                tune_sqlite(engine, config)
+            seed(engine, args.notes)
+            results[name] = run_workload(
+                engine, args.notes, args.readers, args.writers, args.duration
+            )
+            engine.dispose()
+
+    print(
+        json.dumps(
+            {
+                "benchmark": "db_throughput",
+                "notes": args.notes,
+                "readers": args.readers,
+                "writers": args.writers,
+                "duration": args.duration,
+                "results": results,
+            },
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,343 @@
+"""Deterministic stand-ins for the Ollama, Chroma and whisper.cpp HTTP APIs.
+
+The fakes answer the requests the server's clients make with made-up but stable
+results, after a configurable artificial latency, so that the server can be
+benchmarked without running any model. Embeddings are hashed bags of words, so texts
+that share words are near each other and semantic search still finds something.
+"""
+
+import hashlib
+import json
+import re
+import threading
+import time
+import uuid
+from typing import Any
+
+import numpy as np
+from flask import Flask, Response, request
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+__all__ = ["FakeOllama", "FakeChroma", "FakeWhisper", "embed"]
+
+_WORDS = re.compile(r"\w+")
+
+
+def embed(text: str, dim: int) -> list[float]:
+    """A unit vector with one signed component per word of the text, in hashed slots."""
+    vector = np.zeros(dim, dtype=np.float32)
+    for word in _WORDS.findall(text.lower()):
+        digest = hashlib.blake2b(word.encode(), digest_size=8).digest()
+        h = int.from_bytes(digest, "little")
+        vector[h % dim] += 1.0 if (h >> 32) & 1 else -1.0
+    norm = np.linalg.norm(vector)
+    return (vector / norm if norm else vector).tolist()
+
+
+class _KeepAliveHandler(WSGIRequestHandler):
+    # The clients keep connections alive, which needs HTTP/1.1
+    protocol_version = "HTTP/1.1"
+
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+class _FakeServer:
+    """A Flask app served on a background thread."""
+
+    def __init__(self, port: int, latency: float):
+        self.port = port
+        self.latency = latency
+        self.requests = 0
+        self.app = Flask(type(self).__name__)
+        self.app.before_request(self._before_request)
+        self._server = None
+
+    def _before_request(self):
+        self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def route(self, rule: str, view, methods: tuple[str, ...] = ("GET",)):
+        self.app.add_url_rule(rule, f"{methods[0]} {rule}", view, methods=list(methods))
+
+    def start(self):
+        self._server = make_server(
+            "127.0.0.1",
+            self.port,
+            self.app,
+            threaded=True,
+            request_handler=_KeepAliveHandler,
+        )
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+
+class FakeOllama(_FakeServer):
+    """Embeds with `embed` and chats with canned replies of `reply_tokens` words.
+
+    Every request waits `latency` seconds, and chat replies additionally take
+    `token_latency` seconds per word, streamed or not. Asked to pick notes for RAG, the
+    fake picks the first three notes it was shown.
+    """
+
+    def __init__(
+        self,
+        port: int,
+        latency: float = 0.0,
+        token_latency: float = 0.0,
+        reply_tokens: int = 32,
+        dim: int = 384,
+    ):
+        super().__init__(port, latency)
+        self.token_latency = token_latency
+        self.reply_tokens = reply_tokens
+        self.dim = dim
+        self.route("/", lambda: "Ollama is running")
+        self.route("/api/tags", lambda: {"models": []})
+        self.route("/api/pull", self.pull, ("POST",))
+        self.route("/api/embeddings", self.embeddings, ("POST",))
+        self.route("/api/chat", self.chat, ("POST",))
+
+    def pull(self):
+        if request.get_json(force=True).get("stream"):
+            return Response('{"status":"success"}\n', mimetype="application/x-ndjson")
+        return {"status": "success"}
+
+    def embeddings(self):
+        return {"embedding": embed(request.get_json(force=True)["prompt"], self.dim)}
+
+    def _reply(self, messages: list[dict[str, Any]]) -> list[str]:
+        prompt = messages[-1]["content"] if messages else ""
+        note_ids = re.findall(r"Note ID: (\d+)", prompt)
+        if note_ids:
+            return [", ".join(note_ids[:3])]
+        return [f"word{i % 100} " for i in range(self.reply_tokens)]
+
+    def chat(self):
+        data = request.get_json(force=True)
+        pieces = self._reply(data["messages"])
+        message = lambda content: {  # noqa: E731
+            "model": data["model"],
+            "created_at": "2024-01-01T00:00:00Z",
+            "message": {"role": "assistant", "content": content},
+            "done": False,
+        }
+        if not data.get("stream", True):
+            time.sleep(self.token_latency * len(pieces))
+            return {**message("".join(pieces)), "done": True}
+
+        def generate():
+            for piece in pieces:
+                time.sleep(self.token_latency)
+                yield json.dumps(message(piece)) + "\n"
+            yield json.dumps({**message(""), "done": True}) + "\n"
+
+        return Response(generate(), mimetype="application/x-ndjson")
+
+
+class _Collection:
+    def __init__(self, name: str, metadata: dict[str, Any] | None):
+        self.id = str(uuid.uuid4())
+        self.name = name
+        self.metadata = metadata
+        self.rows: dict[str, int] = {}
+        self.ids: list[str | None] = []
+        self.docs: list[str | None] = []
+        self.metadatas: list[dict[str, Any] | None] = []
+        self.matrix = np.zeros((0, 0), dtype=np.float32)
+
+    def to_dict(self):
+        return {"id": self.id, "name": self.name, "metadata": self.metadata}
+
+    def upsert(self, ids, embeddings, metadatas, documents):
+        if self.matrix.shape[1] == 0:
+            self.matrix = np.zeros((1024, len(embeddings[0])), dtype=np.float32)
+        for i, id in enumerate(ids):
+            row = self.rows.get(id)
+            if row is None:
+                row = self.rows[id] = len(self.ids)
+                self.ids.append(id)
+                self.docs.append(None)
+                self.metadatas.append(None)
+                if row >= len(self.matrix):
+                    grown = np.zeros_like(self.matrix)
+                    self.matrix = np.concatenate([self.matrix, grown])
+            self.matrix[row] = embeddings[i]
+            self.docs[row] = documents[i] if documents else None
+            self.metadatas[row] = metadatas[i] if metadatas else None
+
+    def select(self, ids=None, where=None) -> list[int]:
+        if ids:
+            rows = [self.rows[id] for id in ids if id in self.rows]
+        else:
+            rows = list(self.rows.values())
+        return [row for row in rows if _matches(self.metadatas[row], where)]
+
+    def delete(self, rows: list[int]):
+        for row in rows:
+            del self.rows[self.ids[row]]  # type: ignore
+            self.ids[row] = self.docs[row] = self.metadatas[row] = None
+
+    def result(self, rows: list[int], include: list[str], distances=None):
+        result: dict[str, Any] = {"ids": [self.ids[row] for row in rows]}
+        if "documents" in include:
+            result["documents"] = [self.docs[row] for row in rows]
+        if "metadatas" in include:
+            result["metadatas"] = [self.metadatas[row] for row in rows]
+        if "embeddings" in include:
+            result["embeddings"] = [self.matrix[row].tolist() for row in rows]
+        if distances is not None:
+            result["distances"] = distances
+        return result
+
+
+def _matches(metadata: dict[str, Any] | None, where: dict[str, Any] | None) -> bool:
+    for key, condition in (where or {}).items():
+        value = (metadata or {}).get(key)
+        if isinstance(condition, dict):
+            if "$in" in condition and value not in condition["$in"]:
+                return False
+            if "$eq" in condition and value != condition["$eq"]:
+                return False
+        elif value != condition:
+            return False
+    return True
+
+
+class FakeChroma(_FakeServer):
+    """An in-memory Chroma server with exact nearest-neighbor search in l2 space."""
+
+    def __init__(self, port: int, latency: float = 0.0):
+        super().__init__(port, latency)
+        self.collections: dict[str, _Collection] = {}
+        self._lock = threading.Lock()
+        self.route("/api/v1", lambda: {"nanosecond heartbeat": time.time_ns()})
+        self.route("/api/v1/version", lambda: json.dumps("0.5.0"))
+        self.route("/api/v1/pre-flight-checks", lambda: {"max_batch_size": 41666})
+        self.route("/api/v1/tenants/<name>", lambda name: {"name": name})
+        self.route("/api/v1/databases/<name>", self.get_database)
+        self.route("/api/v1/collections", self.create_collection, ("POST",))
+        self.route("/api/v1/collections/<name>", self.get_collection)
+        self.route("/api/v1/collections/<name>", self.delete_collection, ("DELETE",))
+        self.route(
+            "/api/v1/collections/<id>/<operation>", self.collection_operation, ("POST",)
+        )
+        self.route(
+            "/api/v1/collections/<id>/count",
+            lambda id: json.dumps(len(self._by_id(id).rows)),
+        )
+
+    def _by_id(self, id: str) -> _Collection:
+        for collection in self.collections.values():
+            if collection.id == id:
+                return collection
+        raise KeyError(id)
+
+    def get_database(self, name):
+        return {"id": name, "name": name, "tenant": request.args.get("tenant")}
+
+    def create_collection(self):
+        data = request.get_json(force=True)
+        with self._lock:
+            collection = self.collections.get(data["name"])
+            if collection is None:
+                collection = _Collection(data["name"], data.get("metadata"))
+                self.collections[data["name"]] = collection
+            elif not data.get("get_or_create"):
+                return {"error": f"Collection {data['name']} already exists"}, 409
+        return collection.to_dict()
+
+    def get_collection(self, name):
+        if name not in self.collections:
+            return {"error": f"Collection {name} does not exist."}, 404
+        return self.collections[name].to_dict()
+
+    def delete_collection(self, name):
+        with self._lock:
+            self.collections.pop(name, None)
+        return json.dumps(None)
+
+    def collection_operation(self, id, operation):
+        data = request.get_json(force=True)
+        with self._lock:
+            try:
+                collection = self._by_id(id)
+            except KeyError:
+                return {"error": f"Collection {id} does not exist."}, 404
+            if operation in ("add", "upsert"):
+                collection.upsert(
+                    data["ids"],
+                    data["embeddings"],
+                    data["metadatas"],
+                    data["documents"],
+                )
+                return json.dumps(True)
+            if operation == "delete":
+                rows = collection.select(data.get("ids"), data.get("where"))
+                deleted = [collection.ids[row] for row in rows]
+                collection.delete(rows)
+                return json.dumps(deleted)
+            if operation == "get":
+                rows = collection.select(data.get("ids"), data.get("where"))
+                return collection.result(rows, data.get("include") or [])
+            if operation == "query":
+                return self._query(collection, data)
+        return {"error": f"Unknown operation {operation}"}, 404
+
+    def _query(self, collection: _Collection, data):
+        rows = np.array(collection.select(where=data.get("where")), dtype=np.int64)
+        result: dict[str, list] = {}
+        for query in data["query_embeddings"]:
+            k = min(data["n_results"], len(rows))
+            if k:
+                diff = collection.matrix[rows] - np.asarray(query, dtype=np.float32)
+                distances = np.einsum("ij,ij->i", diff, diff)
+                nearest = np.argpartition(distances, k - 1)[:k]
+                nearest = nearest[np.argsort(distances[nearest])]
+                hits = collection.result(
+                    rows[nearest].tolist(),
+                    data.get("include") or [],
+                    distances[nearest].tolist(),
+                )
+            else:
+                hits = collection.result([], data.get("include") or [], [])
+            for key, value in hits.items():
+                result.setdefault(key, []).append(value)
+        return result
+
+
+class FakeWhisper(_FakeServer):
+    """Transcribes WAV uploads into one numbered segment per 5 seconds of audio.
+
+    Besides the base latency, a request takes `realtime_factor` seconds per second of
+    audio, like a real model would.
+    """
+
+    SEGMENT = 5.0
+
+    def __init__(self, port: int, latency: float = 0.0, realtime_factor: float = 0.0):
+        super().__init__(port, latency)
+        self.realtime_factor = realtime_factor
+        self.route("/", lambda: "whisper.cpp server")
+        self.route("/inference", self.inference, ("POST",))
+
+    def inference(self):
+        audio = request.files["file"].read()
+        # 16-bit mono PCM at 16 kHz after the 44 byte WAV header
+        duration = max(len(audio) - 44, 0) / 32000
+        time.sleep(duration * self.realtime_factor)
+        segments = [
+            {
+                "start": start,
+                "end": min(start + self.SEGMENT, duration),
+                "text": f" segment at {start:g} seconds",
+            }
+            for start in np.arange(0.0, duration, self.SEGMENT).tolist()
+        ]
+        return {"text": "".join(s["text"] for s in segments), "segments": segments}
@@ -0,0 +1,501 @@
+"""Load test the server against local stand-ins for its backends.
+
+For every database size, this seeds a database with synthetic notes (cached between
+runs), starts the server with `run.py` against fakes of Ollama, Chroma and whisper.cpp
+(see fakes.py), measures how long startup and the embedding backfill take, and then
+runs each scenario with a number of concurrent clients for a fixed time. The results
+are printed as JSON with the throughput and latency percentiles of every scenario, to
+compare across commits.
+
+Usage: python bench/load_test.py [--sizes 1k,100k,1m] [--duration 10] [--concurrency 8]
+    [--embed-latency 0.005] [--token-latency 0.001] [--output results.json]
+
+Scenarios that need the embeddings are skipped for sizes whose backfill does not finish
+within --ready-timeout.
+"""
+
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import sqlite3
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tomllib
+from typing import Any, Callable
+
+import requests
+
+sys.path.insert(0, os.path.dirname(__file__))
+from fakes import FakeChroma, FakeOllama, FakeWhisper  # noqa: E402
+from seed import vocabulary  # noqa: E402
+
+SERVER_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def parse_size(size: str) -> int:
+    multipliers = {"k": 1000, "m": 1000000}
+    suffix = size[-1].lower()
+    if suffix in multipliers:
+        return int(float(size[:-1]) * multipliers[suffix])
+    return int(size)
+
+
+def percentile(sorted_values: list[float], p: float) -> float | None:
+    """The nearest-rank percentile of sorted values."""
+    if not sorted_values:
+        return None
+    rank = int(round(p / 100 * len(sorted_values)))
+    return sorted_values[min(max(rank - 1, 0), len(sorted_values) - 1)]
+
+
+class Scenario:
+    """A kind of request, sent repeatedly by every client."""
+
+    def __init__(
+        self,
+        name: str,
+        method: str,
+        path: Callable[[random.Random], str],
+        body: Callable[[random.Random], Any] | None = None,
+        needs_embeddings: bool = False,
+    ):
+        self.name = name
+        self.method = method
+        self.path = path
+        self.body = body
+        self.needs_embeddings = needs_embeddings
+
+    def send(
+        self, session: requests.Session, url: str, rng: random.Random
+    ) -> requests.Response:
+        body = self.body(rng) if self.body else None
+        return session.request(self.method, url + self.path(rng), json=body, timeout=60)
+
+
+class TranscribeScenario(Scenario):
+    """Uploads a new recording of `seconds` of noise and waits for its transcript."""
+
+    def __init__(self, seconds: float):
+        super().__init__("transcribe", "POST", lambda rng: "/api/transcribe")
+        self.seconds = seconds
+
+    def send(self, session, url, rng):
+        n_bytes = int(self.seconds * 16000) * 2
+        header = struct.pack(
+            "<4sI4s4sIHHIIHH4sI",
+            b"RIFF", 36 + n_bytes, b"WAVE", b"fmt ", 16, 1, 1, 16000, 32000, 2, 16,
+            b"data", n_bytes,
+        )  # fmt: skip
+        audio = header + rng.randbytes(n_bytes)
+        response = session.post(
+            f"{url}/api/media",
+            data=audio,
+            headers={"Content-Type": "audio/wav"},
+            timeout=60,
+        )
+        if not response.ok:
+            return response
+        media_id = response.json()["id"]
+        response = session.post(f"{url}/api/transcribe/{media_id}", timeout=60)
+        if response.status_code == 202:
+            job_id = response.json()["id"]
+            while response.ok and response.json()["status"] in ("pending", "running"):
+                time.sleep(0.5)
+                response = session.get(f"{url}/api/transcriptions/{job_id}", timeout=60)
+        if not response.ok:
+            return response
+        # The transcript is missing if the job failed
+        return session.get(f"{url}/api/media/{media_id}/transcript", timeout=60)
+
+
+def scenarios(n_notes: int, n_tags: int, words: list[str], args) -> list[Scenario]:
+    common, rare = words[:50], words[1000:]
+
+    def note(rng: random.Random) -> int:
+        return rng.randint(1, n_notes)
+
+    def query(rng: random.Random) -> str:
+        return " ".join(rng.sample(common, 2) + [rng.choice(rare)])
+
+    page = "n=20&cursor="
+    scenarios = [
+        Scenario("list_notes", "GET", lambda rng: f"/api/notes?sort=modified&{page}"),
+        Scenario("list_notes_counted", "GET", lambda rng: "/api/notes?n=20&page=1"),
+        Scenario("get_note", "GET", lambda rng: f"/api/notes/{note(rng)}"),
+        Scenario(
+            "search_common",
+            "GET",
+            lambda rng: f"/api/notes?q={rng.choice(common)}&sort=relevance&{page}",
+        ),
+        Scenario(
+            "search_rare",
+            "GET",
+            lambda rng: f"/api/notes?q={rng.choice(rare)}&sort=relevance&{page}",
+        ),
+        Scenario(
+            "search_hybrid",
+            "GET",
+            lambda rng: f"/api/notes?q={query(rng)}&mode=hybrid&sort=relevance&n=20",
+            needs_embeddings=True,
+        ),
+        Scenario("list_tags", "GET", lambda rng: "/api/tags"),
+        Scenario(
+            "update_note",
+            "PUT",
+            lambda rng: f"/api/notes/{note(rng)}",
+            lambda rng: {"content": " ".join(rng.choices(common + rare[:200], k=100))},
+        ),
+        Scenario(
+            "chat",
+            "POST",
+            lambda rng: "/api/chat",
+            lambda rng: {"messages": [{"role": "user", "content": query(rng)}]},
+        ),
+        Scenario(
+            "rag",
+            "POST",
+            lambda rng: "/api/rag",
+            lambda rng: {"query": query(rng)},
+            needs_embeddings=True,
+        ),
+        TranscribeScenario(args.audio_seconds),
+    ]
+    if n_tags:
+        scenarios.insert(
+            3,
+            Scenario(
+                "notes_by_tag",
+                "GET",
+                lambda rng: f"/api/notes?tags={rng.randint(1, n_tags)}&{page}",
+            ),
+        )
+    return scenarios
+
+
+def run_scenario(url: str, scenario: Scenario, concurrency: int, duration: float):
+    """Send requests from `concurrency` clients for `duration` seconds."""
+    latencies: list[list[float]] = [[] for _ in range(concurrency)]
+    errors = [0] * concurrency
+    deadline = time.monotonic() + duration
+
+    def client(i: int):
+        rng = random.Random(i)
+        session = requests.Session()
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            try:
+                response = scenario.send(session, url, rng)
+                ok = response.status_code < 400
+            except requests.RequestException:
+                ok = False
+            if ok:
+                latencies[i].append(time.perf_counter() - start)
+            else:
+                errors[i] += 1
+
+    started = time.monotonic()
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    values = sorted(latency for client in latencies for latency in client)
+    ms = lambda value: None if value is None else round(value * 1000, 3)  # noqa: E731
+    return {
+        "requests": len(values),
+        "errors": sum(errors),
+        "throughput": round(len(values) / elapsed, 2),
+        "latency_ms": {
+            "mean": ms(sum(values) / len(values)) if values else None,
+            "p50": ms(percentile(values, 50)),
+            "p95": ms(percentile(values, 95)),
+            "p99": ms(percentile(values, 99)),
+            "max": ms(values[-1]) if values else None,
+        },
+    }
+
+
+def bench_config(base, workdir: str, ports: dict[str, int], args) -> dict[str, Any]:
+    config = json.loads(json.dumps(base))
+    config["settings"]["instance_path"] = os.path.join(workdir, "instance")
+    config["settings"]["background_startup"] = True
+    config["database"]["uri"] = f"sqlite:///{os.path.join(workdir, 'notes.db')}"
+    config["vectors"]["store"] = args.vector_store
+    config["backends"]["log_dir"] = os.path.join(workdir, "logs")
+    config["api"].update(
+        host="127.0.0.1",
+        port=ports["api"],
+        server=args.server,
+        workers=args.workers,
+        threads=args.threads,
+        media_path=os.path.join(workdir, "media"),
+    )
+    for name in ["chromadb", "ollama", "whisper"]:
+        config[name].update(host="127.0.0.1", port=ports[name], external=True)
+    config["whisper"]["extra_ports"] = []
+    return config
+
+
+def write_toml(config: dict[str, Any], path: str):
+    def value(v):
+        if isinstance(v, bool):
+            return "true" if v else "false"
+        if isinstance(v, str):
+            return json.dumps(v)
+        return repr(v)
+
+    with open(path, "w") as f:
+        for section, values in config.items():
+            f.write(f"[{section}]\n")
+            for key, v in values.items():
+                f.write(f"{key} = {value(v)}\n")
+            f.write("\n")
+
+
+def count_notes(path: str) -> int:
+    with contextlib.closing(sqlite3.connect(path)) as conn:
+        (count,) = conn.execute("SELECT COUNT(*) FROM note").fetchone()
+    return count
+
+
+def seeded_database(config, args, n_notes: int) -> str:
+    """The path of a seeded database for a size, created if it is not cached yet."""
+    path = os.path.join(args.cache_dir, f"notes-{n_notes}-{args.tags}-{args.seed}.db")
+    if not os.path.exists(path):
+        os.makedirs(args.cache_dir, exist_ok=True)
+        # Left over from an interrupted run, and seed.py needs a new database
+        for suffix in [".part", ".part-wal", ".part-shm"]:
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+        with tempfile.TemporaryDirectory() as tmp:
+            seed_config = json.loads(json.dumps(config))
+            seed_config["database"]["uri"] = f"sqlite:///{path}.part"
+            seed_config["settings"]["instance_path"] = tmp
+            config_path = os.path.join(tmp, "config.toml")
+            write_toml(seed_config, config_path)
+            subprocess.run(
+                [
+                    sys.executable,
+                    os.path.join(os.path.dirname(__file__), "seed.py"),
+                    config_path,
+                    f"--notes={n_notes}",
+                    f"--tags={args.tags}",
+                    f"--seed={args.seed}",
+                ],
+                cwd=SERVER_DIR,
+                check=True,
+                stdout=subprocess.DEVNULL,
+            )
+        os.replace(f"{path}.part", path)
+    # Databases cached before seed.py left WAL mode are missing their notes
+    count = count_notes(path)
+    if count != n_notes:
+        raise Exception(f"{path} has {count} notes instead of {n_notes}, delete it")
+    return path
+
+
+def wait_for(check: Callable[[], bool], timeout: float) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if check():
+            return True
+        time.sleep(0.1)
+    return False
+
+
+def bench_size(base_config, args, n_notes: int) -> dict[str, Any]:
+    workdir = tempfile.mkdtemp(prefix=f"bench-{n_notes}-")
+    ports = {name: free_port() for name in ["api", "chromadb", "ollama", "whisper"]}
+    config = bench_config(base_config, workdir, ports, args)
+    config_path = os.path.join(workdir, "config.toml")
+    write_toml(config, config_path)
+
+    seed_started = time.monotonic()
+    seeded = seeded_database(config, args, n_notes)
+    shutil.copy(seeded, os.path.join(workdir, "notes.db"))
+    seed_seconds = time.monotonic() - seed_started
+
+    fakes = [
+        FakeOllama(
+            ports["ollama"],
+            latency=args.embed_latency,
+            token_latency=args.token_latency,
+            dim=args.dim,
+        ).start(),
+        FakeChroma(ports["chromadb"], latency=args.chroma_latency).start(),
+        FakeWhisper(ports["whisper"], realtime_factor=args.whisper_rtf).start(),
+    ]
+    url = f"http://127.0.0.1:{ports['api']}"
+    log = open(os.path.join(workdir, "server.log"), "w")
+    started = time.monotonic()
+    server = subprocess.Popen(
+        [sys.executable, "run.py", config_path],
+        cwd=SERVER_DIR,
+        stdout=log,
+        stderr=subprocess.STDOUT,
+    )
+    result: dict[str, Any] = {"notes": n_notes, "tags": args.tags}
+    try:
+
+        def up():
+            try:
+                return requests.get(f"{url}/api/health", timeout=1).ok
+            except requests.RequestException:
+                return False
+
+        # Stop waiting early if the server exits, e.g. on a configuration error
+        if not wait_for(lambda: server.poll() is not None or up(), 600) or not up():
+            raise Exception(f"The server did not start, see {log.name}")
+        startup_seconds = time.monotonic() - started
+
+        progress: dict[str, Any] = {}
+
+        def ready():
+            status = requests.get(f"{url}/api/health/ready", timeout=5).json()
+            progress.update(status["jobs"]["embeddings"].get("progress") or {})
+            return status["ready"]
+
+        is_ready = wait_for(ready, args.ready_timeout)
+        ready_seconds = time.monotonic() - started - startup_seconds
+        result["startup"] = {
+            "seed_or_copy_seconds": round(seed_seconds, 3),
+            "startup_seconds": round(startup_seconds, 3),
+            "backfill_seconds": round(ready_seconds, 3) if is_ready else None,
+            "backfill_progress": progress,
+            "backfill_notes_per_second": round(
+                progress.get("done", 0) / max(ready_seconds, 1e-9), 2
+            ),
+        }
+
+        words = vocabulary(random.Random(args.seed))
+        result["endpoints"] = {}
+        for scenario in scenarios(n_notes, args.tags, words, args):
+            if args.only and scenario.name not in args.only:
+                continue
+            if scenario.needs_embeddings and not is_ready:
+                skipped = {"skipped": "backfill not finished"}
+                result["endpoints"][scenario.name] = skipped
+                continue
+            result["endpoints"][scenario.name] = run_scenario(
+                url, scenario, args.concurrency, args.duration
+            )
+            if not result["endpoints"][scenario.name]["requests"]:
+                raise Exception(f"Every request of {scenario.name} failed, see {log.name}")
+            print(
+                f"{n_notes} notes, {scenario.name}: "
+                f"{json.dumps(result['endpoints'][scenario.name])}",
+                file=sys.stderr,
+            )
+        result["backend_requests"] = {
+            type(fake).__name__: fake.requests for fake in fakes
+        }
+    except BaseException:
+        # The server log is kept to see what went wrong
+        args.keep = True
+        raise
+    finally:
+        server.terminate()
+        try:
+            server.wait(30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+        log.close()
+        for fake in fakes:
+            fake.stop()
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return result
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=SERVER_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--config", default=os.path.join(SERVER_DIR, "config.toml"))
+    parser.add_argument("--sizes", default="1k", help="e.g. 1k,100k,1m")
+    parser.add_argument("--tags", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--only", type=lambda s: s.split(","), help="scenario names")
+    parser.add_argument(
+        "--server", default="gunicorn", choices=["gunicorn", "development"]
+    )
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument(
+        "--vector-store", default="chromadb", choices=["chromadb", "local"]
+    )
+    parser.add_argument("--embed-latency", type=float, default=0.005)
+    parser.add_argument("--token-latency", type=float, default=0.001)
+    parser.add_argument("--chroma-latency", type=float, default=0.001)
+    parser.add_argument("--whisper-rtf", type=float, default=0.05)
+    parser.add_argument("--audio-seconds", type=float, default=60.0)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--ready-timeout", type=float, default=300.0)
+    parser.add_argument(
+        "--cache-dir",
+        default=os.path.join(tempfile.gettempdir(), "ai-notes-bench"),
+        help="where seeded databases are kept between runs",
+    )
+    parser.add_argument("--keep", action="store_true", help="keep the work directories")
+    parser.add_argument("--output", help="write the results to a file, not stdout")
+    args = parser.parse_args()
+
+    with open(args.config, "rb") as f:
+        base_config = tomllib.load(f)
+
+    results = {
+        "benchmark": "load_test",
+        "commit": git_commit(),
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "parameters": {
+            key: value
+            for key, value in vars(args).items()
+            if key not in ("config", "output")
+        },
+        "sizes": [
+            bench_size(base_config, args, parse_size(size))
+            for size in args.sizes.split(",")
+        ],
+    }
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""Create a database with synthetic notes and tags for benchmarks.
+
+Notes are made of words from a fixed vocabulary with a skewed distribution, so that
+searches for common words match many notes and searches for rare words match few. The
+same arguments always produce the same database.
+
+Usage: python bench/seed.py CONFIG --notes 100000 [--tags 100] [--seed 0]
+
+The database is created at the `database.uri` of the config file, which must not exist.
+"""
+
+import argparse
+import contextlib
+import datetime
+import os
+import random
+import sqlite3
+import sys
+import tomllib
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+VOCABULARY_SIZE = 5000
+BATCH_SIZE = 10000
+
+
+def vocabulary(rng: random.Random) -> list[str]:
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    words = set()
+    while len(words) < VOCABULARY_SIZE:
+        words.add("".join(rng.choices(letters, k=rng.randint(3, 9))))
+    return sorted(words)
+
+
+def seed(config, n_notes: int, n_tags: int, seed: int = 0):
+    import src
+
+    server = src.Server(config)
+    src._server = server
+    from src import db_model
+    from src.db_model import Note, NoteTag, Tag
+    from src.search import get_search_index
+
+    rng = random.Random(seed)
+    words = vocabulary(rng)
+    # Zipf-like weights, the first words are by far the most common
+    weights = [1 / (rank + 1) for rank in range(len(words))]
+    start = datetime.datetime(2020, 1, 1)
+
+    with server.app.app_context():
+        db = server.db
+        db.create_all()
+        db_model.create_indexes()
+        with db.engine.begin() as conn:
+            conn.execute(
+                Tag.__table__.insert(),
+                [
+                    {"name": f"tag-{i}", "color": f"#{rng.randrange(0x1000000):06x}"}
+                    for i in range(n_tags)
+                ],
+            )
+        for offset in range(0, n_notes, BATCH_SIZE):
+            notes, note_tags = [], []
+            for id in range(offset + 1, min(offset + BATCH_SIZE, n_notes) + 1):
+                created = start + datetime.timedelta(minutes=id)
+                modified = created + datetime.timedelta(hours=rng.randrange(1000))
+                content = rng.choices(words, weights, k=rng.randint(20, 400))
+                notes.append(
+                    {
+                        "id": id,
+                        "title": " ".join(rng.choices(words, weights, k=3)).title(),
+                        "content": " ".join(content),
+                        "created_at": created,
+                        "last_modified": modified,
+                        "last_opened": modified if rng.random() < 0.5 else None,
+                    }
+                )
+                if n_tags:
+                    for tag_id in rng.sample(range(1, n_tags + 1), rng.randint(0, 3)):
+                        note_tags.append({"note_id": id, "tag_id": tag_id})
+            with db.engine.begin() as conn:
+                conn.execute(Note.__table__.insert(), notes)
+                if note_tags:
+                    conn.execute(NoteTag.__table__.insert(), note_tags)
+            print(f"Seeded {offset + len(notes)}/{n_notes} notes", flush=True)
+        # Built after the notes are inserted, which indexes them all at once
+        get_search_index(db).setup()
+        path = db.engine.url.database
+        db.engine.dispose()
+    # The server writes through a write-ahead log, which the database file is only
+    # complete without once it is folded back in. Leaving WAL mode does that, and keeps
+    # the file complete on its own when it is copied for a benchmark
+    with contextlib.closing(sqlite3.connect(path)) as conn:
+        conn.execute("PRAGMA journal_mode=DELETE")
+    return words
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("config")
+    parser.add_argument("--notes", type=int, required=True)
+    parser.add_argument("--tags", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    with open(args.config, "rb") as f:
+        config = tomllib.load(f)
+    seed(config, args.notes, args.tags, args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,28 @@
+import os
+
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy.pool import NullPool
 from flask_cors import CORS
 
 from .backends import ChromadbClient, OllamaClient, WhisperClient, BackendManager
+from .cache import EmbeddingCache
+from .database import engine_options, tune_sqlite, wait_for_writes_on_fork
+from .embeddings import EmbeddingBackfill, EmbeddingQueue
+from .jobs import BackgroundJob
+from .metrics import install_request_metrics
+from .querycount import install_query_count_header
+from .rag import Retriever
+from .search import HybridSearch, get_search_index
+from .summaries import Summarizer
+from .transcription import TranscriptionQueue
+from .transport import BackendUnavailable
+from .vectorstore import LocalVectorStore, VectorStore
+from .wsgi import serve_gunicorn
+
+
+def backend_unavailable(e: BackendUnavailable):
+    """Answer requests that need a backend whose circuit is open, from any route."""
+    return {"error": str(e)}, 503
 
 
 class Server:
@@ -11,60 +30,131 @@ class Server:
 
     def __init__(self, config):
         self.config = config
-        self.app = Flask(__name__)
+        self.app = Flask(
+            __name__, instance_path=os.path.abspath(config["settings"]["instance_path"])
+        )
         self.app.config["SQLALCHEMY_DATABASE_URI"] = config["database"]["uri"]
         self.app.config["FLASK_ADMIN_SWATCH"] = "cerulean"
         self.app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
         self.app.config["SECRET_KEY"] = "super secret key"
+        # Larger request bodies are rejected before they are read
+        self.app.config["MAX_CONTENT_LENGTH"] = config["api"]["max_upload_size"]
 
         CORS(self.app)
-        self.db = SQLAlchemy(self.app, engine_options={"poolclass": NullPool})
+        self.app.register_error_handler(BackendUnavailable, backend_unavailable)
+        self.db = SQLAlchemy(self.app, engine_options=engine_options(config["database"]))
+        with self.app.app_context():
+            for engine in self.db.engines.values():
+                tune_sqlite(engine, config["database"])
+                # The master writes from background threads while gunicorn forks workers
+                wait_for_writes_on_fork(engine)
+        # Forked worker processes must not share the parent's database connections
+        os.register_at_fork(after_in_child=self._dispose_engines)
+        if config["settings"]["debug"]:
+            install_query_count_header(self.app)
+
+        self.jobs: dict[str, BackgroundJob] = {}
+        """Startup jobs by name, used to report readiness."""
+
+        self.backfill = EmbeddingBackfill(self)
+        self.embedding_queue = EmbeddingQueue(self)
+        self.summarizer = Summarizer(self)
+        self.retriever = Retriever(self)
+        self.transcription_queue = TranscriptionQueue(self)
 
     def run(self):
         """Spin up the backends and start the server."""
         with BackendManager(self.config):
-            self.chromadb_client = ChromadbClient(self.config["chromadb"])
-            self.ollama_client = OllamaClient(self.config["ollama"])
-            self.whisper_client = WhisperClient(self.config["whisper"])
-
-            # Expose the routes for the api
-            from . import routes
-
-            # Make sure the database is created and all notes are embedded
-            with self.app.app_context():
-                self.db.create_all()
-                self.ensure_embedded()
+            self.setup()
+
+            # Pull the models and embed all notes, either before serving or in the
+            # background while the CRUD routes are already available
+            self.create_startup_jobs()
+            self.embedding_queue.start()
+            self.transcription_queue.start()
+            for job in self.jobs.values():
+                if self.config["settings"]["background_startup"]:
+                    job.start()
+                else:
+                    job.run()
 
             # Start the server
-            self.app.run(
-                host=self.config["api"]["host"],
-                port=self.config["api"]["port"],
-                debug=self.config["settings"]["debug"],
+            if self.config["api"]["server"] == "gunicorn":
+                serve_gunicorn(self.app, self.config["api"])
+            else:
+                self.app.run(
+                    host=self.config["api"]["host"],
+                    port=self.config["api"]["port"],
+                    debug=self.config["settings"]["debug"],
+                )
+
+    def setup(self):
+        """Create the backend clients and the database, and register the routes."""
+        self.vector_store = self.create_vector_store()
+        self.embedding_cache = EmbeddingCache(
+            os.path.join(self.app.instance_path, "embedding-cache.sqlite3"),
+            self.config["ollama"]["embed_model"],
+            self.config["embeddings"]["cache_size"],
+        )
+        self.ollama_client = OllamaClient(
+            self.client_config("ollama"), self.embedding_cache
+        )
+        self.whisper_client = WhisperClient(self.client_config("whisper"))
+
+        # Make sure the database and the search index are created. The models must
+        # be imported first so that create_all knows about their tables.
+        from . import db_model
+
+        with self.app.app_context():
+            self.db.create_all()
+            db_model.add_missing_columns()
+            db_model.create_indexes()
+            self.search_index = get_search_index(self.db)
+            self.search_index.setup()
+        self.hybrid_search = HybridSearch(self)
+
+        # Expose the routes for the api
+        from . import routes
+
+        install_request_metrics(self.app)
+
+    def client_config(self, name: str):
+        """The config of a backend, with the [http] settings it does not override."""
+        return {**self.config["http"], **self.config[name]}
+
+    def create_vector_store(self) -> VectorStore:
+        """Create the configured store for note embeddings."""
+        store = self.config["vectors"]["store"]
+        if store == "chromadb":
+            return ChromadbClient(self.client_config("chromadb"))
+        if store == "local":
+            return LocalVectorStore(
+                os.path.join(self.app.instance_path, "vectors"),
+                self.config["vectors"]["ann_threshold"],
             )
+        raise ValueError(f"Unknown vector store '{store}'")
+
+    def _dispose_engines(self):
+        with self.app.app_context():
+            for engine in self.db.engines.values():
+                engine.dispose(close=False)
+
+    def create_startup_jobs(self):
+        """Create the jobs that must finish before the semantic routes are usable."""
+        chat_model = BackgroundJob("chat_model", self.ollama_client.pull_chat_model)
+        embed_model = BackgroundJob("embed_model", self.ollama_client.pull_embed_model)
+        embeddings = BackgroundJob(
+            "embeddings",
+            self.ensure_embedded,
+            depends_on=[embed_model],
+            progress=lambda: {"done": self.backfill.done, "total": self.backfill.total},
+        )
+        self.jobs = {job.name: job for job in [chat_model, embed_model, embeddings]}
 
     def ensure_embedded(self):
-        """Ensure that all notes are embedded in the ChromaDB database."""
-
-        # Import Note here to avoid circular import with db_model
-        from .db_model import Note
-
-        regenerate_embeddings = self.config["settings"]["regenerate_embeddings"]
-        if regenerate_embeddings:
-            print("Clearing all embeddings")
-            self.chromadb_client.clear()
-
-        ids = []
-        docs = []
-        embeddings = []
-        for note in Note.query.all():
-            if regenerate_embeddings or self.chromadb_client.get(str(note.id)) is None:
-                ids.append(str(note.id))
-                doc = f"{note.title}\n{note.content}"
-                docs.append(doc)
-                embeddings.append(self.ollama_client.embed(doc))
-                print(f"Embedded note {note.id} ({note.title})")
-        if ids:
-            self.chromadb_client.add(ids, docs, embeddings)
+        """Ensure that all notes are embedded in the vector store."""
+        with self.app.app_context():
+            self.backfill.run(regenerate=self.config["settings"]["regenerate_embeddings"])
 
 
 _server: Server | None = None
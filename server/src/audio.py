@@ -0,0 +1,224 @@
+from itertools import chain
+import struct
+import subprocess
+import tempfile
+import threading
+from typing import IO, Iterable, Iterator
+import uuid
+
+import numpy as np
+
+__all__ = [
+    "SAMPLE_RATE",
+    "decode_pcm",
+    "decode_pcm_to_file",
+    "read_chunks",
+    "pcm_segments",
+    "wav_header",
+    "MultipartBody",
+]
+
+SAMPLE_RATE = 16000
+"""The sample rate whisper.cpp expects, in Hz. Audio is decoded to mono 16-bit PCM."""
+
+_CHUNK_SIZE = 64 * 1024
+
+
+def decode_pcm(path: str, max_duration: float | None = None) -> Iterator[bytes]:
+    """Decode any audio or video file that ffmpeg can read to mono 16-bit PCM at 16 kHz.
+
+    The samples are yielded in chunks as ffmpeg produces them, so nothing is written to
+    disk and the whole recording is never held in memory. Recordings longer than
+    `max_duration` seconds raise an exception once decoding gets past that point.
+    """
+    command = ["ffmpeg", "-nostdin", "-loglevel", "error", "-i", path]
+    command += ["-vn", "-ac", "1", "-ar", str(SAMPLE_RATE), "-f", "s16le", "-"]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    # ffmpeg blocks once the stderr pipe is full, so its errors are read on a thread
+    errors: list[bytes] = []
+    reader = threading.Thread(
+        target=lambda: errors.append(process.stderr.read()),  # type: ignore
+        daemon=True,
+    )
+    reader.start()
+    max_bytes = None if max_duration is None else 2 * int(max_duration * SAMPLE_RATE)
+    size = 0
+    try:
+        while chunk := process.stdout.read(_CHUNK_SIZE):  # type: ignore
+            size += len(chunk)
+            if max_bytes is not None and size > max_bytes:
+                raise Exception(
+                    f"{path} is longer than the maximum of {max_duration:g} seconds"
+                )
+            yield chunk
+        process.wait()
+        reader.join()
+        if process.returncode != 0:
+            lines = b"".join(errors).decode(errors="replace").strip().splitlines()
+            error = lines[-1] if lines else f"ffmpeg exited with {process.returncode}"
+            raise Exception(f"Failed to decode {path}: {error}")
+    finally:
+        # Stop ffmpeg when decoding fails or the caller stops reading early
+        if process.poll() is None:
+            process.kill()
+        process.wait()
+        process.stdout.close()  # type: ignore
+
+
+def decode_pcm_to_file(path: str, max_duration: float | None = None) -> IO[bytes]:
+    """Decode like `decode_pcm` into an anonymous temporary file, for uploads that need
+    the length of the PCM before they start. The file is returned at its start."""
+    f = tempfile.TemporaryFile()
+    try:
+        for chunk in decode_pcm(path, max_duration):
+            f.write(chunk)
+        f.seek(0)
+    except BaseException:
+        f.close()
+        raise
+    return f
+
+
+def read_chunks(f: IO[bytes]) -> Iterator[bytes]:
+    """Read a file in chunks, closing it once it has been read or the caller stops."""
+    with f:
+        while chunk := f.read(_CHUNK_SIZE):
+            yield chunk
+
+
+def _quietest_cut(buffer: bytearray, begin: int, segment: int, search: float) -> int:
+    """The sample offset in `buffer` of the quietest 20 ms frame in the last `search`
+    seconds of the `segment` samples that start at sample `begin`."""
+    samples = np.frombuffer(buffer, dtype=np.int16, count=len(buffer) // 2)
+    frame = SAMPLE_RATE // 50
+    end = begin + segment
+    # Never search the first half of a segment, so that segments do not get too short
+    start = max(begin + segment // 2, end - int(search * SAMPLE_RATE))
+    n_frames = (end - start) // frame
+    if n_frames == 0:
+        # The search window is shorter than a frame, so cut at the longest length
+        return end
+    window = samples[start : start + n_frames * frame].astype(np.float32)
+    energy = np.square(window).reshape(n_frames, frame).mean(axis=1)
+    return start + int(np.argmin(energy)) * frame + frame // 2
+
+
+def pcm_segments(
+    chunks: Iterable[bytes],
+    segment_duration: float,
+    overlap: float,
+    search: float = 5.0,
+) -> Iterator[tuple[int, int, bytes]]:
+    """Cut streamed PCM from `decode_pcm` into segments of at most `segment_duration`
+    seconds.
+
+    Each cut is placed at the quietest 20 ms frame in the last `search` seconds before
+    the segment would get too long, so that cuts fall between words where possible, and
+    each segment starts `overlap` seconds before its cut. Yields the sample offsets of
+    the start of each segment and of its cut, and its PCM. Only the segment that is
+    being cut is held in memory.
+    """
+    # Segments of less than a frame would never get past their cut
+    segment = max(int(segment_duration * SAMPLE_RATE), SAMPLE_RATE // 50)
+    overlap_samples = int(overlap * SAMPLE_RATE)
+    buffer = bytearray()
+    start = cut = 0
+    for chunk in chunks:
+        buffer += chunk
+        while len(buffer) // 2 - (cut - start) > segment:
+            next_cut = start + _quietest_cut(buffer, cut - start, segment, search)
+            yield start, cut, bytes(buffer[: 2 * (next_cut - start)])
+            next_start = max(next_cut - overlap_samples, 0)
+            del buffer[: 2 * (next_start - start)]
+            start, cut = next_start, next_cut
+    yield start, cut, bytes(buffer[: len(buffer) // 2 * 2])
+
+
+def wav_header(n_bytes: int) -> bytes:
+    """The header of a WAV file holding `n_bytes` of the PCM produced by `decode_pcm`."""
+    channels, sample_width = 1, 2
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF",
+        36 + n_bytes,
+        b"WAVE",
+        b"fmt ",
+        16,  # size of the fmt chunk
+        1,  # PCM
+        channels,
+        SAMPLE_RATE,
+        SAMPLE_RATE * channels * sample_width,
+        channels * sample_width,
+        8 * sample_width,
+        b"data",
+        n_bytes,
+    )
+
+
+class MultipartBody:
+    """A multipart/form-data request body whose file content is read from an iterable.
+
+    Unlike the bodies `requests` builds for `files=`, the file content is not copied into
+    one buffer first, so it can be streamed from a decoder. The body has a known length,
+    so `requests` sends it with a Content-Length and reads it piece by piece while
+    uploading. The content must add up to exactly `content_length` bytes.
+    """
+
+    def __init__(
+        self,
+        fields: dict[str, str],
+        file_field: str,
+        filename: str,
+        content_type: str,
+        content: Iterable[bytes | memoryview],
+        content_length: int,
+    ):
+        boundary = uuid.uuid4().hex
+        self.content_type = f"multipart/form-data; boundary={boundary}"
+        head = "".join(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n'
+            f"{value}\r\n"
+            for name, value in fields.items()
+        )
+        head += (
+            f"--{boundary}\r\n"
+            f'Content-Disposition: form-data; name="{file_field}"; filename="{filename}"\r\n'
+            f"Content-Type: {content_type}\r\n\r\n"
+        )
+        tail = f"\r\n--{boundary}--\r\n".encode()
+        self._length = len(head.encode()) + content_length + len(tail)
+        self._chunks = chain(
+            [head.encode()], self._checked(content, content_length), [tail]
+        )
+        self._buffer = memoryview(b"")
+
+    @staticmethod
+    def _checked(content: Iterable[bytes | memoryview], length: int):
+        size = 0
+        for chunk in content:
+            size += len(chunk)
+            if size > length:
+                break
+            yield chunk
+        if size != length:
+            raise Exception(f"File content has {size} bytes instead of {length}")
+
+    def __len__(self) -> int:
+        return self._length
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            size = self._length
+        pieces = []
+        while size > 0:
+            if not self._buffer:
+                chunk = next(self._chunks, None)
+                if chunk is None:
+                    break
+                self._buffer = memoryview(chunk)
+                continue
+            piece = self._buffer[:size]
+            pieces.append(piece.tobytes())
+            size -= len(piece)
+            self._buffer = self._buffer[len(piece) :]
+        return b"".join(pieces)
@@ -1,13 +1,39 @@
 from abc import ABC
-import tempfile
+from concurrent.futures import (
+    ALL_COMPLETED,
+    FIRST_COMPLETED,
+    Future,
+    ThreadPoolExecutor,
+    wait,
+)
 import chromadb
+from chromadb.api.client import SharedSystemClient
 from ollama import Client as _OllamaClient
-import os
 import requests
+from itertools import chain
+import logging
+from logging.handlers import RotatingFileHandler
+import os
+import queue
 import subprocess
 import sys
+import threading
 import time
-from typing import Any, Mapping, Sequence
+from typing import Any, Callable, Iterable, Iterator, Mapping, Sequence
+
+from .audio import (
+    SAMPLE_RATE,
+    MultipartBody,
+    decode_pcm,
+    decode_pcm_to_file,
+    pcm_segments,
+    read_chunks,
+    wav_header,
+)
+from .cache import EmbeddingCache
+from .metrics import timed
+from .transport import HttpxTransport, RequestsTransport, TransportPolicy, probe
+from .vectorstore import VectorStore
 
 __all__ = [
     "ChromadbBackend",
@@ -21,7 +47,13 @@ __all__ = [
 
 
 class Backend(ABC):
-    """Abstract base class for backend services."""
+    """Abstract base class for backend services.
+
+    A started backend is supervised: its output is written to a rotating log file, and
+    if it exits without being stopped, it is restarted after a delay that doubles with
+    every crash, up to `max_restart_backoff` seconds. The delay is reset once the
+    backend has stayed up for that long.
+    """
 
     name: str
     """The name of the backend service."""
@@ -32,13 +64,126 @@ class Backend(ABC):
     port: int
     """The port of the backend service."""
 
-    def start(self) -> None:
-        """Start the backend service."""
+    process: subprocess.Popen | None = None
+    """The running process of the backend service."""
+
+    def __init__(self, config):
+        self.host = config["host"]
+        self.port = config["port"]
+        self.log_path = os.path.join(config["log_dir"], f"{self.name}-{self.port}.log")
+        self.log_max_bytes: int = config["log_max_bytes"]
+        self.log_backups: int = config["log_backups"]
+        self.stop_timeout: float = config["stop_timeout"]
+        self.restart_backoff: float = config["restart_backoff"]
+        self.max_restart_backoff: float = config["max_restart_backoff"]
+        self.restarts = 0
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+
+    def command(self) -> list[str]:
+        """The command that runs the backend service."""
         raise NotImplementedError
 
+    def env(self) -> dict[str, str] | None:
+        """The environment of the backend service, or None to inherit the server's."""
+        return None
+
+    def start(self) -> None:
+        """Start the backend service and restart it whenever it exits."""
+        self._stopping.clear()
+        self._launch()
+        threading.Thread(
+            target=self._supervise, name=f"{self.name}-supervisor", daemon=True
+        ).start()
+
     def stop(self) -> None:
-        """Stop the backend service."""
-        raise NotImplementedError
+        """Stop the backend service, and kill it if it does not exit within
+        `stop_timeout` seconds."""
+        with self._lock:
+            self._stopping.set()
+            process = self.process
+        if process is None or process.poll() is not None:
+            return
+        process.terminate()
+        try:
+            process.wait(self.stop_timeout)
+        except subprocess.TimeoutExpired:
+            print(f"{self.name} did not stop within {self.stop_timeout}s, killing it")
+            process.kill()
+            process.wait()
+
+    def wait_until_alive(self, timeout: float) -> bool:
+        """Wait until the backend service answers, for at most `timeout` seconds."""
+        deadline = time.monotonic() + timeout
+        while not self.alive():
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.2)
+        return True
+
+    def _launch(self):
+        with self._lock:
+            if self._stopping.is_set():
+                return
+            # Both streams go to one pipe, which is always drained so the backend never
+            # blocks on a full pipe
+            self.process = subprocess.Popen(
+                self.command(),
+                env=self.env(),
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+            )
+        threading.Thread(
+            target=self._drain,
+            args=(self.process.stdout,),
+            name=f"{self.name}-output",
+            daemon=True,
+        ).start()
+
+    def _drain(self, stream):
+        logger = self._logger()
+        with stream:
+            for line in stream:
+                logger.info(line.decode(errors="replace").rstrip())
+
+    def _logger(self) -> logging.Logger:
+        logger = logging.getLogger(f"backends.{self.name}.{self.port}")
+        if not logger.handlers:
+            os.makedirs(os.path.dirname(self.log_path) or ".", exist_ok=True)
+            handler = RotatingFileHandler(
+                self.log_path,
+                maxBytes=self.log_max_bytes,
+                backupCount=self.log_backups,
+            )
+            handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+            logger.addHandler(handler)
+            logger.setLevel(logging.INFO)
+            # Backend output only goes to its own log file
+            logger.propagate = False
+        return logger
+
+    def _supervise(self):
+        backoff = self.restart_backoff
+        while True:
+            started = time.monotonic()
+            code = self.process.wait()  # type: ignore
+            if self._stopping.is_set():
+                return
+            if time.monotonic() - started >= self.max_restart_backoff:
+                backoff = self.restart_backoff
+            print(
+                f"{self.name} exited with code {code}, restarting it in {backoff:g}s "
+                f"(see {self.log_path})"
+            )
+            if self._stopping.wait(backoff):
+                return
+            try:
+                self._launch()
+                self.restarts += 1
+            except Exception as e:
+                print(f"Failed to restart {self.name}: {e}")
+            backoff = min(backoff * 2, self.max_restart_backoff)
 
     @classmethod
     def _alive(cls, host: str, port: int) -> bool:
@@ -53,120 +198,259 @@ class Backend(ABC):
 ### ChromaDB ###
 
 
-class ChromadbClient:
+class ChromadbClient(VectorStore):
+    """Vector store in a Chroma server.
+
+    Each call of the Chroma client goes through a `TransportPolicy`, under the method
+    and path of the request it sends. Chroma's client pools its own connections and
+    sets no timeouts, so only the retries and the circuit breaker apply.
+    """
+
     def __init__(self, config):
         self.host = config["host"]
         self.port = config["port"]
+        self.collection_name = "note-content"
+        self.embedding_function = None
+        self.metadata = {"hnsw:space": "l2"}
+        # All the operations used here can be repeated safely
+        self.policy = TransportPolicy(
+            "chromadb",
+            config,
+            {"": None},
+            idempotent_posts=("/collections", "/upsert", "/get", "/query", "/delete"),
+        )
+        self._connect()
+
+        # Forked worker processes must not share the parent's HTTP connections
+        os.register_at_fork(after_in_child=self._reconnect)
+
+    def _connect(self):
         self.client = chromadb.HttpClient(
             host=self.host,
             port=self.port,
         )
+        self.collection = self._call(
+            "POST",
+            "/collections",
+            lambda: self.client.create_collection(
+                name=self.collection_name,
+                get_or_create=True,
+                embedding_function=self.embedding_function,
+                metadata=self.metadata,
+            ),
+        )
 
-        self.collection_name = "note-content"
-        self.embedding_function = None
-        self.metadata = {"hnsw:space": "l2"}
-        self.collection = self.client.create_collection(
-            name=self.collection_name,
-            get_or_create=True,
-            embedding_function=self.embedding_function,
-            metadata=self.metadata,
+    def _reconnect(self):
+        # Chroma caches clients per host, so the cache has to go too
+        SharedSystemClient.clear_system_cache()
+        self._connect()
+
+    def _call(self, method: str, path: str, call: Callable[[], Any]) -> Any:
+        """Make a call of the Chroma client that sends a request to `path`.
+
+        Chroma turns error responses into exceptions without their status, so only
+        failures to connect and timeouts are retried.
+        """
+        return self.policy.call(
+            method,
+            path,
+            call,
+            status=lambda result: 200,
+            close=lambda result: None,
+            transient=(requests.ConnectionError, requests.Timeout),
         )
 
-    def add(self, ids: list[str], docs: list[str], embeddings: list[Sequence[float]]):
-        self.collection.upsert(ids=ids, documents=docs, embeddings=embeddings)
+    @timed("chromadb", "add")
+    def add(
+        self,
+        ids: list[str],
+        docs: list[str],
+        embeddings: list[Sequence[float]],
+        metadatas: list[dict[str, Any]] | None = None,
+    ):
+        self._call(
+            "POST",
+            "/upsert",
+            lambda: self.collection.upsert(
+                ids=ids, documents=docs, embeddings=embeddings, metadatas=metadatas  # type: ignore
+            ),
+        )
 
+    @timed("chromadb", "remove")
     def remove(self, ids: list[str]):
-        self.collection.delete(ids=ids)
+        self._call("POST", "/delete", lambda: self.collection.delete(ids=ids))
+
+    @timed("chromadb", "remove_notes")
+    def remove_notes(self, note_ids: list[int]):
+        self._call(
+            "POST",
+            "/delete",
+            lambda: self.collection.delete(where={"note_id": {"$in": note_ids}}),
+        )
 
+    @timed("chromadb", "clear")
     def clear(self):
-        self.client.delete_collection(self.collection_name)
-        self.collection = self.client.create_collection(
-            name=self.collection_name,
-            embedding_function=self.embedding_function,
-            metadata=self.metadata,
+        self._call(
+            "DELETE",
+            f"/collections/{self.collection_name}",
+            lambda: self.client.delete_collection(self.collection_name),
+        )
+        self.collection = self._call(
+            "POST",
+            "/collections",
+            lambda: self.client.create_collection(
+                name=self.collection_name,
+                get_or_create=True,
+                embedding_function=self.embedding_function,
+                metadata=self.metadata,
+            ),
         )
 
-    def query(
+    @timed("chromadb", "query")
+    def query_chunks(
         self,
         query_embedding: Sequence[float],
         n_results: int = 10,
         max_distance: float | None = None,
-    ) -> tuple[list[int], list[float]]:
-        result = self.collection.query(
-            query_embeddings=[query_embedding],
-            n_results=n_results,
-            include=["distances"],
+    ) -> list[tuple[int, str, float]]:
+        result = self._call(
+            "POST",
+            "/query",
+            lambda: self.collection.query(
+                query_embeddings=[query_embedding],  # type: ignore
+                n_results=n_results,
+                include=["documents", "distances", "metadatas"],  # type: ignore
+            ),
         )
-        ids: list[int] = []
-        distances: list[float] = []
-        for id, distance in zip(result["ids"][0], result["distances"][0]):  # type: ignore
+        chunks: list[tuple[int, str, float]] = []
+        for doc, metadata, distance in zip(
+            result["documents"][0], result["metadatas"][0], result["distances"][0]  # type: ignore
+        ):
             if max_distance is not None and distance > max_distance:
                 break
-            ids.append(int(id))
-            distances.append(distance)
-        return ids, distances
+            if metadata and "note_id" in metadata:
+                chunks.append((int(metadata["note_id"]), doc, distance))  # type: ignore
+        return chunks
+
+    @timed("chromadb", "note_chunk_ids")
+    def note_chunk_ids(
+        self, note_ids: list[int] | None = None
+    ) -> dict[int | None, set[str]]:
+        where = None if note_ids is None else {"note_id": {"$in": note_ids}}
+        result = self._call(
+            "POST",
+            "/get",
+            lambda: self.collection.get(where=where, include=["metadatas"]),  # type: ignore
+        )
+        chunk_ids: dict[int | None, set[str]] = {}
+        for id, metadata in zip(result["ids"], result["metadatas"]):  # type: ignore
+            note_id = metadata.get("note_id") if metadata else None
+            chunk_ids.setdefault(note_id, set()).add(id)  # type: ignore
+        return chunk_ids
 
+    @timed("chromadb", "get")
     def get(self, id: str) -> Sequence[float] | None:
-        hit = self.collection.get(id, include=["embeddings"])["embeddings"]
+        hit = self._call(
+            "POST",
+            "/get",
+            lambda: self.collection.get(id, include=["embeddings"]),  # type: ignore
+        )["embeddings"]
         return hit[0] if hit else None
 
     def alive(self):
-        try:
-            self.client.heartbeat()
-            return True
-        except Exception:
-            return False
+        return probe(f"http://{self.host}:{self.port}/api/v1/heartbeat")
 
 
 class ChromadbBackend(Backend):
-
-    def __init__(self, config):
-        self.name = "chromadb"
-        self.host = config["host"]
-        self.port = config["port"]
-
-    def start(self):
-        self.process = subprocess.Popen(
-            [
-                # fmt: off
-                sys.executable, "-m", "chromadb.cli.cli", "run", 
-                "--path", "./instance", 
-                "--host", self.host, 
-                "--port", f"{self.port}",
-                # fmt: on
-            ],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-        )
-
-    def stop(self):
-        self.process.terminate()
+    name = "chromadb"
+
+    def command(self):
+        return [
+            # fmt: off
+            sys.executable, "-m", "chromadb.cli.cli", "run", 
+            "--path", "./instance", 
+            "--host", self.host, 
+            "--port", f"{self.port}",
+            # fmt: on
+        ]
 
     @classmethod
     def _alive(cls, host: str, port: int):
-        try:
-            requests.get(f"http://{host}:{port}/api/v1").raise_for_status()
-            return True
-        except Exception:
-            return False
+        return probe(f"http://{host}:{port}/api/v1")
 
 
 ### Ollama ###
 
 
 class OllamaClient:
-    def __init__(self, config):
+    def __init__(self, config, embedding_cache: EmbeddingCache | None = None):
         self.config = config
-        self.client = _OllamaClient(f"{config['host']}:{config['port']}")
+        self.embedding_cache = embedding_cache
         self.chat_model = config["chat_model"]
         self.embed_model = config["embed_model"]
+        # Embeddings are cheap and can be repeated, chats are slow and pulls take as long
+        # as the download
+        self.policy = TransportPolicy(
+            "ollama",
+            config,
+            {
+                "": config["read_timeout"],
+                "/api/embeddings": config["embed_timeout"],
+                "/api/pull": None,
+            },
+            idempotent_posts=("/api/embeddings",),
+        )
+        self._connect()
+
+        # Forked worker processes must not share the parent's HTTP connections
+        os.register_at_fork(after_in_child=self._connect)
+
+    def _connect(self):
+        self.client = _OllamaClient(
+            f"{self.config['host']}:{self.config['port']}",
+            transport=HttpxTransport(self.policy),
+        )
+
+    @timed("ollama", "pull")
+    def pull_chat_model(self):
         self.client.pull(self.chat_model)
+
+    @timed("ollama", "pull")
+    def pull_embed_model(self):
         self.client.pull(self.embed_model)
 
+    @timed("ollama", "chat")
     def chat(self, messages: Sequence[Mapping[str, Any]]) -> Mapping[str, Any]:
         return self.client.chat(self.chat_model, messages, options={"num_predict": 1024})  # type: ignore
 
+    @timed("ollama", "chat_stream")
+    def chat_stream(self, messages: Sequence[Mapping[str, Any]]) -> Iterator[str]:
+        """Stream the reply to a chat, yielding pieces of its content as they are generated.
+
+        Closing the iterator closes the connection to Ollama, which stops the generation.
+        """
+        stream = self.client.chat(
+            self.chat_model, messages, stream=True, options={"num_predict": 1024}  # type: ignore
+        )
+        try:
+            for chunk in stream:
+                yield chunk["message"]["content"]
+        finally:
+            stream.close()  # type: ignore
+
     def embed(self, text: str) -> Sequence[float]:
+        if self.embedding_cache is not None:
+            embedding = self.embedding_cache.get(text)
+            if embedding is not None:
+                return embedding
+        embedding = self._embed(text)
+        if self.embedding_cache is not None:
+            self.embedding_cache.put(text, embedding)
+        return embedding
+
+    # Cache hits are left out of the timing, so that it measures Ollama alone
+    @timed("ollama", "embed")
+    def _embed(self, text: str) -> Sequence[float]:
         return self.client.embeddings(self.embed_model, prompt=text)["embedding"]  # type: ignore
 
     def alive(self):
@@ -178,123 +462,252 @@ class OllamaClient:
 
 
 class OllamaBackend(Backend):
+    name = "ollama"
+
     def __init__(self, config):
-        self.name = "ollama"
-        self.host = config["host"]
-        self.port = config["port"]
+        super().__init__(config)
         self.executable = config["executable"]
 
-    def start(self):
-        self.process = subprocess.Popen(
-            [self.executable, "serve"],
-            env={
-                "OLLAMA_HOST": f"{self.host}:{self.port}",
-                "HOME": os.environ["HOME"],
-            },
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-        )
+    def command(self):
+        return [self.executable, "serve"]
 
-    def stop(self):
-        self.process.terminate()
+    def env(self):
+        return {
+            "OLLAMA_HOST": f"{self.host}:{self.port}",
+            "HOME": os.environ["HOME"],
+        }
 
     @classmethod
     def _alive(cls, host: str, port: int):
-        try:
-            requests.get(f"http://{host}:{port}").raise_for_status()
-            return True
-        except Exception:
-            return False
+        return probe(f"http://{host}:{port}")
 
 
 ### Whisper ###
 
 
+def _stitch(results: list[list[dict[str, Any]]], cuts: list[int]) -> list[dict[str, Any]]:
+    """Join the whisper segments of consecutive audio segments.
+
+    Whisper segments in the overlap before a cut belong to the previous audio segment,
+    unless they are centered after the cut, so they are dropped.
+    """
+    stitched = []
+    for i, segments in enumerate(results):
+        cut = cuts[i] / SAMPLE_RATE
+        stitched += [
+            segment
+            for segment in segments
+            if i == 0 or (segment["start"] + segment["end"]) / 2 >= cut
+        ]
+    return [segment for segment in stitched if segment["text"]]
+
+
 class WhisperClient:
+    """Client for one or more whisper.cpp servers, on `port` and `extra_ports`.
+
+    Recordings longer than `segment_duration` are cut at silences into segments, which
+    are transcribed concurrently on all servers and stitched back together. Segments
+    start `segment_overlap` seconds before their cut so that words at a cut are heard
+    in full, and whisper segments are assigned to the side of the cut they are centered
+    on.
+    """
+
     def __init__(self, config):
-        self.endpoint = f"http://{config['host']}:{config['port']}"
-
-    def transcribe(self, file_path: str):
-        # check if file is webm
-        if file_path.endswith(".webm"):
-            # convert to wav with 16khz sample rate
-            with tempfile.NamedTemporaryFile(suffix=".wav") as f:
-                subprocess.run(
-                    [
-                        "ffmpeg",
-                        "-y",
-                        "-i",
-                        file_path,
-                        "-ar",
-                        "16000",
-                        f.name,
-                    ],
-                    check=True,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
+        self.endpoints = [
+            f"http://{config['host']}:{port}" for port in WhisperBackend.ports(config)
+        ]
+        self.endpoint = self.endpoints[0]
+        self.max_duration: float = config["max_duration"]
+        self.segment_duration: float = config["segment_duration"]
+        self.segment_overlap: float = config["segment_overlap"]
+        self._free_endpoints: queue.Queue[str] = queue.Queue()
+        for endpoint in self.endpoints:
+            self._free_endpoints.put(endpoint)
+        self._pool = ThreadPoolExecutor(
+            max_workers=len(self.endpoints), thread_name_prefix="whisper"
+        )
+        # Inference requests are not retried, their body can only be read once
+        self.policy = TransportPolicy("whisper", config, {"": config["read_timeout"]})
+        self._connect()
+
+        # Forked worker processes must not share the parent's HTTP connections
+        os.register_at_fork(after_in_child=self._connect)
+
+    def _connect(self):
+        self.session = RequestsTransport.session(self.policy)
+
+    def transcribe(self, file_path: str) -> str:
+        """Transcribe an audio or video file in any format that ffmpeg can read."""
+        segments = self.transcribe_segments(file_path)
+        return " ".join(segment["text"] for segment in segments)
+
+    @timed("whisper", "transcribe")
+    def transcribe_segments(
+        self,
+        file_path: str,
+        on_progress: Callable[[list[dict[str, Any]], int, int], None] | None = None,
+    ) -> list[dict[str, Any]]:
+        """Transcribe a file into segments with "start" and "end" times in seconds and
+        their "text".
+
+        The recording is decoded while it is transcribed, and at most two segments per
+        server are held in memory at a time. A recording that is sent whole is decoded
+        to a temporary file first, since its length must be known to upload it.
+
+        If given, `on_progress` is called on the calling thread whenever a segment has
+        been transcribed, with the transcript so far, the number of finished segments
+        and the number of segments so far, which grows until the whole recording is
+        decoded. The transcript so far ends at the first segment that is not finished
+        yet.
+        """
+        if self.segment_duration > 0:
+            chunks = decode_pcm(file_path, self.max_duration)
+            segments = (
+                (start, cut, [pcm], len(pcm))
+                for start, cut, pcm in pcm_segments(
+                    chunks, self.segment_duration, self.segment_overlap
                 )
-                return self._transcribe(f.name)
+            )
+        else:
+            # The WAV header holds the length of the audio, so the recording is decoded
+            # to a temporary file first and uploaded from there
+            pcm_file = decode_pcm_to_file(file_path, self.max_duration)
+            length = os.fstat(pcm_file.fileno()).st_size
+            chunks = read_chunks(pcm_file)
+            segments = iter([(0, 0, chunks, length)])
+
+        cuts: list[int] = []
+        results: list[list[dict[str, Any]] | None] = []
+        futures: dict[Future, int] = {}
+        pending: set[Future] = set()
+        done = 0
+
+        def collect(return_when: str):
+            nonlocal pending, done
+            finished, pending = wait(pending, return_when=return_when)
+            for future in finished:
+                results[futures.pop(future)] = future.result()
+                done += 1
+                if on_progress is not None:
+                    transcribed = []
+                    for result in results:
+                        if result is None:
+                            break
+                        transcribed.append(result)
+                    on_progress(_stitch(transcribed, cuts), done, len(results))
 
-    def _transcribe(self, wav_path: str):
-        response = requests.post(
-            f"{self.endpoint}/inference",
-            files={"file": ("audio.wav", open(wav_path, "rb"), "audio/wav")},
-            data={
+        try:
+            for start, cut, content, length in segments:
+                # Decoding is much faster than transcribing, so wait for a segment to
+                # finish before cutting more than the servers can work on
+                if len(pending) >= 2 * len(self.endpoints):
+                    collect(FIRST_COMPLETED)
+                future = self._pool.submit(
+                    self._transcribe_segment, content, length, start / SAMPLE_RATE
+                )
+                futures[future] = len(results)
+                pending.add(future)
+                cuts.append(cut)
+                results.append(None)
+            collect(ALL_COMPLETED)
+        finally:
+            chunks.close()
+        return _stitch(results, cuts)  # type: ignore
+
+    @timed("whisper", "transcribe_segment")
+    def _transcribe_segment(
+        self, pcm: Iterable[bytes], length: int, offset: float
+    ) -> list[dict[str, Any]]:
+        endpoint = self._free_endpoints.get()
+        try:
+            response = self._transcribe(pcm, length, endpoint)
+        finally:
+            self._free_endpoints.put(endpoint)
+        segments = response.get("segments")
+        if not segments:
+            # Older servers have no verbose output, so the whole segment is one piece
+            duration = length / 2 / SAMPLE_RATE
+            segments = [{"start": 0.0, "end": duration, "text": response["text"]}]
+        return [
+            {
+                "start": offset + segment["start"],
+                "end": offset + segment["end"],
+                "text": segment["text"].strip(),
+            }
+            for segment in segments
+        ]
+
+    def _transcribe(
+        self, pcm: Iterable[bytes], length: int, endpoint: str
+    ) -> dict[str, Any]:
+        # The WAV file is sent as a header followed by the decoded samples, as they are
+        header = wav_header(length)
+        body = MultipartBody(
+            fields={
                 "temperature": "0.0",
                 "temperature_inc": "0.2",
-                "response_format": "json",
+                "response_format": "verbose_json",
             },
+            file_field="file",
+            filename="audio.wav",
+            content_type="audio/wav",
+            content=chain([header], pcm),
+            content_length=len(header) + length,
+        )
+        response = self.session.post(
+            f"{endpoint}/inference",
+            data=body,  # type: ignore
+            headers={"Content-Type": body.content_type},
         )
         response.raise_for_status()
-        return response.json()["text"]
+        return response.json()
 
     def alive(self):
-        requests.get(self.endpoint).raise_for_status()
-        return True
+        return probe(self.endpoint)
 
 
 class WhisperBackend(Backend):
+    name = "whisper"
+
     def __init__(self, config):
-        self.name = "whisper"
-        self.host = config["host"]
-        self.port = config["port"]
+        super().__init__(config)
         self.model = config["model"]
         self.executable = config["executable"]
 
-    def start(self):
-        self.process = subprocess.Popen(
-            [
-                # fmt: off
-                self.executable,
-                "-m", self.model,
-                "--host", self.host,
-                "--port", f"{self.port}",
-                # fmt: on
-            ],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-        )
-
-    def stop(self):
-        self.process.terminate()
+    @staticmethod
+    def ports(config) -> list[int]:
+        """The ports of all whisper servers in the whisper config."""
+        return [config["port"], *config["extra_ports"]]
+
+    def command(self):
+        return [
+            # fmt: off
+            self.executable,
+            "-m", self.model,
+            "--host", self.host,
+            "--port", f"{self.port}",
+            # fmt: on
+        ]
 
     @classmethod
     def _alive(cls, host: str, port: int):
-        try:
-            requests.get(f"http://{host}:{port}").raise_for_status()
-            return True
-        except Exception:
-            return False
+        return probe(f"http://{host}:{port}")
 
 
 ### Backend Manager ###
 
 
 class BackendManager:
+    """Runs the backends that are not external for as long as the server runs.
+
+    All backends are started at once and checked concurrently, so startup takes as long
+    as the slowest backend instead of all of them together.
+    """
 
     def __init__(self, config):
         self.backends: list[Backend] = []
         self.external = []
+        self.startup_timeout: float = config["backends"]["startup_timeout"]
         for name, backend in [
             ("chromadb", ChromadbBackend),
             ("ollama", OllamaBackend),
@@ -302,30 +715,68 @@ class BackendManager:
         ]:
             cfg = config[name]
 
-            if cfg["external"]:
-                self.external.append((backend, cfg["host"], cfg["port"], name))
+            if name == "chromadb" and config["vectors"]["store"] != "chromadb":
+                # Vectors are stored in-process, so there is no Chroma server to run
+                continue
+            if name == "whisper":
+                ports = WhisperBackend.ports(cfg)
             else:
-                self.backends.append(backend(cfg))
-
-    def __enter__(self):
+                ports = [cfg["port"]]
+            for port in ports:
+                if cfg["external"]:
+                    self.external.append((backend, cfg["host"], port, name))
+                else:
+                    self.backends.append(
+                        backend({**config["backends"], **cfg, "port": port})
+                    )
+        self._check_ports(config["api"]["port"])
+
+    def _check_ports(self, api_port: int):
+        """Raise if two of the servers that run on this machine would share a port."""
+        owners: dict[int, str] = {api_port: "the API"}
         for backend in self.backends:
-            backend.start()
-
-        for backend in self.backends:
-            for _ in range(50):
-                if backend.alive():
-                    break
-                time.sleep(0.2)
-            else:
-                raise Exception(f"Failed to start {backend.name}")
+            if backend.port in owners:
+                raise Exception(
+                    f"Port {backend.port} of {backend.name} is already used by "
+                    f"{owners[backend.port]}"
+                )
+            owners[backend.port] = backend.name
 
-        for backend, host, port, name in self.external:
-            if not backend._alive(host, port):
-                raise Exception(f"Failed to connect to {name}")
+    def __enter__(self):
+        try:
+            for backend in self.backends:
+                backend.start()
+
+            with ThreadPoolExecutor(
+                max_workers=max(len(self.backends) + len(self.external), 1)
+            ) as pool:
+                checks = [
+                    (
+                        f"Failed to start {backend.name}",
+                        pool.submit(backend.wait_until_alive, self.startup_timeout),
+                    )
+                    for backend in self.backends
+                ] + [
+                    (
+                        f"Failed to connect to {name}",
+                        pool.submit(backend._alive, host, port),
+                    )
+                    for backend, host, port, name in self.external
+                ]
+                errors = [error for error, alive in checks if not alive.result()]
+            if errors:
+                raise Exception(", ".join(errors))
+        except BaseException:
+            self.stop()
+            raise
 
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
-        for backend in self.backends:
-            backend.stop()
+        self.stop()
         return False
+
+    def stop(self):
+        """Stop all backends at once, so that each of them gets the full stop timeout."""
+        with ThreadPoolExecutor(max_workers=max(len(self.backends), 1)) as pool:
+            list(pool.map(lambda backend: backend.stop(), self.backends))
@@ -0,0 +1,150 @@
+from array import array
+import hashlib
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+from typing import Sequence
+
+__all__ = ["EmbeddingCache"]
+
+
+class EmbeddingCache:
+    """Persistent cache of embeddings, keyed by the embed model and a hash of the text.
+
+    Vectors are stored as float32 blobs in a local SQLite database and evicted in least
+    recently used order once the cache holds more than `max_entries` vectors. Entries for
+    any other embed model are dropped when the cache is opened, so changing `embed_model`
+    in the config invalidates the cache automatically.
+    """
+
+    def __init__(self, path: str, embed_model: str, max_entries: int):
+        self.path = path
+        self.embed_model = embed_model
+        self.max_entries = max_entries
+
+        # Shared with forked worker processes, which do most of the lookups
+        self._hits = multiprocessing.Value("q", 0)
+        self._misses = multiprocessing.Value("q", 0)
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._connect()
+
+        # SQLite connections must not be used across a fork, and a fork must not land in
+        # the middle of a write: the child would inherit SQLite's record of the lock and
+        # fail every later write. The lock is held across the fork to wait for writes.
+        os.register_at_fork(
+            before=self._lock_for_fork,
+            after_in_parent=self._unlock_after_fork,
+            after_in_child=self._connect,
+        )
+
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS embedding (
+                    model TEXT NOT NULL,
+                    hash BLOB NOT NULL,
+                    vector BLOB NOT NULL,
+                    last_used REAL NOT NULL,
+                    PRIMARY KEY (model, hash)
+                )"""
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS embedding_last_used ON embedding (last_used)"
+            )
+            self._conn.execute("DELETE FROM embedding WHERE model != ?", (embed_model,))
+            (self._size,) = self._conn.execute(
+                "SELECT COUNT(*) FROM embedding"
+            ).fetchone()
+
+    def _connect(self):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+
+    def _lock_for_fork(self):
+        self._lock.acquire()
+
+    def _unlock_after_fork(self):
+        self._lock.release()
+
+    @property
+    def hits(self) -> int:
+        """The number of lookups that were answered from the cache."""
+        return self._hits.value  # type: ignore
+
+    @property
+    def misses(self) -> int:
+        """The number of lookups that were not in the cache."""
+        return self._misses.value  # type: ignore
+
+    @staticmethod
+    def _hash(text: str) -> bytes:
+        return hashlib.sha256(text.encode()).digest()
+
+    def get(self, text: str) -> list[float] | None:
+        """Get the cached embedding of a text, or None if it is not cached."""
+        key = self._hash(text)
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT vector FROM embedding WHERE model = ? AND hash = ?",
+                (self.embed_model, key),
+            ).fetchone()
+            if row is None:
+                with self._misses.get_lock():
+                    self._misses.value += 1  # type: ignore
+                return None
+            self._conn.execute(
+                "UPDATE embedding SET last_used = ? WHERE model = ? AND hash = ?",
+                (time.time(), self.embed_model, key),
+            )
+        with self._hits.get_lock():
+            self._hits.value += 1  # type: ignore
+        return array("f", row[0]).tolist()
+
+    def put(self, text: str, embedding: Sequence[float]):
+        """Store the embedding of a text, evicting the least recently used entries."""
+        vector = array("f", embedding).tobytes()
+        key = (self.embed_model, self._hash(text))
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO embedding VALUES (?, ?, ?, ?)",
+                (*key, vector, time.time()),
+            )
+            if cursor.rowcount:
+                self._size += 1
+            else:
+                # Replacing an entry does not change the size of the cache
+                self._conn.execute(
+                    """UPDATE embedding SET vector = ?, last_used = ?
+                    WHERE model = ? AND hash = ?""",
+                    (vector, time.time(), *key),
+                )
+            if self._size > self.max_entries:
+                # Other processes add entries too, so count them before evicting
+                (self._size,) = self._conn.execute(
+                    "SELECT COUNT(*) FROM embedding"
+                ).fetchone()
+            if self._size > self.max_entries:
+                # Evict a tenth of the cache at once so that eviction is not run on
+                # every insert once the cache is full
+                excess = self._size - self.max_entries + self.max_entries // 10
+                self._conn.execute(
+                    """DELETE FROM embedding WHERE rowid IN (
+                        SELECT rowid FROM embedding ORDER BY last_used LIMIT ?
+                    )""",
+                    (excess,),
+                )
+                (self._size,) = self._conn.execute(
+                    "SELECT COUNT(*) FROM embedding"
+                ).fetchone()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": self._size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
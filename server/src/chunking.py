@@ -0,0 +1,87 @@
+import re
+
+__all__ = ["estimate_tokens", "split_markdown"]
+
+_HEADING = re.compile(r"^#{1,6}\s")
+_FENCE = re.compile(r"^\s*(```|~~~)")
+
+
+def estimate_tokens(text: str) -> int:
+    """Roughly estimate the number of tokens in a text, at about four characters a token."""
+    return len(text) // 4 + 1
+
+
+def _sections(text: str) -> list[list[str]]:
+    """Split markdown into sections at headings, and each section into blocks.
+
+    Blocks are paragraphs separated by blank lines. Fenced code blocks are kept whole.
+    """
+    sections: list[list[str]] = [[]]
+    block: list[str] = []
+    in_fence = False
+
+    def end_block():
+        if block:
+            sections[-1].append("\n".join(block))
+            block.clear()
+
+    for line in text.splitlines():
+        if _FENCE.match(line):
+            in_fence = not in_fence
+        elif not in_fence and _HEADING.match(line):
+            end_block()
+            if sections[-1]:
+                sections.append([])
+        elif not in_fence and not line.strip():
+            end_block()
+            continue
+        block.append(line)
+    end_block()
+    return [section for section in sections if section]
+
+
+def _split_block(block: str, max_chars: int) -> list[str]:
+    """Split a block that is too long at line breaks, or mid-line if a line is too long."""
+    pieces: list[str] = []
+    current = ""
+    for line in block.splitlines():
+        if len(line) > max_chars and current:
+            pieces.append(current)
+            current = ""
+        while len(line) > max_chars:
+            # Prefer to break at a space, so that words are not cut in half
+            cut = line.rfind(" ", 0, max_chars)
+            if cut <= 0:
+                cut = max_chars
+            pieces.append(line[:cut])
+            line = line[cut:].lstrip()
+        if current and len(current) + 1 + len(line) > max_chars:
+            pieces.append(current)
+            current = ""
+        current = f"{current}\n{line}" if current else line
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def split_markdown(text: str, max_tokens: int) -> list[str]:
+    """Split markdown into chunks of at most about `max_tokens` tokens.
+
+    Headings always start a new chunk, and within a section, whole paragraphs are packed
+    into chunks for as long as they fit. Chunk boundaries therefore depend only on the
+    section a chunk belongs to, so editing one section leaves the chunks of all other
+    sections unchanged.
+    """
+    max_chars = max_tokens * 4
+    chunks: list[str] = []
+    for section in _sections(text):
+        current = ""
+        for block in section:
+            for piece in _split_block(block, max_chars) if len(block) > max_chars else [block]:
+                if current and len(current) + 2 + len(piece) > max_chars:
+                    chunks.append(current)
+                    current = ""
+                current = f"{current}\n\n{piece}" if current else piece
+        if current:
+            chunks.append(current)
+    return chunks
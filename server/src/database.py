@@ -0,0 +1,127 @@
+import os
+import threading
+from typing import Any
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.pool import QueuePool
+
+__all__ = ["engine_options", "tune_sqlite", "wait_for_writes_on_fork"]
+
+# How long a fork waits for write transactions to end, before forking anyway
+_FORK_TIMEOUT = 10.0
+
+# Statements that do not write, so that they do not delay forks
+_READS = ("SELECT", "PRAGMA", "EXPLAIN")
+
+
+def engine_options(config) -> dict[str, Any]:
+    """SQLAlchemy engine options for the [database] config section.
+
+    Connections are pooled, so that requests reuse open connections instead of paying
+    for a new connection each time. In-memory SQLite databases keep SQLAlchemy's default
+    pool, since every new connection to them would see an empty database.
+    """
+    url = make_url(config["uri"])
+    if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+        return {}
+    options: dict[str, Any] = {
+        "poolclass": QueuePool,
+        "pool_size": config["pool_size"],
+        "max_overflow": config["max_overflow"],
+        "pool_timeout": config["pool_timeout"],
+        "pool_recycle": config["pool_recycle"],
+    }
+    if url.get_backend_name() != "sqlite":
+        # Database servers drop idle connections, check them before they are used
+        options["pool_pre_ping"] = True
+    return options
+
+
+def tune_sqlite(engine: Engine, config):
+    """Set the pragmas from the [database] config section on every new SQLite connection.
+
+    In WAL mode, readers no longer wait for writers to commit, and with a synchronous
+    level of NORMAL a commit no longer waits for the disk, at the risk of losing the
+    last transactions (but never corrupting the database) on a power failure.
+    """
+    if engine.dialect.name != "sqlite":
+        return
+
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute(f"PRAGMA synchronous={config['sqlite_synchronous']}")
+        cursor.execute(f"PRAGMA busy_timeout={int(config['sqlite_busy_timeout'])}")
+        cursor.execute(f"PRAGMA cache_size={int(config['sqlite_cache_size'])}")
+        cursor.execute(f"PRAGMA mmap_size={int(config['sqlite_mmap_size'])}")
+        cursor.close()
+
+
+class _WriteGate:
+    """Counts the connections of this process that are in a write transaction."""
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._writers = 0
+        self._forking = False
+
+    def enter(self):
+        with self._condition:
+            self._condition.wait_for(lambda: not self._forking)
+            self._writers += 1
+
+    def leave(self):
+        with self._condition:
+            self._writers -= 1
+            self._condition.notify_all()
+
+    def before_fork(self):
+        with self._condition:
+            self._forking = True
+            if not self._condition.wait_for(lambda: not self._writers, _FORK_TIMEOUT):
+                print(f"Forking during {self._writers} write transactions")
+
+    def after_fork_in_parent(self):
+        with self._condition:
+            self._forking = False
+            self._condition.notify_all()
+
+    def after_fork_in_child(self):
+        # Only the forking thread exists in the child, and it was not writing
+        self._condition = threading.Condition()
+        self._writers = 0
+        self._forking = False
+
+
+def wait_for_writes_on_fork(engine: Engine):
+    """Make forks of this process wait until no connection of `engine` is writing.
+
+    A child forked in the middle of a write inherits SQLite's record of the write lock,
+    which nothing in the child ever releases, so every write in the child would fail
+    with "database is locked". Connections count as writing from their first statement
+    that is not a read until they are returned to the pool, which is after their
+    transaction ended. New writes wait while a fork is pending.
+    """
+    if engine.dialect.name != "sqlite":
+        return
+    gate = _WriteGate()
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def enter(conn, cursor, statement, parameters, context, executemany):
+        write = not statement.lstrip().upper().startswith(_READS)
+        if write and "writing" not in conn.info:
+            gate.enter()
+            conn.info["writing"] = True
+
+    @event.listens_for(engine.pool, "checkin")
+    def leave(dbapi_connection, connection_record):
+        if connection_record is not None and connection_record.info.pop("writing", None):
+            gate.leave()
+
+    os.register_at_fork(
+        before=gate.before_fork,
+        after_in_parent=gate.after_fork_in_parent,
+        after_in_child=gate.after_fork_in_child,
+    )
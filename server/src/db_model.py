@@ -1,6 +1,12 @@
+import os
+
 from . import get_server
 from flask_admin import Admin
 from flask_admin.contrib.sqla import ModelView
+from sqlalchemy.orm import selectinload
+from sqlalchemy import inspect
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.schema import CreateIndex
 
 app = get_server().app
 db = get_server().db
@@ -29,22 +35,49 @@ class Note(db.Model):
     @classmethod
     def new_note(cls):
         note = cls()
-        if not db.session.query(cls.id).count():
-            note.id = 1
-        else:
-            note.id = db.session.query(db.func.max(cls.id)).scalar() + 1
-        default_title = "Untitled Note"
-        # if the default title already exists, append a number to it until it's unique
-        title = default_title
-        i = 1
-        while cls.query.filter_by(title=title).first():
-            title = f"{default_title} {i}"
-            i += 1
-        note.title = title
+        note.title = cls.next_default_title()
         note.content = ""
         note.created_at = note.last_modified = note.last_opened = db.func.now()
         return note
 
+    @classmethod
+    def next_default_title(cls, default_title: str = "Untitled Note") -> str:
+        """Get the default title, with a number appended if it is already taken.
+
+        All default titles sort between `default_title` and `default_title + "!"`, so a
+        single query over a range scan of the title index finds whether the title is taken
+        and the highest number in use.
+        """
+        suffix = db.func.substr(cls.title, len(default_title) + 2)
+        taken, last = (
+            db.session.query(
+                db.func.max(db.case((cls.title == default_title, 1), else_=0)),
+                db.func.max(
+                    db.case(
+                        (
+                            cls.title.startswith(f"{default_title} ")
+                            & suffix.regexp_match("^[0-9]+$"),
+                            db.cast(suffix, db.BigInteger),
+                        )
+                    )
+                ),
+            )
+            .filter(cls.title >= default_title, cls.title < f"{default_title}!")
+            .one()
+        )
+        if not taken:
+            return default_title
+        return f"{default_title} {(last or 0) + 1}"
+
+    @classmethod
+    def with_relations(cls):
+        """Query for notes that loads the tags and media of all results in bulk.
+
+        `to_dict` touches both relationships, so any route that serializes more than one
+        note should use this to avoid two extra queries per note.
+        """
+        return cls.query.options(selectinload(cls.tags), selectinload(cls.media))
+
     def to_dict(self):
         return {
             "id": self.id,
@@ -66,10 +99,6 @@ class Tag(db.Model):
     @classmethod
     def new_tag(cls, name: str, color: str):
         tag = cls()
-        if not db.session.query(cls.id).count():
-            tag.id = 1
-        else:
-            tag.id = db.session.query(db.func.max(cls.id)).scalar() + 1
         tag.name = name
         tag.color = color
         return tag
@@ -84,24 +113,204 @@ class Tag(db.Model):
 
 class Media(db.Model):
     id = db.Column(db.Integer, primary_key=True)
+    # The file name in the media directory, to find earlier uploads of the same content
     path = db.Column(db.String(255), nullable=False)
 
     @classmethod
     def new_media(cls, path: str):
         media = cls()
-        if not db.session.query(cls.id).count():
-            media.id = 1
-        else:
-            media.id = db.session.query(db.func.max(cls.id)).scalar() + 1
         media.path = path
         return media
 
+    @staticmethod
+    def directory() -> str:
+        """The directory that media files are stored in."""
+        return os.path.join(os.getcwd(), get_server().config["api"]["media_path"])
+
+    @property
+    def file_path(self) -> str:
+        """The path of the media file on disk."""
+        return os.path.join(self.directory(), self.path)
+
     def to_dict(self):
         return {
             "id": self.id,
         }
 
 
+class Transcript(db.Model):
+    """The transcript of a media file."""
+
+    media_id = db.Column(db.Integer, db.ForeignKey("media.id"), primary_key=True)
+    text = db.Column(db.Text, nullable=False)
+    # Pieces of the text with their "start" and "end" times in seconds
+    segments = db.Column(db.JSON, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False)
+
+
+class TranscriptionJob(db.Model):
+    """A request to transcribe a media file, processed by the transcription queue."""
+
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+    id = db.Column(db.Integer, primary_key=True)
+    media_id = db.Column(db.Integer, db.ForeignKey("media.id"), nullable=False)
+    status = db.Column(db.String(16), nullable=False, index=True)
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    # The transcript so far while the job is running, as the segments are transcribed
+    partial_text = db.Column(db.Text, nullable=True)
+    segments_done = db.Column(db.Integer, nullable=True)
+    segments_total = db.Column(db.Integer, nullable=True)
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (self.DONE, self.FAILED)
+
+    def to_dict(self):
+        result = {
+            "id": self.id,
+            "media_id": self.media_id,
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+        if self.status == self.RUNNING and self.segments_total is not None:
+            result["progress"] = {
+                "done": self.segments_done,
+                "total": self.segments_total,
+            }
+            result["partial_text"] = self.partial_text
+        if self.status == self.DONE:
+            transcript = db.session.get(Transcript, self.media_id)
+            result["text"] = transcript.text  # type: ignore
+            result["segments"] = transcript.segments  # type: ignore
+        if self.error is not None:
+            result["error"] = self.error
+        return result
+
+
+class EmbeddingTask(db.Model):
+    """A pending refresh of a note's embedding, processed by the embedding queue."""
+
+    # Not a foreign key, since the task for a deleted note removes its embedding
+    note_id = db.Column(db.Integer, primary_key=True)
+    enqueued_at = db.Column(db.DateTime, nullable=False)
+    due_at = db.Column(db.DateTime, nullable=False, index=True)
+    # Incremented by every write, so the queue can tell whether a task changed while
+    # its note was being embedded
+    version = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    # Failed attempts to embed the note, which push its due time further back each time
+    attempts = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+
+
+class Summary(db.Model):
+    """A cached summary of a text, as generated by a chat model with a prompt version."""
+
+    id = db.Column(db.Integer, primary_key=True)
+    # "note" for the summary of a whole note, or "chunk" for one section of a long note
+    kind = db.Column(db.String(16), nullable=False, default="note")
+    content_hash = db.Column(db.String(64), nullable=False)
+    chat_model = db.Column(db.String(80), nullable=False)
+    prompt_version = db.Column(db.Integer, nullable=False)
+    # The note the text came from, if any, so that stale summaries can be dropped
+    note_id = db.Column(db.Integer, nullable=True, index=True)
+    summary = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False)
+
+    __table_args__ = (
+        db.UniqueConstraint("kind", "content_hash", "chat_model", "prompt_version"),
+        # Only holds generated data, so it is recreated when its schema changes
+        {"info": {"cache": True}},
+    )
+
+
+# Indexes for the sort orders of note lists, which are paginated by sort key and ID
+db.Index("ix_note_created", Note.__table__.c.created_at, Note.__table__.c.id)
+db.Index("ix_note_modified", Note.__table__.c.last_modified, Note.__table__.c.id)
+db.Index(
+    "ix_note_opened",
+    db.func.coalesce(Note.__table__.c.last_opened, Note.__table__.c.created_at),
+    Note.__table__.c.id,
+)
+db.Index("ix_note_title", db.func.lower(Note.__table__.c.title), Note.__table__.c.id)
+# For finding the next free default title
+db.Index("ix_note_title_exact", Note.__table__.c.title)
+# Uploads of the same content share a row, even when they arrive at the same time
+db.Index("ux_media_path", Media.__table__.c.path, unique=True)
+
+# Indexes that were replaced, and are dropped from existing databases
+OBSOLETE_INDEXES = ["ix_media_path"]
+
+
+def add_missing_columns():
+    """Bring existing tables up to date with columns added to their models.
+
+    `db.create_all` only creates missing tables, so columns added to a model after its
+    table was created are added here. New columns must be nullable or have a server
+    default. Cache tables, marked with `info={"cache": True}`, are instead dropped and
+    created again when their columns or unique constraints changed, since SQLite cannot
+    alter constraints. Must be called in an app context, before `create_indexes`.
+    """
+    inspector = inspect(db.engine)
+    with db.engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            missing = [column for column in table.columns if column.name not in existing]
+            if table.info.get("cache"):
+                unique = {
+                    frozenset(column.name for column in constraint.columns)
+                    for constraint in table.constraints
+                    if isinstance(constraint, db.UniqueConstraint)
+                }
+                stored = {
+                    frozenset(constraint["column_names"])
+                    for constraint in inspector.get_unique_constraints(table.name)
+                }
+                if missing or unique != stored:
+                    print(f"Recreating cache table {table.name}")
+                    table.drop(conn)
+                    table.create(conn)
+                continue
+            for column in missing:
+                ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} "
+                ddl += column.type.compile(db.engine.dialect)
+                if column.server_default is not None:
+                    ddl += f" DEFAULT {column.server_default.arg}"
+                if not column.nullable:
+                    ddl += " NOT NULL"
+                print(f"Adding column {table.name}.{column.name}")
+                conn.execute(db.text(ddl))
+
+
+def create_indexes():
+    """Create any indexes that are missing from existing tables.
+
+    `db.create_all` only creates missing tables, so indexes added to a table after it was
+    created have to be created separately. Indexes listed in `OBSOLETE_INDEXES` are
+    dropped. Must be called in an app context.
+    """
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            try:
+                with db.engine.begin() as conn:
+                    conn.execute(CreateIndex(index, if_not_exists=True))
+            except IntegrityError:
+                # Rows from before the index was added may not be unique
+                print(f"Could not create unique index {index.name}, it has duplicates")
+    with db.engine.begin() as conn:
+        for name in OBSOLETE_INDEXES:
+            conn.execute(db.text(f"DROP INDEX IF EXISTS {name}"))
+
+
 class NoteView(ModelView):
     column_list = (
         "title",
@@ -127,3 +336,4 @@ admin = Admin(app, name="Notes", template_mode="bootstrap3")
 admin.add_view(NoteView(Note, db.session))
 admin.add_view(ModelView(Tag, db.session))
 admin.add_view(ModelView(Media, db.session))
+admin.add_view(ModelView(Transcript, db.session))
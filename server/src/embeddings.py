@@ -0,0 +1,336 @@
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+import datetime
+import hashlib
+import json
+import multiprocessing
+import os
+import threading
+import time
+import traceback
+
+from sqlalchemy import event
+
+from .chunking import split_markdown
+
+__all__ = ["note_chunks", "EmbeddingBackfill", "EmbeddingQueue"]
+
+
+def note_chunks(note, max_tokens: int) -> dict[str, str]:
+    """The texts that are embedded for a note, by chunk ID.
+
+    Each chunk is prefixed with the note's title, and its ID combines the note ID with a
+    hash of the text, so a chunk keeps its ID for as long as its text is unchanged.
+    """
+    chunks: dict[str, str] = {}
+    for chunk in split_markdown(note.content, max_tokens) or [""]:
+        doc = f"{note.title}\n{chunk}"
+        chunks[f"{note.id}:{hashlib.sha256(doc.encode()).hexdigest()[:16]}"] = doc
+    return chunks
+
+
+class EmbeddingBackfill:
+    """Embeds every note that is missing from the vector database.
+
+    Missing notes are found with a single listing of the collection's chunks, embedded in
+    batches on a bounded worker pool, and each batch is upserted as soon as it is ready.
+    Because finished batches are already stored, an interrupted backfill picks up where it
+    left off the next time it runs.
+    """
+
+    def __init__(self, server):
+        self.server = server
+        self.batch_size: int = server.config["embeddings"]["batch_size"]
+        self.workers: int = server.config["embeddings"]["workers"]
+        self.chunk_tokens: int = server.config["embeddings"]["chunk_tokens"]
+        self.checkpoint_path = os.path.join(
+            server.app.instance_path, "embedding-backfill.json"
+        )
+
+        # Progress is kept in shared memory so that forked worker processes can report it
+        self._total = multiprocessing.Value("q", 0)
+        self._done = multiprocessing.Value("q", 0)
+
+    @property
+    def total(self) -> int:
+        """The number of notes that need to be embedded."""
+        return self._total.value  # type: ignore
+
+    @total.setter
+    def total(self, total: int):
+        self._total.value = total  # type: ignore
+
+    @property
+    def done(self) -> int:
+        """The number of notes that have been embedded so far."""
+        return self._done.value  # type: ignore
+
+    @done.setter
+    def done(self, done: int):
+        self._done.value = done  # type: ignore
+
+    def run(self, regenerate: bool = False):
+        """Embed all missing notes. If `regenerate` is set, all embeddings are rebuilt."""
+
+        # Import Note here to avoid circular import with db_model
+        from .db_model import Note
+
+        vector_store = self.server.vector_store
+
+        if regenerate:
+            if self._resuming():
+                print("Resuming interrupted embedding regeneration")
+            else:
+                print("Clearing all embeddings")
+                self._write_checkpoint()
+                vector_store.clear()
+
+        note_ids = [id for (id,) in self.server.db.session.query(Note.id)]
+        chunk_ids = vector_store.note_chunk_ids()
+
+        # Drop whole-note embeddings stored before notes were chunked
+        legacy = chunk_ids.pop(None, set())
+        if legacy:
+            print(f"Removing {len(legacy)} legacy note embeddings")
+            vector_store.remove(list(legacy))
+
+        # Drop embeddings of notes that no longer exist
+        stale = chunk_ids.keys() - set(note_ids)
+        if stale:
+            vector_store.remove_notes(list(stale))  # type: ignore
+
+        missing = [id for id in note_ids if id not in chunk_ids]
+        self.total = len(missing)
+        self.done = 0
+        if missing:
+            print(f"Embedding {self.total} notes")
+            self._embed(missing)
+
+        if regenerate:
+            self._remove_checkpoint()
+
+    def _embed(self, note_ids: list[int]):
+        from .db_model import Note
+
+        batches = [
+            note_ids[i : i + self.batch_size]
+            for i in range(0, len(note_ids), self.batch_size)
+        ]
+        start = time.monotonic()
+        pending: set[Future] = set()
+        with ThreadPoolExecutor(
+            max_workers=self.workers, thread_name_prefix="embed"
+        ) as pool:
+            for batch in batches:
+                # Keep a bounded number of batches in flight so that memory use does not
+                # grow with the number of notes.
+                if len(pending) >= 2 * self.workers:
+                    pending = self._upsert_finished(pending, start)
+
+                ids: list[str] = []
+                docs: list[str] = []
+                metadatas: list[dict] = []
+                notes = Note.query.filter(Note.id.in_(batch)).all()
+                for note in notes:
+                    for chunk_id, doc in note_chunks(note, self.chunk_tokens).items():
+                        ids.append(chunk_id)
+                        docs.append(doc)
+                        metadatas.append({"note_id": note.id})
+                pending.add(
+                    pool.submit(self._embed_batch, len(notes), ids, docs, metadatas)
+                )
+
+            while pending:
+                pending = self._upsert_finished(pending, start)
+
+    def _embed_batch(self, n_notes: int, ids: list[str], docs: list[str], metadatas):
+        embeddings = [self.server.ollama_client.embed(doc) for doc in docs]
+        return n_notes, ids, docs, embeddings, metadatas
+
+    def _upsert_finished(self, pending: set[Future], start: float) -> set[Future]:
+        finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in finished:
+            n_notes, ids, docs, embeddings, metadatas = future.result()
+            if ids:
+                self.server.vector_store.add(ids, docs, embeddings, metadatas)
+            self.done += n_notes
+            rate = self.done / max(time.monotonic() - start, 1e-9)
+            print(f"Embedded {self.done}/{self.total} notes ({rate:.1f} notes/s)")
+        return pending
+
+    def _resuming(self) -> bool:
+        """Whether a previous regeneration with the same embed model was interrupted."""
+        if not os.path.exists(self.checkpoint_path):
+            return False
+        with open(self.checkpoint_path) as f:
+            checkpoint = json.load(f)
+        return checkpoint.get("embed_model") == self.server.ollama_client.embed_model
+
+    def _write_checkpoint(self):
+        os.makedirs(os.path.dirname(self.checkpoint_path), exist_ok=True)
+        with open(self.checkpoint_path, "w") as f:
+            json.dump({"embed_model": self.server.ollama_client.embed_model}, f)
+
+    def _remove_checkpoint(self):
+        if os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+
+
+class EmbeddingQueue:
+    """Refreshes note embeddings in the background after notes are written.
+
+    Tasks are stored in the database in the same transaction as the note change, so
+    pending work survives restarts. There is at most one task per note, and every write
+    pushes its due time back by the debounce delay, so a burst of edits to the same note
+    results in a single embed. Only the chunks of a note whose text changed are embedded
+    again, and a note that fails to embed is retried with backoff without holding up the
+    others.
+    """
+
+    def __init__(self, server):
+        self.server = server
+        self.debounce = datetime.timedelta(
+            seconds=server.config["embeddings"]["debounce"]
+        )
+        self.max_delay = datetime.timedelta(
+            seconds=server.config["embeddings"]["max_delay"]
+        )
+        self.poll_interval: float = server.config["embeddings"]["poll_interval"]
+        self.batch_size: int = server.config["embeddings"]["batch_size"]
+        self.chunk_tokens: int = server.config["embeddings"]["chunk_tokens"]
+        self.retry_delay: float = server.config["embeddings"]["retry_delay"]
+        self.max_retry_delay: float = server.config["embeddings"]["max_retry_delay"]
+        # Shared with forked worker processes, whose writes wake the worker in the parent
+        self._wake = multiprocessing.Event()
+        self._enqueued = False
+
+        # Wake the worker once new tasks are visible to it
+        event.listen(server.db.session, "after_commit", self._after_commit)
+
+    def enqueue(self, note_id: int, delay: bool = True):
+        """Schedule a refresh of a note's embedding. Must be followed by a commit."""
+        from .db_model import EmbeddingTask
+
+        now = datetime.datetime.now()
+        task = self.server.db.session.get(EmbeddingTask, note_id)
+        if task is None:
+            task = EmbeddingTask(note_id=note_id, enqueued_at=now)
+            self.server.db.session.add(task)
+        if delay:
+            # Debounce, but never postpone a task past its maximum delay
+            task.due_at = min(now + self.debounce, task.enqueued_at + self.max_delay)
+        else:
+            task.due_at = now
+        task.version = (task.version or 0) + 1
+        # The note changed, so a failure to embed its earlier text no longer counts
+        task.attempts = 0
+        self._enqueued = True
+
+    def _after_commit(self, session):
+        if self._enqueued:
+            self._enqueued = False
+            self._wake.set()
+
+    def start(self):
+        """Start processing tasks on a background thread."""
+        threading.Thread(target=self._run, name="embedding-queue", daemon=True).start()
+
+    def _run(self):
+        # Embedding requires the embed model to be pulled
+        self.server.jobs["embed_model"].wait()
+        while True:
+            self._wake.clear()
+            try:
+                with self.server.app.app_context():
+                    timeout = self._process_due()
+            except Exception:
+                traceback.print_exc()
+                timeout = self.poll_interval
+            self._wake.wait(timeout)
+
+    def _process_due(self) -> float:
+        """Process a batch of due tasks. Returns how long to wait before the next batch."""
+        from .db_model import EmbeddingTask, Note
+
+        db = self.server.db
+        now = datetime.datetime.now()
+        tasks = (
+            EmbeddingTask.query.filter(EmbeddingTask.due_at <= now)
+            .order_by(EmbeddingTask.due_at)
+            .limit(self.batch_size)
+            .all()
+        )
+        if not tasks:
+            next_due = db.session.query(db.func.min(EmbeddingTask.due_at)).scalar()
+            db.session.rollback()
+            if next_due is None:
+                return self.poll_interval
+            return min(max((next_due - now).total_seconds(), 0), self.poll_interval)
+
+        claimed = {task.note_id: task.version for task in tasks}
+        attempts = {task.note_id: task.attempts for task in tasks}
+        notes = Note.query.filter(Note.id.in_(claimed)).all()
+        note_ids = [note.id for note in notes]
+        chunks = {note.id: note_chunks(note, self.chunk_tokens) for note in notes}
+        removed = list(claimed.keys() - set(note_ids))
+        # End the read transaction so that writers are not blocked while embedding
+        db.session.rollback()
+
+        vector_store = self.server.vector_store
+        stored_chunks = vector_store.note_chunk_ids(note_ids) if note_ids else {}
+        ids: list[str] = []
+        docs: list[str] = []
+        embeddings: list = []
+        metadatas: list[dict] = []
+        stale: list[str] = []
+        failed: list[int] = []
+        for note_id, note_chunk_docs in chunks.items():
+            stored = stored_chunks.get(note_id, set())
+            new = {id: doc for id, doc in note_chunk_docs.items() if id not in stored}
+            try:
+                new_embeddings = [
+                    self.server.ollama_client.embed(doc) for doc in new.values()
+                ]
+            except Exception:
+                # A note that cannot be embedded must not hold up the rest of the batch
+                traceback.print_exc()
+                failed.append(note_id)
+                continue
+            ids += new.keys()
+            docs += new.values()
+            embeddings += new_embeddings
+            metadatas += [{"note_id": note_id}] * len(new)
+            stale += stored - note_chunk_docs.keys()
+
+        # Add the new chunks before removing the old ones, so that a note never drops
+        # out of search results while it is being updated
+        if ids:
+            vector_store.add(ids, docs, embeddings, metadatas)
+        if stale:
+            vector_store.remove(stale)
+        if removed:
+            vector_store.remove_notes(removed)
+
+        # Only touch tasks that were not enqueued again by another write in the meantime.
+        # The due time cannot tell, since it stops changing once the maximum delay is hit.
+        for note_id, version in claimed.items():
+            task = EmbeddingTask.query.filter_by(note_id=note_id, version=version)
+            if note_id in failed:
+                # Retry later, backing off so that a note that keeps failing is not
+                # claimed again on every poll
+                delay = min(
+                    self.retry_delay * 2 ** attempts[note_id], self.max_retry_delay
+                )
+                task.update(
+                    {
+                        "due_at": now + datetime.timedelta(seconds=delay),
+                        "attempts": attempts[note_id] + 1,
+                    }
+                )
+            else:
+                task.delete()
+        db.session.commit()
+        note_ids = [id for id in note_ids if id not in failed]
+
+        # The notes have settled, so this is also a good time to summarize them
+        self.server.summarizer.precompute(note_ids)
+        return 0
@@ -0,0 +1,121 @@
+from functools import wraps
+import multiprocessing
+import threading
+import traceback
+from typing import Any, Callable
+
+__all__ = ["BackgroundJob", "requires_jobs"]
+
+
+class BackgroundJob:
+    """A named unit of startup work that runs on a daemon thread and reports its status.
+
+    The status lives in shared memory, so that worker processes forked by a production
+    server see the progress of jobs that run in the parent process.
+    """
+
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    _STATUSES = [PENDING, RUNNING, DONE, FAILED]
+
+    def __init__(
+        self,
+        name: str,
+        target: Callable[[], Any],
+        depends_on: list["BackgroundJob"] | None = None,
+        progress: Callable[[], dict[str, Any]] | None = None,
+    ):
+        self.name = name
+        """The name of the job, used in status reports."""
+
+        self.target = target
+        """The function that does the work."""
+
+        self.depends_on = depends_on or []
+        """Jobs that must finish successfully before this one starts."""
+
+        self.progress = progress
+        """Optional callback that reports progress while the job is running."""
+
+        self._status = multiprocessing.Value("i", 0)
+        self._error = multiprocessing.Array("c", 1024)
+        self._finished = multiprocessing.Event()
+
+    @property
+    def status(self) -> str:
+        return self._STATUSES[self._status.value]  # type: ignore
+
+    @status.setter
+    def status(self, status: str):
+        self._status.value = self._STATUSES.index(status)  # type: ignore
+
+    @property
+    def error(self) -> str | None:
+        return self._error.value.decode(errors="replace") or None  # type: ignore
+
+    @error.setter
+    def error(self, error: str):
+        self._error.value = error.encode()[: len(self._error) - 1]  # type: ignore
+
+    def start(self):
+        """Run the job on a background thread."""
+        threading.Thread(target=self.run, name=f"job-{self.name}", daemon=True).start()
+
+    def run(self):
+        """Run the job on the current thread, after waiting for its dependencies."""
+        try:
+            for job in self.depends_on:
+                job.wait()
+                if job.status != self.DONE:
+                    raise Exception(f"Dependency '{job.name}' did not finish")
+            self.status = self.RUNNING
+            self.target()
+            self.status = self.DONE
+        except Exception as e:
+            traceback.print_exc()
+            self.error = str(e)
+            self.status = self.FAILED
+        finally:
+            self._finished.set()
+
+    def wait(self, timeout: float | None = None) -> bool:
+        """Block until the job has finished. Returns whether it finished in time."""
+        return self._finished.wait(timeout)
+
+    @property
+    def ready(self) -> bool:
+        return self.status == self.DONE
+
+    def to_dict(self):
+        result: dict[str, Any] = {"status": self.status}
+        if self.status == self.RUNNING and self.progress is not None:
+            result["progress"] = self.progress()
+        if self.error is not None:
+            result["error"] = self.error
+        return result
+
+
+def requires_jobs(*names: str):
+    """Route decorator that answers with 503 until the named background jobs are done."""
+
+    def decorator(route):
+        @wraps(route)
+        def wrapper(*args, **kwargs):
+            from . import get_server
+
+            jobs = {name: get_server().jobs[name] for name in names}
+            if all(job.ready for job in jobs.values()):
+                return route(*args, **kwargs)
+            failed = [name for name, job in jobs.items() if job.status == job.FAILED]
+            error = f"Startup job failed: {', '.join(failed)}" if failed else "Warming up"
+            return (
+                {"error": error, "jobs": {n: j.to_dict() for n, j in jobs.items()}},
+                503,
+                {"Retry-After": "5"},
+            )
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,139 @@
+import hashlib
+import os
+import re
+import tempfile
+from typing import BinaryIO
+
+from flask import Request, send_from_directory
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.utils import secure_filename
+
+__all__ = ["save_upload", "save_form_upload", "send_media"]
+
+_CHUNK_SIZE = 1024 * 1024
+_CONTENT_ADDRESSED = re.compile(r"^[0-9a-f]{64}\.")
+
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+"""How long clients may cache media files whose name is the hash of their content."""
+
+
+class _HashedUpload:
+    """A temporary file in the media directory that hashes what is written to it.
+
+    The temporary file is in the media directory, so that it can be renamed atomically
+    to the hash of its content once the upload is complete.
+    """
+
+    def __init__(self, media_dir: str, max_size: int):
+        self.media_dir = media_dir
+        self.max_size = max_size
+        self.size = 0
+        self.digest = hashlib.sha256()
+        self.file = tempfile.NamedTemporaryFile(dir=media_dir, suffix=".part", delete=False)
+
+    def write(self, chunk: bytes) -> int:
+        self.size += len(chunk)
+        if self.size > self.max_size:
+            raise RequestEntityTooLarge()
+        self.digest.update(chunk)
+        return self.file.write(chunk)
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        return self.file.seek(offset, whence)
+
+    def save(self, extension: str) -> str:
+        """Move the file to its final name and return that name."""
+        self.file.close()
+        filename = f"{self.digest.hexdigest()}{extension}"
+        path = os.path.join(self.media_dir, filename)
+        if os.path.exists(path):
+            os.remove(self.file.name)
+        else:
+            os.replace(self.file.name, path)
+        return filename
+
+    def discard(self):
+        """Remove the temporary file, unless it was saved."""
+        self.file.close()
+        if os.path.exists(self.file.name):
+            os.remove(self.file.name)
+
+
+def save_upload(stream: BinaryIO, media_dir: str, extension: str, max_size: int) -> str:
+    """Save an uploaded file under the hash of its content and return its file name.
+
+    The file is read in chunks and hashed while it is written to a temporary file, so
+    uploads never have to fit in memory. Uploads larger than `max_size` bytes are
+    rejected with 413. If a file with the same content was uploaded before, the upload
+    is discarded and the existing file is kept.
+    """
+    os.makedirs(media_dir, exist_ok=True)
+    upload = _HashedUpload(media_dir, max_size)
+    try:
+        while chunk := stream.read(_CHUNK_SIZE):
+            upload.write(chunk)
+        return upload.save(extension)
+    finally:
+        upload.discard()
+
+
+def save_form_upload(
+    request: Request, field: str, media_dir: str, extension: str, max_size: int
+) -> str | None:
+    """Save the file `field` of a multipart form request like `save_upload`.
+
+    `request.files` spools every file of the form to a temporary file before the route
+    sees it, so the form is parsed here instead, writing the file straight to the media
+    directory as it arrives. The extension of the uploaded file name is used if it has
+    one, else `extension`. Returns None if the form has no such file, and raises
+    ValueError if it is malformed.
+    """
+    os.makedirs(media_dir, exist_ok=True)
+    uploads: list[_HashedUpload] = []
+
+    def stream_factory(*args, **kwargs):
+        upload = _HashedUpload(media_dir, max_size)
+        uploads.append(upload)
+        return upload
+
+    parser = request.form_data_parser_class(
+        stream_factory=stream_factory,  # type: ignore
+        max_form_memory_size=request.max_form_memory_size,
+        max_content_length=request.max_content_length,
+        max_form_parts=request.max_form_parts,
+        silent=False,
+    )
+    try:
+        _, _, files = parser.parse(
+            request.stream,
+            request.mimetype,
+            request.content_length,
+            request.mimetype_params,
+        )
+        file_storage = files.get(field)
+        if file_storage is None:
+            return None
+        filename = secure_filename(file_storage.filename or "")
+        return file_storage.stream.save(os.path.splitext(filename)[1] or extension)
+    finally:
+        # Other files in the form are not kept
+        for upload in uploads:
+            upload.discard()
+
+
+def send_media(media_dir: str, filename: str):
+    """Send a media file with support for conditional and range requests.
+
+    Files named by their content hash never change, so they get the hash as their ETag
+    and may be cached forever.
+    """
+    if _CONTENT_ADDRESSED.match(filename):
+        response = send_from_directory(
+            media_dir, filename, etag=filename.split(".")[0], max_age=IMMUTABLE_MAX_AGE
+        )
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+    else:
+        response = send_from_directory(media_dir, filename)
+        response.cache_control.no_cache = True
+    return response
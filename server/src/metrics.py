@@ -0,0 +1,292 @@
+from functools import wraps
+import inspect
+import multiprocessing
+import threading
+import time
+from typing import Any, Callable, Iterable
+
+from flask import Flask, g, request
+
+__all__ = [
+    "Counter",
+    "Histogram",
+    "Registry",
+    "REGISTRY",
+    "install_request_metrics",
+    "timed",
+]
+
+LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0
+)  # fmt: skip
+"""Upper bounds of the latency histogram buckets, in seconds."""
+
+Sample = tuple[str, str, str, dict[str, str], float]
+"""The name, type, help text, labels and value of a collected sample."""
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\"")
+
+
+def _labels(names: Iterable[str], values: Iterable[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(int(value)) if float(value).is_integer() else repr(value)
+
+
+class _Metric:
+    """A metric family with one series of shared values per combination of labels.
+
+    The values live in shared memory, so worker processes forked by a production server
+    add to the same series and any of them can report the totals. Series created after
+    the fork are only seen by the process that created them, so the series of known
+    labels should be created at startup, with `labels`.
+    """
+
+    type: str
+    size: int
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._series: dict[tuple[str, ...], Any] = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values: str):
+        """The shared values of the series with the given label values."""
+        series = self._series.get(values)
+        if series is None:
+            with self._lock:
+                series = self._series.get(values)
+                if series is None:
+                    series = multiprocessing.Array("d", self.size)
+                    self._series[values] = series
+        return series
+
+    def expose(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            items = sorted(self._series.items())
+        for values, series in items:
+            with series.get_lock():
+                snapshot = series[:]
+            lines += self._expose(values, snapshot)
+        return lines
+
+    def _expose(self, values: tuple[str, ...], snapshot: list[float]) -> list[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    type = "counter"
+    size = 1
+
+    def inc(self, *values: str, amount: float = 1):
+        series = self.labels(*values)
+        with series.get_lock():
+            series[0] += amount
+
+    def _expose(self, values, snapshot):
+        labels = _labels(self.labelnames, values)
+        return [f"{self.name}_total{labels} {_number(snapshot[0])}"]
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, help, labelnames)
+        self.buckets = buckets
+        # A count per bucket, then the sum and the count of all observations
+        self.size = len(buckets) + 2
+
+    def observe(self, value: float, *values: str):
+        series = self.labels(*values)
+        with series.get_lock():
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    def _expose(self, values, snapshot):
+        lines = []
+        cumulative = 0.0
+        for bound, count in zip(self.buckets, snapshot):
+            cumulative += count
+            labels = _labels(self.labelnames, values, f'le="{_number(bound)}"')
+            lines.append(f"{self.name}_bucket{labels} {_number(cumulative)}")
+        # Observations above the last bound are only in the count
+        labels = _labels(self.labelnames, values, 'le="+Inf"')
+        lines.append(f"{self.name}_bucket{labels} {_number(snapshot[-1])}")
+        labels = _labels(self.labelnames, values)
+        lines.append(f"{self.name}_sum{labels} {_number(snapshot[-2])}")
+        lines.append(f"{self.name}_count{labels} {_number(snapshot[-1])}")
+        return lines
+
+
+class Registry:
+    """The metrics reported by /api/metrics, in the Prometheus text format.
+
+    Besides the registered metrics, collectors report values that are read when the
+    metrics are scraped, such as queue depths.
+    """
+
+    def __init__(self):
+        self.metrics: list[_Metric] = []
+        self.collectors: list[Callable[[], Iterable[Sample]]] = []
+
+    def counter(
+        self, name: str, help: str, labelnames: tuple[str, ...] = ()
+    ) -> Counter:
+        metric = Counter(name, help, labelnames)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(
+        self, name: str, help: str, labelnames: tuple[str, ...] = ()
+    ) -> Histogram:
+        metric = Histogram(name, help, labelnames)
+        self.metrics.append(metric)
+        return metric
+
+    def collector(self, collect: Callable[[], Iterable[Sample]]):
+        """Add a function that yields samples when the metrics are scraped."""
+        self.collectors.append(collect)
+        return collect
+
+    def expose(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines += metric.expose()
+        families: dict[str, tuple[str, str, list[str]]] = {}
+        for collect in self.collectors:
+            for name, type, help, labels, value in collect():
+                series = families.setdefault(name, (type, help, []))[2]
+                sample = name + "_total" if type == "counter" else name
+                series.append(
+                    f"{sample}{_labels(labels.keys(), labels.values())} {_number(value)}"
+                )
+        for name, (type, help, series) in families.items():
+            lines += [f"# HELP {name} {help}", f"# TYPE {name} {type}", *series]
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# Only requests to routes under this prefix are recorded
+_API_PREFIX = "/api/"
+
+REQUEST_DURATION = REGISTRY.histogram(
+    "http_request_duration_seconds",
+    "Time until the response of an API request was ready, by route.",
+    ("route", "method"),
+)
+REQUEST_ERRORS = REGISTRY.counter(
+    "http_request_errors",
+    "API requests that were answered with a server error, by route.",
+    ("route", "method"),
+)
+BACKEND_DURATION = REGISTRY.histogram(
+    "backend_call_duration_seconds",
+    "Duration of calls to the backend clients.",
+    ("backend", "operation"),
+)
+BACKEND_ERRORS = REGISTRY.counter(
+    "backend_call_errors",
+    "Calls to the backend clients that raised an exception.",
+    ("backend", "operation"),
+)
+
+
+def timed(backend: str, operation: str):
+    """Record the duration and the errors of calls to a backend client method.
+
+    Generators are timed until they are exhausted. One that is closed early, e.g. because
+    the client disconnected, is neither timed nor counted as an error.
+    """
+    BACKEND_DURATION.labels(backend, operation)
+    BACKEND_ERRORS.labels(backend, operation)
+
+    def decorator(f):
+        if inspect.isgeneratorfunction(f):
+
+            @wraps(f)
+            def generator(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    yield from f(*args, **kwargs)
+                except GeneratorExit:
+                    raise
+                except BaseException:
+                    BACKEND_ERRORS.inc(backend, operation)
+                    BACKEND_DURATION.observe(
+                        time.perf_counter() - start, backend, operation
+                    )
+                    raise
+                BACKEND_DURATION.observe(time.perf_counter() - start, backend, operation)
+
+            return generator
+
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return f(*args, **kwargs)
+            except BaseException:
+                BACKEND_ERRORS.inc(backend, operation)
+                raise
+            finally:
+                BACKEND_DURATION.observe(time.perf_counter() - start, backend, operation)
+
+        return wrapper
+
+    return decorator
+
+
+def install_request_metrics(app: Flask):
+    """Record the latency and server errors of every request to an API route of the app.
+
+    Only routes under /api/ are recorded, since the admin views add hundreds of routes
+    whose series would make up most of every scrape. Must be called once all routes are
+    registered, and before worker processes are forked, so that the series of every
+    route are shared.
+    """
+    for rule in app.url_map.iter_rules():
+        if not rule.rule.startswith(_API_PREFIX):
+            continue
+        for method in rule.methods or ():
+            if method not in ("HEAD", "OPTIONS"):
+                REQUEST_DURATION.labels(rule.rule, method)
+                REQUEST_ERRORS.labels(rule.rule, method)
+
+    @app.before_request
+    def start_timer():
+        g.request_start = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        # Requests for unknown URLs would add a series per URL, so they are left out
+        rule = request.url_rule
+        if rule is not None and rule.rule.startswith(_API_PREFIX) and "request_start" in g:
+            labels = (rule.rule, request.method)
+            REQUEST_DURATION.observe(time.perf_counter() - g.request_start, *labels)
+            if response.status_code >= 500:
+                REQUEST_ERRORS.inc(*labels)
+        return response
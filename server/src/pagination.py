@@ -0,0 +1,96 @@
+import base64
+import datetime
+import json
+from typing import Any
+
+from sqlalchemy import String, and_, or_, type_coerce
+
+__all__ = [
+    "encode_cursor",
+    "decode_cursor",
+    "decode_offset",
+    "keyset_page",
+    "offset_page",
+]
+
+
+def encode_cursor(position: dict[str, Any]) -> str:
+    """Encode a position in a result list as an opaque, URL-safe cursor."""
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> dict[str, Any]:
+    """Decode a cursor created by `encode_cursor`. Raises ValueError if it is invalid."""
+    if not cursor:
+        return {}
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception:
+        raise ValueError(f"Invalid cursor '{cursor}'")
+    if not isinstance(position, dict):
+        raise ValueError(f"Invalid cursor '{cursor}'")
+    return position
+
+
+def decode_offset(cursor: str) -> int:
+    """Decode a cursor created by `offset_page`. Raises ValueError if it is invalid."""
+    position = decode_cursor(cursor)
+    offset = position.get("offset", 0)
+    # Cursors of `keyset_page` have no offset, but must not silently restart at 0
+    valid = isinstance(offset, int) and not isinstance(offset, bool) and offset >= 0
+    if not valid or "key" in position:
+        raise ValueError(f"Invalid cursor '{cursor}'")
+    return offset
+
+
+def keyset_page(query, key, id_column, descending: bool, cursor: str, limit: int):
+    """Get the page of `query` that follows `cursor`, ordered by `key` and then by ID.
+
+    Instead of skipping rows with OFFSET, the page starts right after the sort key and ID
+    of the last row of the previous page, so every page costs the same no matter how deep
+    it is. Returns the rows and the cursor of the next page, or None on the last page.
+    """
+    # Compare and encode the sort key as it is stored, so that values round-trip exactly
+    # (SQLite stores datetimes as text in more than one format).
+    raw_key = type_coerce(key, String)
+    position = decode_cursor(cursor)
+    if position:
+        if "key" not in position or "id" not in position:
+            raise ValueError(f"Invalid cursor '{cursor}'")
+        if descending:
+            after = or_(
+                raw_key < position["key"],
+                and_(raw_key == position["key"], id_column < position["id"]),
+            )
+        else:
+            after = or_(
+                raw_key > position["key"],
+                and_(raw_key == position["key"], id_column > position["id"]),
+            )
+        query = query.filter(after)
+
+    if descending:
+        query = query.order_by(key.desc(), id_column.desc())
+    else:
+        query = query.order_by(key.asc(), id_column.asc())
+
+    rows = query.add_columns(raw_key, id_column).limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last_key, last_id = rows[-1][-2], rows[-1][-1]
+        if isinstance(last_key, (datetime.date, datetime.datetime)):
+            last_key = last_key.isoformat(" ")
+        next_cursor = encode_cursor({"key": last_key, "id": last_id})
+    return [row[0] for row in rows], next_cursor
+
+
+def offset_page(query, cursor: str, limit: int):
+    """Like `keyset_page`, for orderings that have no stable key, such as relevance."""
+    offset = decode_offset(cursor)
+    rows = query.offset(offset).limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor({"offset": offset + limit})
+    return rows, next_cursor
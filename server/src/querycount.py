@@ -0,0 +1,55 @@
+from contextlib import contextmanager
+import threading
+
+from flask import Flask, g, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+__all__ = ["count_queries", "install_query_count_header"]
+
+_local = threading.local()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    counters = getattr(_local, "counters", None)
+    if counters:
+        for counter in counters:
+            counter[0] += 1
+    if has_request_context() and "query_count" in g:
+        g.query_count += 1
+
+
+event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+
+
+@contextmanager
+def count_queries():
+    """Count the SQL statements executed on the current thread.
+
+    Yields a one-element list that holds the running count, e.g.
+
+        with count_queries() as count:
+            client.get("/api/notes?n=100")
+        assert count[0] <= 4
+    """
+    counter = [0]
+    counters = _local.__dict__.setdefault("counters", [])
+    counters.append(counter)
+    try:
+        yield counter
+    finally:
+        counters.remove(counter)
+
+
+def install_query_count_header(app: Flask):
+    """Report the number of SQL statements each request ran in an X-Query-Count header."""
+
+    @app.before_request
+    def start_query_count():
+        g.query_count = 0
+
+    @app.after_request
+    def add_query_count_header(response):
+        if "query_count" in g:
+            response.headers["X-Query-Count"] = str(g.query_count)
+        return response
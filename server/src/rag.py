@@ -0,0 +1,89 @@
+from .chunking import estimate_tokens
+
+__all__ = ["rag_messages", "Retriever"]
+
+
+def rag_messages(query: str, context: str) -> list[dict[str, str]]:
+    """The chat messages that ask the chat model which notes are relevant to a query."""
+    return [
+        {
+            "role": "system",
+            "content": """You are an AI assistant that retrieves notes based on user queries.
+            You will be given a query and a list of notes. You need to select which notes (if any) are relevant to the query.
+            Each note has a title, an ID, and excerpts from its content. Please provide your response as a comma-separated list of note IDs that are relevant to the query.
+            For example, if notes with IDs 1, 2, and 3 are relevant, your response should be "1, 2, 3". If no notes are relevant, respond with "None".
+            Do not say anything else in your response, or the user will not be able to parse it.""",
+        },
+        {
+            "role": "user",
+            "content": f"""Here is my query: "{query}"
+            Here are the notes to analyze:
+            {context}
+
+
+            Now please consider the notes above and provide a list of comma-separated note IDs relevant to the query "{query}", or "None" if no notes are relevant. Do not say anything else in your response.""",
+        },
+    ]
+
+
+class Retriever:
+    """Finds the notes that may answer a query and builds a bounded prompt context for them.
+
+    Instead of whole notes, the context holds the chunks of each note that are nearest to
+    the query. Chunks beyond the maximum distance, if one is configured, are dropped, and
+    snippets are added one rank at a time, the best snippet of every note first, until the
+    token budget is spent.
+    """
+
+    def __init__(self, server):
+        self.server = server
+        config = server.config["rag"]
+        self.max_distance: float | None = config["max_distance"] or None
+        self.context_tokens: int = config["context_tokens"]
+        self.snippets_per_note: int = config["snippets_per_note"]
+
+    def candidates(
+        self, query: str, n_results: int, max_distance: float | None = None
+    ) -> dict[int, list[str]]:
+        """Get the snippets of the notes nearest to a query, nearest notes first."""
+        server = self.server
+        if max_distance is None:
+            max_distance = self.max_distance
+        query_embedding = server.ollama_client.embed(query)
+        chunks = server.vector_store.query_chunks(
+            query_embedding,
+            n_results=n_results * server.vector_store.CHUNKS_PER_NOTE,
+            max_distance=max_distance,
+        )
+        snippets: dict[int, list[str]] = {}
+        for note_id, doc, _ in chunks:
+            if note_id not in snippets:
+                if len(snippets) == n_results:
+                    continue
+                snippets[note_id] = []
+            if len(snippets[note_id]) < self.snippets_per_note:
+                # Chunks start with the note's title, which is listed separately
+                snippets[note_id].append(doc.partition("\n")[2])
+        return snippets
+
+    def context(self, snippets: dict[int, list[str]], titles: dict[int, str]) -> str:
+        """Format the snippets of notes for the prompt, within the token budget."""
+        budget = self.context_tokens
+        selected: dict[int, list[str]] = {}
+        for rank in range(self.snippets_per_note):
+            for note_id, note_snippets in snippets.items():
+                if note_id not in titles or rank >= len(note_snippets):
+                    continue
+                snippet = " ".join(note_snippets[rank].split())
+                cost = estimate_tokens(snippet)
+                if note_id not in selected:
+                    cost += estimate_tokens(f"Note ID: {note_id} Title: {titles[note_id]}")
+                if cost > budget:
+                    continue
+                budget -= cost
+                selected.setdefault(note_id, []).append(snippet)
+        return "\n\n".join(
+            f"Note ID: {note_id}\n    Title: {titles[note_id]}\n"
+            + "\n".join(f"    Excerpt: {snippet}" for snippet in note_snippets)
+            for note_id, note_snippets in selected.items()
+        )
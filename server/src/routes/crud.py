@@ -1,87 +1,123 @@
-import datetime
-from flask import request, send_from_directory
-import os
-from sqlalchemy import case, func
+from flask import request
+import math
+import mimetypes
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
 
 from .. import get_server
 from ..db_model import Note, Tag, Media
+from ..media import save_form_upload, save_upload, send_media
+from ..pagination import decode_offset, encode_cursor, keyset_page, offset_page
 
 app = get_server().app
 db = get_server().db
 config = get_server().config
 ollama_client = get_server().ollama_client
-chromadb_client = get_server().chromadb_client
+embedding_queue = get_server().embedding_queue
+search_index = get_server().search_index
+hybrid_search = get_server().hybrid_search
 
 # Routes for notes
 
 
+# Sort modes as (sort key, descending). Notes that were never opened sort by creation.
+SORT_KEYS = {
+    "created": (Note.created_at, True),
+    "modified": (Note.last_modified, True),
+    "opened": (func.coalesce(Note.last_opened, Note.created_at), True),
+    "title": (func.lower(Note.title), False),
+}
+
+
 @app.route("/api/notes", methods=["GET"])
 def get_notes():
     search_query = request.args.get("q")
+    search_mode = request.args.get("mode")
     sort_mode = request.args.get("sort")
     tags = request.args.get("tags")
     results_per_page = int(request.args.get("n", 10))
     page = int(request.args.get("page", 1))
+    # Passing a cursor (empty for the first page) selects cursor-based pagination
+    cursor = request.args.get("cursor")
+    # Counting runs over the whole result set, so it is opt-in for cursor pagination
+    with_count = request.args.get("count", "0" if cursor is not None else "1") == "1"
 
-    notes = Note.query
+    notes = Note.with_relations()
 
     if tags:
         tag_ids = [int(tag_id) for tag_id in tags.split(",")]
         for tag_id in tag_ids:
             notes = notes.filter(Note.tags.any(Tag.id == tag_id))
 
-    if search_query:
-        title_matches = Note.query.filter(Note.title.ilike(f"%{search_query}%"))
-        title_score = case(
-            (func.lower(Note.title).startswith(func.lower(search_query)), 1000),
-            else_=(
-                func.char_length(Note.title)
-                - func.char_length(
-                    func.replace(func.lower(Note.title), func.lower(search_query), "")
-                )
-            ),
-        )
-
-        content_matches = Note.query.filter(Note.content.ilike(f"%{search_query}%"))
-        content_score = func.char_length(Note.content) - func.char_length(
-            func.replace(func.lower(Note.content), func.lower(search_query), "")
-        )
-        notes = title_matches.union(content_matches).distinct()
-
-        # TODO this is too slow and too inaccurate
-        # query the embeddings
-        # query_embedding = ollama_client.embed(search_query)
-        # ids, distances = chromadb_client.query(query_embedding, n_results=20)
-        # distance_map = dict(zip(ids, distances))
-        # if len(ids) > 0:
-        #     semantic_matches = Note.query.filter(Note.id.in_(ids))
-        #     # calculate semantic score using distance map, notes not in distance map = 0 score
-        #     semantic_score = case(distance_map, value=Note.id, else_=1000)
-        #     notes = notes.union(semantic_matches).distinct()
-        #     if sort_mode == "relevance":
-        #         notes = notes.order_by(
-        #             title_score.desc(), content_score.desc(), semantic_score.asc()
-        #         )
-        # elif sort_mode == "relevance":
-        #     notes = notes.order_by(title_score.desc(), content_score.desc())
-
+    relevance = None
+    if search_query and search_mode == "hybrid":
+        ranked_ids = hybrid_search.search(notes, search_query)
         if sort_mode == "relevance":
-            notes = notes.order_by(title_score.desc(), content_score.desc())
-
-    if sort_mode == "created":
-        notes = notes.order_by(Note.created_at.desc())
-    elif sort_mode == "modified":
-        notes = notes.order_by(Note.last_modified.desc())
-    elif sort_mode == "opened":
-        notes = notes.order_by(Note.last_opened.desc())
-    elif sort_mode == "title":
-        # ignore case when sorting by title
-        notes = notes.order_by(func.lower(Note.title))
-
-    pagination = notes.paginate(page=page, per_page=results_per_page, count=True)
+            # The ranking comes from Python, so paginate it here instead of in SQL
+            return ranked_notes_page(ranked_ids, page, cursor, results_per_page)
+        notes = notes.filter(Note.id.in_(ranked_ids))
+    elif search_query:
+        notes, relevance = search_index.search(notes, search_query)
+
+    if cursor is not None:
+        try:
+            if sort_mode == "relevance" and relevance is not None:
+                notes_page, next_cursor = offset_page(
+                    notes.order_by(*relevance, Note.id), cursor, results_per_page
+                )
+            else:
+                key, descending = SORT_KEYS.get(sort_mode, (Note.id, True))
+                notes_page, next_cursor = keyset_page(
+                    notes, key, Note.id, descending, cursor, results_per_page
+                )
+        except ValueError as e:
+            return {"error": str(e)}, 400
+        result = {
+            "notes": [note.to_dict() for note in notes_page],
+            "next_cursor": next_cursor,
+        }
+        if with_count:
+            result["total"] = notes.order_by(None).count()
+        return result
+
+    if sort_mode == "relevance" and relevance is not None:
+        notes = notes.order_by(*relevance)
+    elif sort_mode in SORT_KEYS:
+        key, descending = SORT_KEYS[sort_mode]
+        notes = notes.order_by(key.desc() if descending else key.asc())
+
+    pagination = notes.paginate(page=page, per_page=results_per_page, count=with_count)
     notes = pagination.items
-    total_pages = pagination.pages
-    return {"notes": [note.to_dict() for note in notes], "pages": total_pages}
+    result = {"notes": [note.to_dict() for note in notes]}
+    if with_count:
+        result["pages"] = pagination.pages
+    return result
+
+
+def ranked_notes_page(ranked_ids: list[int], page: int, cursor: str | None, n: int):
+    """Serialize one page of notes from a list of note IDs ranked in Python."""
+    if cursor is not None:
+        try:
+            offset = decode_offset(cursor)
+        except ValueError as e:
+            return {"error": str(e)}, 400
+    else:
+        offset = (page - 1) * n
+    page_ids = ranked_ids[offset : offset + n]
+    notes_by_id = {
+        note.id: note for note in Note.with_relations().filter(Note.id.in_(page_ids))
+    }
+    # Notes deleted since they were ranked are left out
+    result = {
+        "notes": [notes_by_id[id].to_dict() for id in page_ids if id in notes_by_id]
+    }
+    if cursor is not None:
+        more = offset + n < len(ranked_ids)
+        result["next_cursor"] = encode_cursor({"offset": offset + n}) if more else None
+        result["total"] = len(ranked_ids)
+    else:
+        result["pages"] = math.ceil(len(ranked_ids) / n)
+    return result
 
 
 @app.route("/api/notes/<int:note_id>", methods=["GET"])
@@ -94,6 +130,8 @@ def get_note(note_id):
 def create_note():
     note = Note.new_note()
     db.session.add(note)
+    db.session.flush()
+    embedding_queue.enqueue(note.id)
     db.session.commit()
     return note.to_dict(), 201
 
@@ -110,6 +148,8 @@ def update_note(note_id):
                 print(f"Invalid key for note '{key}'")
                 return {"error": f"Invalid key '{key}'"}, 400
     note.last_modified = func.now()
+    if data is not None and ("title" in data or "content" in data):
+        embedding_queue.enqueue(note.id)
     db.session.commit()
     return note.to_dict()
 
@@ -118,8 +158,8 @@ def update_note(note_id):
 def delete_note(note_id):
     note = Note.query.get_or_404(note_id)
     db.session.delete(note)
+    embedding_queue.enqueue(note_id, delay=False)
     db.session.commit()
-    chromadb_client.remove([str(note_id)])
     return "", 204
 
 
@@ -213,8 +253,23 @@ def remove_tag_from_note(note_id, tag_id):
 @app.route("/api/tags/<int:tag_id>/notes", methods=["GET"])
 def get_tag_notes(tag_id):
     tag = Tag.query.get_or_404(tag_id)
-    notes = Note.query.filter(Note.tags.contains(tag)).all()
-    return {"notes": [note.to_dict() for note in notes]}
+    sort_mode = request.args.get("sort", "modified")
+    results_per_page = int(request.args.get("n", 10))
+    cursor = request.args.get("cursor", "")
+    with_count = request.args.get("count", "0") == "1"
+
+    notes = Note.with_relations().filter(Note.tags.contains(tag))
+    key, descending = SORT_KEYS.get(sort_mode, (Note.id, True))
+    try:
+        notes_page, next_cursor = keyset_page(
+            notes, key, Note.id, descending, cursor, results_per_page
+        )
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    result = {"notes": [note.to_dict() for note in notes_page], "next_cursor": next_cursor}
+    if with_count:
+        result["total"] = notes.order_by(None).count()
+    return result
 
 
 # Routes for media
@@ -223,28 +278,43 @@ def get_tag_notes(tag_id):
 @app.route("/api/media/<int:media_id>", methods=["GET"])
 def get_media(media_id):
     media = Media.query.get_or_404(media_id)
-    media_dir = os.path.join(os.getcwd(), config["api"]["media_path"])
-    return send_from_directory(media_dir, media.path)
+    return send_media(Media.directory(), media.path)
 
 
 @app.route("/api/media", methods=["POST"])
 def upload_media():
-    if "webm" not in request.files:
-        return {"error": "No file part"}, 400
-
-    file_storage = request.files["webm"]
-
-    media_dir = config["api"]["media_path"]
-    os.makedirs("media", exist_ok=True)
-
-    filename = f"{int(datetime.datetime.now().timestamp() * 1000)}.webm"
-    save_path = os.path.join(os.getcwd(), media_dir, filename)
-    file_storage.save(save_path)
-
-    media = Media.new_media(filename)
+    # Recordings are sent as a multipart form with a "webm" file, or as the raw body
+    if request.mimetype == "multipart/form-data":
+        try:
+            filename = save_form_upload(
+                request,
+                "webm",
+                Media.directory(),
+                ".webm",
+                config["api"]["max_upload_size"],
+            )
+        except ValueError:
+            return {"error": "Invalid form"}, 400
+        if filename is None:
+            return {"error": "No file part"}, 400
+    else:
+        filename = save_upload(
+            request.stream,
+            Media.directory(),
+            mimetypes.guess_extension(request.mimetype) or ".webm",
+            config["api"]["max_upload_size"],
+        )
 
-    db.session.add(media)
-    db.session.commit()
+    media = Media.query.filter_by(path=filename).first()
+    if media is None:
+        try:
+            media = Media.new_media(filename)
+            db.session.add(media)
+            db.session.commit()
+        except IntegrityError:
+            # Another worker stored the same content at the same time
+            db.session.rollback()
+            media = Media.query.filter_by(path=filename).one()
     return {"id": media.id}
 
 
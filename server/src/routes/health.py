@@ -1,10 +1,17 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import Response, request
+
 from .. import get_server
-from ..db_model import Note, Tag, Media
+from ..backends import ChromadbBackend, OllamaBackend, WhisperBackend
+from ..db_model import EmbeddingTask, Note, Tag, Media
+from ..metrics import REGISTRY
 
 app = get_server().app
-chromadb_client = get_server().chromadb_client
+vector_store = get_server().vector_store
 ollama_client = get_server().ollama_client
 whisper_client = get_server().whisper_client
+config = get_server().config
 
 
 def get_db_health():
@@ -18,6 +25,92 @@ def get_db_health():
         return "DOWN"
 
 
+def get_backend_health() -> dict[str, str]:
+    """Probe every backend at once, with short timeouts."""
+    probes = {}
+    if config["vectors"]["store"] == "chromadb":
+        probes["chromadb"] = (ChromadbBackend, config["chromadb"])
+    probes["ollama"] = (OllamaBackend, config["ollama"])
+    whisper = config["whisper"]
+    for i, port in enumerate(WhisperBackend.ports(whisper)):
+        name = "whisper" if i == 0 else f"whisper-{i}"
+        probes[name] = (WhisperBackend, {**whisper, "port": port})
+
+    with ThreadPoolExecutor(max_workers=len(probes)) as pool:
+        alive = {
+            name: pool.submit(backend._alive, cfg["host"], cfg["port"])
+            for name, (backend, cfg) in probes.items()
+        }
+        health = {name: "UP" if up.result() else "DOWN" for name, up in alive.items()}
+    if "chromadb" not in health:
+        health["vectors"] = "UP" if vector_store.alive() else "DOWN"
+    return health
+
+
 @app.route("/api/health", methods=["GET"])
 def health():
-    return {"status": "UP"}
+    if request.args.get("deep", "0") != "1":
+        return {"status": "UP"}
+    status = {"database": get_db_health(), **get_backend_health()}
+    is_up = all(value == "UP" for value in status.values())
+    return {"status": "UP" if is_up else "DOWN", **status}, 200 if is_up else 503
+
+
+@app.route("/api/health/ready", methods=["GET"])
+def ready():
+    jobs = get_server().jobs
+    is_ready = all(job.ready for job in jobs.values())
+    status = {
+        "ready": is_ready,
+        "jobs": {name: job.to_dict() for name, job in jobs.items()},
+    }
+    return status, 200 if is_ready else 503
+
+
+@REGISTRY.collector
+def collect_queues():
+    yield (
+        "embedding_queue_depth",
+        "gauge",
+        "Notes waiting for their embeddings to be refreshed.",
+        {},
+        EmbeddingTask.query.count(),
+    )
+    stats = get_server().transcription_queue.stats()
+    for status in ["pending", "running"]:
+        yield (
+            "transcription_jobs",
+            "gauge",
+            "Transcription jobs waiting for a worker or being transcribed.",
+            {"status": status},
+            stats[status],
+        )
+
+
+@REGISTRY.collector
+def collect_caches():
+    caches = {
+        "embeddings": get_server().embedding_cache.stats(),
+        "summaries": get_server().summarizer.stats(),
+    }
+    for cache, stats in caches.items():
+        for result in ["hit", "miss"]:
+            yield (
+                "cache_lookups",
+                "counter",
+                "Cache lookups by whether they were answered from the cache.",
+                {"cache": cache, "result": result},
+                stats["hits" if result == "hit" else "misses"],
+            )
+        yield (
+            "cache_hit_ratio",
+            "gauge",
+            "The share of cache lookups that were answered from the cache.",
+            {"cache": cache},
+            stats["hit_rate"],
+        )
+
+
+@app.route("/api/metrics", methods=["GET"])
+def metrics():
+    return Response(REGISTRY.expose(), mimetype="text/plain; version=0.0.4")
@@ -1,26 +1,36 @@
-import os
 from flask import request
 
 from .. import get_server
-from ..db_model import Note, Media
+from ..db_model import Note, Media, Transcript, TranscriptionJob
+from ..jobs import requires_jobs
+from ..rag import rag_messages
+from ..streaming import ndjson_response, wants_stream
 
 
 app = get_server().app
 db = get_server().db
-chromadb_client = get_server().chromadb_client
 ollama_client = get_server().ollama_client
-whisper_client = get_server().whisper_client
+transcription_queue = get_server().transcription_queue
+embedding_queue = get_server().embedding_queue
+summarizer = get_server().summarizer
+retriever = get_server().retriever
 config = get_server().config
 
 # Chat with LLM
 
 
 @app.route("/api/chat", methods=["POST"])
+@requires_jobs("chat_model")
 def chat():
     data = request.json
     if data is None or "messages" not in data:
         return {"error": "Invalid request"}, 400
     messages = data["messages"]
+    if wants_stream(data):
+        return ndjson_response(
+            {"role": "assistant", "content": content}
+            for content in ollama_client.chat_stream(messages)
+        )
     response = ollama_client.chat(messages)
     return response["message"]
 
@@ -29,29 +39,18 @@ def chat():
 
 
 @app.route("/api/summarize", methods=["POST"])
+@requires_jobs("chat_model")
 def summarize():
     data = request.json
     if data is None or "text" not in data:
         return {"error": "Invalid request"}, 400
     text = data["text"]
-    messages = [
-        {
-            "role": "system",
-            "content": """You are an AI assistant that summarizes notes. 
-            You will be given a note to summarize. 
-            Please provide a summary of the note. 
-            Do not say anything else in your response, or the user will not be able to parse it.""",
-        },
-        {
-            "role": "user",
-            "content": f"""Here is the note to summarize: "{text}" 
-
-            
-            Please provide a summary of the note. Do not say anything else in your response.""",
-        },
-    ]
-    summary = ollama_client.chat(messages)["message"]["content"]
-    return {"summary": summary}
+    note_id = data.get("noteId")
+    if wants_stream(data):
+        return ndjson_response(
+            {"summary": content} for content in summarizer.summarize_stream(text, note_id)
+        )
+    return {"summary": summarizer.summarize(text, note_id)}
 
 
 # Note embedding
@@ -59,10 +58,10 @@ def summarize():
 
 @app.route("/api/embed/<int:note_id>", methods=["POST"])
 def update_note_embedding(note_id):
+    # Notes are re-embedded automatically when they change, this only skips the debounce
     note = Note.query.get_or_404(note_id)
-    doc = f"{note.title}\n{note.content}"
-    embedding = ollama_client.embed(doc)
-    chromadb_client.add([str(note.id)], [doc], [embedding])
+    embedding_queue.enqueue(note.id, delay=False)
+    db.session.commit()
     return note.to_dict()
 
 
@@ -70,46 +69,36 @@ def update_note_embedding(note_id):
 
 
 @app.route("/api/rag", methods=["POST"])
+@requires_jobs("chat_model", "embed_model", "embeddings")
 def rag():
     data = request.json
     if data is None or "query" not in data:
         return {"error": "Invalid request"}, 400
     query = data["query"]
     n_results = data.get("nResults", 10)
-    query_embedding = ollama_client.embed(query)
-    ids, distances = chromadb_client.query(query_embedding, n_results=n_results)
-    notes = Note.query.filter(Note.id.in_(ids)).all()
-
-    messages = [
-        {
-            "role": "system",
-            "content": """You are an AI assistant that retrieves notes based on user queries. 
-            You will be given a query and a list of notes. You need to select which notes (if any) are relevant to the query.
-            Each note has a title, content, and an ID. Please provide your response as a comma-separated list of note IDs that are relevant to the query.
-            For example, if notes with IDs 1, 2, and 3 are relevant, your response should be "1, 2, 3". If no notes are relevant, respond with "None".
-            Do not say anything else in your response, or the user will not be able to parse it.""",
-        },
-        {
-            "role": "user",
-            "content": f"""Here is my query: "{query}" 
-            Here are the notes to analyze:
-            {"\n\n".join([f"Note ID: {note.id}\n    Title: {note.title}\n    Content: {' '.join(note.content.splitlines())}" for note in notes])}
-            
-            
-            Now please consider the notes above and provide a list of comma-separated note IDs relevant to the query "{query}", or "None" if no notes are relevant. Do not say anything else in your response.""",
-        },
-    ]
+    snippets = retriever.candidates(query, n_results, data.get("maxDistance"))
+    titles = dict(
+        db.session.query(Note.id, Note.title).filter(Note.id.in_(snippets)).all()
+    )
+    context = retriever.context(snippets, titles)
+    # Without any excerpts within the budget there is nothing for the chat model to pick
+    if not context:
+        return {"notes": []}
+
+    messages = rag_messages(query, context)
     response = ollama_client.chat(messages)
     content = response["message"]["content"]
 
     try:
         if content.lower() == "none":
-            notes = []
+            note_ids = []
         else:
-            note_ids = [int(id) for id in content.split(",")]
-            notes = Note.query.filter(Note.id.in_(note_ids)).all()
+            # Only accept IDs of notes that were actually shown to the model
+            note_ids = [int(id) for id in content.split(",") if int(id) in titles]
     except Exception:
         print(f"Error extracting note IDs from response '{content}'")
+        note_ids = list(titles)
+    notes = Note.with_relations().filter(Note.id.in_(note_ids)).all()
 
     return {"notes": [note.to_dict() for note in notes]}
 
@@ -117,12 +106,47 @@ def rag():
 # Transcription
 
 
+@app.route("/api/transcriptions", methods=["POST"])
+def submit_transcription():
+    data = request.json
+    if data is None or "mediaId" not in data:
+        return {"error": "Invalid request"}, 400
+    media = Media.query.get_or_404(data["mediaId"])
+    job = transcription_queue.submit(media.id)
+    db.session.commit()
+    return job.to_dict(), 200 if job.finished else 202
+
+
+@app.route("/api/transcriptions", methods=["GET"])
+def get_transcription_queue():
+    return transcription_queue.stats()
+
+
+@app.route("/api/transcriptions/<int:job_id>", methods=["GET"])
+def get_transcription(job_id: int):
+    job = TranscriptionJob.query.get_or_404(job_id)
+    if wants_stream(request.args):
+        # Report every status change until the job has finished
+        return ndjson_response(
+            job.to_dict() for job in transcription_queue.watch(job_id)
+        )
+    return job.to_dict()
+
+
+@app.route("/api/media/<int:media_id>/transcript", methods=["GET"])
+def get_transcript(media_id: int):
+    transcript = Transcript.query.get_or_404(media_id)
+    return {"text": transcript.text, "segments": transcript.segments}
+
+
 @app.route("/api/transcribe/<int:media_id>", methods=["POST"])
 def transcribe(media_id: int):
+    # Kept for older clients, which get the transcript in the response if the media file
+    # was already transcribed. Otherwise they poll the job, since waiting for it would
+    # hold up a request worker for as long as the transcription takes.
     media = Media.query.get_or_404(media_id)
-    media_path = os.path.join(os.getcwd(), config["api"]["media_path"], media.path)
-    try:
-        text = whisper_client.transcribe(media_path)
-        return {"text": text}
-    except Exception as e:
-        return {"error": str(e)}, 500
+    job = transcription_queue.submit(media.id)
+    db.session.commit()
+    if job.status == job.DONE:
+        return {"text": job.to_dict()["text"]}
+    return job.to_dict(), 202
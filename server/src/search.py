@@ -0,0 +1,250 @@
+from abc import ABC
+from concurrent.futures import ThreadPoolExecutor
+import re
+import time
+import traceback
+
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import case, false, func, literal_column, text
+
+__all__ = [
+    "SearchIndex",
+    "SqliteSearchIndex",
+    "PostgresSearchIndex",
+    "LikeSearchIndex",
+    "get_search_index",
+    "reciprocal_rank_fusion",
+    "HybridSearch",
+]
+
+
+def _terms(search_query: str) -> list[str]:
+    """Split a search query into words, dropping any full-text query syntax."""
+    return re.findall(r"\w+", search_query.lower())
+
+
+class SearchIndex(ABC):
+    """Abstract base class for full-text search over note titles and contents."""
+
+    def __init__(self, db: SQLAlchemy):
+        self.db = db
+
+    def setup(self) -> None:
+        """Create the index if it does not exist yet. Must be called in an app context."""
+        raise NotImplementedError
+
+    def search(self, notes, search_query: str):
+        """Restrict a note query to notes matching `search_query`.
+
+        Every word of the query must match a word in the note, either exactly or as a
+        prefix. Returns the filtered query and a list of order-by clauses that sort the
+        most relevant notes first.
+        """
+        raise NotImplementedError
+
+
+class SqliteSearchIndex(SearchIndex):
+    """Full-text search with an FTS5 table that is kept in sync with notes by triggers."""
+
+    def setup(self):
+        with self.db.engine.begin() as conn:
+            exists = conn.execute(
+                text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'note_fts'")
+            ).first()
+            conn.execute(
+                text(
+                    """CREATE VIRTUAL TABLE IF NOT EXISTS note_fts USING fts5(
+                        title, content,
+                        content='note', content_rowid='id',
+                        tokenize='unicode61 remove_diacritics 2', prefix='2 3 4'
+                    )"""
+                )
+            )
+            conn.execute(
+                text(
+                    """CREATE TRIGGER IF NOT EXISTS note_fts_insert AFTER INSERT ON note BEGIN
+                        INSERT INTO note_fts(rowid, title, content)
+                        VALUES (new.id, new.title, new.content);
+                    END"""
+                )
+            )
+            conn.execute(
+                text(
+                    """CREATE TRIGGER IF NOT EXISTS note_fts_delete AFTER DELETE ON note BEGIN
+                        INSERT INTO note_fts(note_fts, rowid, title, content)
+                        VALUES ('delete', old.id, old.title, old.content);
+                    END"""
+                )
+            )
+            conn.execute(
+                text(
+                    """CREATE TRIGGER IF NOT EXISTS note_fts_update
+                    AFTER UPDATE OF title, content ON note BEGIN
+                        INSERT INTO note_fts(note_fts, rowid, title, content)
+                        VALUES ('delete', old.id, old.title, old.content);
+                        INSERT INTO note_fts(rowid, title, content)
+                        VALUES (new.id, new.title, new.content);
+                    END"""
+                )
+            )
+            if not exists:
+                # Index the notes that were written before the index existed
+                conn.execute(text("INSERT INTO note_fts(note_fts) VALUES ('rebuild')"))
+
+    def search(self, notes, search_query):
+        from .db_model import Note
+
+        terms = _terms(search_query)
+        if not terms:
+            return notes.filter(false()), [Note.id]
+        match = " ".join(f'"{term}"*' for term in terms)
+        # BM25 with title matches weighted higher than content matches
+        matches = (
+            text(
+                """SELECT rowid AS note_id, bm25(note_fts, 10.0, 1.0) AS rank
+                FROM note_fts WHERE note_fts MATCH :match"""
+            )
+            .bindparams(match=match)
+            .columns(note_id=self.db.Integer, rank=self.db.Float)
+            .subquery("note_fts_match")
+        )
+        notes = notes.join(matches, Note.id == matches.c.note_id)
+        return notes, [matches.c.rank.asc()]
+
+
+class PostgresSearchIndex(SearchIndex):
+    """Full-text search with a GIN index on a tsvector expression over notes."""
+
+    # Must match the indexed expression exactly for the index to be used
+    vector = literal_column("to_tsvector('simple', note.title || ' ' || note.content)")
+
+    def setup(self):
+        with self.db.engine.begin() as conn:
+            conn.execute(
+                text(
+                    """CREATE INDEX IF NOT EXISTS note_fts ON note
+                    USING GIN (to_tsvector('simple', title || ' ' || content))"""
+                )
+            )
+
+    def search(self, notes, search_query):
+        from .db_model import Note
+
+        terms = _terms(search_query)
+        if not terms:
+            return notes.filter(false()), [Note.id]
+        query = func.to_tsquery("simple", " & ".join(f"{term}:*" for term in terms))
+        notes = notes.filter(self.vector.op("@@")(query))
+        return notes, [func.ts_rank_cd(self.vector, query).desc()]
+
+
+class LikeSearchIndex(SearchIndex):
+    """Fallback for other databases that matches notes with case-insensitive LIKE scans."""
+
+    def setup(self):
+        pass
+
+    def search(self, notes, search_query):
+        from .db_model import Note
+
+        notes = notes.filter(
+            Note.title.ilike(f"%{search_query}%") | Note.content.ilike(f"%{search_query}%")
+        )
+        title_score = case(
+            (func.lower(Note.title).startswith(func.lower(search_query)), 1000),
+            else_=(
+                func.char_length(Note.title)
+                - func.char_length(
+                    func.replace(func.lower(Note.title), func.lower(search_query), "")
+                )
+            ),
+        )
+        content_score = func.char_length(Note.content) - func.char_length(
+            func.replace(func.lower(Note.content), func.lower(search_query), "")
+        )
+        return notes, [title_score.desc(), content_score.desc()]
+
+
+def get_search_index(db: SQLAlchemy) -> SearchIndex:
+    """Get the search index for the configured database. Must be called in an app context."""
+    dialect = db.engine.dialect.name
+    if dialect == "sqlite":
+        return SqliteSearchIndex(db)
+    if dialect == "postgresql":
+        return PostgresSearchIndex(db)
+    return LikeSearchIndex(db)
+
+
+def reciprocal_rank_fusion(*rankings: list[int], k: int = 60) -> list[int]:
+    """Merge ranked lists of IDs, scoring each ID by the sum of 1 / (k + rank)."""
+    scores: dict[int, float] = {}
+    for ranking in rankings:
+        for rank, id in enumerate(ranking, start=1):
+            scores[id] = scores.get(id, 0.0) + 1 / (k + rank)
+    return sorted(scores, key=scores.__getitem__, reverse=True)
+
+
+class HybridSearch:
+    """Combines full-text matches with a nearest neighbor search over note embeddings.
+
+    The semantic half (embedding the query and querying the vector database) runs on a
+    thread pool while the lexical half runs on the calling thread, and the two rankings
+    are merged with reciprocal rank fusion. If the semantic half does not finish within
+    the latency budget, only the lexical results are returned.
+    """
+
+    def __init__(self, server):
+        self.server = server
+        config = server.config["search"]
+        self.candidates: int = config["hybrid_candidates"]
+        self.budget: float = config["hybrid_budget"]
+        self.rrf_k: int = config["rrf_k"]
+        self.pool = ThreadPoolExecutor(
+            max_workers=config["hybrid_workers"], thread_name_prefix="hybrid-search"
+        )
+
+    def search(self, notes, search_query: str) -> list[int]:
+        """Get the IDs of notes in the `notes` query that match `search_query`, best first."""
+        from .db_model import Note
+
+        start = time.monotonic()
+        semantic = None
+        if all(self.server.jobs[name].ready for name in ("embed_model", "embeddings")):
+            semantic = self.pool.submit(self._semantic_ids, search_query)
+
+        matches, relevance = self.server.search_index.search(notes, search_query)
+        lexical_ids = [
+            id
+            for (id,) in matches.with_entities(Note.id)
+            .order_by(*relevance)
+            .limit(self.candidates)
+        ]
+        if semantic is None:
+            return lexical_ids
+
+        try:
+            semantic_ids = semantic.result(
+                timeout=max(self.budget - (time.monotonic() - start), 0)
+            )
+        except TimeoutError:
+            # The query embedding is still cached once it finishes, so a repeated query
+            # is likely to make it within the budget
+            print(f"Semantic search for '{search_query}' exceeded the latency budget")
+            return lexical_ids
+        except Exception:
+            traceback.print_exc()
+            return lexical_ids
+
+        # Nearest neighbors are not filtered by the query's tag filters
+        allowed = {
+            id for (id,) in notes.filter(Note.id.in_(semantic_ids)).with_entities(Note.id)
+        }
+        semantic_ids = [id for id in semantic_ids if id in allowed]
+        return reciprocal_rank_fusion(lexical_ids, semantic_ids, k=self.rrf_k)
+
+    def _semantic_ids(self, search_query: str) -> list[int]:
+        query_embedding = self.server.ollama_client.embed(search_query)
+        ids, _ = self.server.vector_store.query(
+            query_embedding, n_results=self.candidates
+        )
+        return ids
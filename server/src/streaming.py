@@ -0,0 +1,42 @@
+from typing import Any, Iterator, Mapping
+
+from flask import Response, current_app, request, stream_with_context
+
+__all__ = ["wants_stream", "ndjson_response"]
+
+
+_TRUE_STRINGS = frozenset({"1", "true", "yes", "on"})
+
+
+def wants_stream(data: Mapping[str, Any]) -> bool:
+    """Whether the client asked for a streamed response, in the body, the query string or
+    the Accept header."""
+    stream = data.get("stream")
+    if isinstance(stream, str):
+        # Query values are strings, where "0" and "false" must not count as true
+        stream = stream.lower() in _TRUE_STRINGS
+    return bool(stream) or request.accept_mimetypes.best == "application/x-ndjson"
+
+
+def ndjson_response(chunks: Iterator[dict[str, Any]]) -> Response:
+    """Stream JSON objects to the client as newline-delimited JSON.
+
+    When the client disconnects, the server closes the response, which closes `chunks`.
+    Generators that wrap an Ollama stream then close their connection to Ollama, which
+    stops the generation.
+    """
+
+    def generate():
+        try:
+            for chunk in chunks:
+                # Serialize like Flask does for JSON responses, which handles dates
+                yield current_app.json.dumps(chunk) + "\n"
+        finally:
+            chunks.close()  # type: ignore
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="application/x-ndjson",
+        # Ask reverse proxies not to buffer the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
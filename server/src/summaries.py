@@ -0,0 +1,264 @@
+from concurrent.futures import ThreadPoolExecutor
+import datetime
+import hashlib
+import multiprocessing
+import os
+import traceback
+from typing import Iterator
+
+from sqlalchemy.exc import IntegrityError
+
+from .chunking import estimate_tokens, split_markdown
+
+__all__ = ["summary_messages", "chunk_summary_messages", "combine_messages", "Summarizer"]
+
+PROMPT_VERSION = 2
+"""Version of the summary prompts. Bump it when a prompt changes to invalidate the cache."""
+
+MAX_REDUCE_ROUNDS = 3
+"""How many times chunk summaries may themselves be chunked and summarized again."""
+
+
+def summary_messages(text: str) -> list[dict[str, str]]:
+    """The chat messages that ask the chat model to summarize a text."""
+    return [
+        {
+            "role": "system",
+            "content": """You are an AI assistant that summarizes notes.
+            You will be given a note to summarize.
+            Please provide a summary of the note.
+            Do not say anything else in your response, or the user will not be able to parse it.""",
+        },
+        {
+            "role": "user",
+            "content": f"""Here is the note to summarize: "{text}"
+
+
+            Please provide a summary of the note. Do not say anything else in your response.""",
+        },
+    ]
+
+
+def chunk_summary_messages(text: str) -> list[dict[str, str]]:
+    """The chat messages that ask the chat model to summarize one section of a long note."""
+    return [
+        {
+            "role": "system",
+            "content": """You are an AI assistant that summarizes notes.
+            You will be given one section of a longer note.
+            Please provide a concise summary of the section, keeping any important names, numbers, and decisions.
+            Do not say anything else in your response, or the user will not be able to parse it.""",
+        },
+        {
+            "role": "user",
+            "content": f"""Here is the section to summarize: "{text}"
+
+
+            Please provide a summary of the section. Do not say anything else in your response.""",
+        },
+    ]
+
+
+def combine_messages(summaries: str) -> list[dict[str, str]]:
+    """The chat messages that ask the chat model to combine section summaries."""
+    return [
+        {
+            "role": "system",
+            "content": """You are an AI assistant that summarizes notes.
+            You will be given summaries of consecutive sections of one note.
+            Please combine them into a single summary of the whole note.
+            Do not say anything else in your response, or the user will not be able to parse it.""",
+        },
+        {
+            "role": "user",
+            "content": f"""Here are the section summaries: "{summaries}"
+
+
+            Please provide a summary of the whole note. Do not say anything else in your response.""",
+        },
+    ]
+
+
+def _hash(text: str) -> str:
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+class Summarizer:
+    """Summarizes texts with the chat model, caching summaries in the database.
+
+    Summaries are keyed by a hash of the text, the chat model and the prompt version, so
+    a note is only summarized again once its content has changed. When a new summary is
+    stored for a note, the summaries of its previous contents are dropped.
+
+    Texts that do not fit the context budget are split into chunks along their markdown
+    structure. The chunks are summarized in parallel and the chunk summaries are then
+    combined into one. Chunk summaries are cached too, so after an edit to one section of
+    a long note only that section is summarized again.
+    """
+
+    def __init__(self, server):
+        self.server = server
+        config = server.config["summaries"]
+        self.precompute_enabled: bool = config["precompute"]
+        self.context_tokens: int = config["context_tokens"]
+        self.chunk_tokens: int = config["chunk_tokens"]
+        # Shared with forked worker processes, which do most of the lookups
+        self._hits = multiprocessing.Value("q", 0)
+        self._misses = multiprocessing.Value("q", 0)
+        self._workers: int = config["workers"]
+        self._create_pools()
+
+        # Threads do not survive a fork, and an executor whose threads are gone never runs
+        # the work submitted to it, so each worker process needs pools of its own
+        os.register_at_fork(after_in_child=self._create_pools)
+
+    def _create_pools(self):
+        # Bounds the number of concurrent chunk summaries sent to Ollama
+        self._chunk_pool = ThreadPoolExecutor(
+            max_workers=self._workers, thread_name_prefix="summary-chunks"
+        )
+        # Precomputing is best-effort and runs one summary at a time, so that it does not
+        # compete with interactive requests for the chat model
+        self._precompute_pool = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="summaries"
+        )
+
+    def cached(self, text: str, kind: str = "note") -> str | None:
+        """Get the cached summary of a text, or None if it has not been summarized yet."""
+        from .db_model import Summary
+
+        hit = Summary.query.filter_by(
+            kind=kind,
+            content_hash=_hash(text),
+            chat_model=self.server.ollama_client.chat_model,
+            prompt_version=PROMPT_VERSION,
+        ).first()
+        counter = self._hits if hit else self._misses
+        with counter.get_lock():
+            counter.value += 1  # type: ignore
+        return hit.summary if hit else None
+
+    def stats(self):
+        hits, misses = self._hits.value, self._misses.value  # type: ignore
+        lookups = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / lookups if lookups else 0.0,
+        }
+
+    def summarize(self, text: str, note_id: int | None = None) -> str:
+        """Get the summary of a text, generating it if it is not cached."""
+        summary = self.cached(text)
+        if summary is None:
+            messages, chunk_hashes = self._prepare(text, note_id)
+            summary = self.server.ollama_client.chat(messages)["message"]["content"]
+            self.store(text, summary, note_id, chunk_hashes)
+        return summary
+
+    def summarize_stream(self, text: str, note_id: int | None = None) -> Iterator[str]:
+        """Like `summarize`, but yields pieces of a new summary as they are generated.
+
+        The summary is only cached if the stream runs to completion.
+        """
+        summary = self.cached(text)
+        if summary is not None:
+            yield summary
+            return
+        messages, chunk_hashes = self._prepare(text, note_id)
+        pieces = []
+        for piece in self.server.ollama_client.chat_stream(messages):
+            pieces.append(piece)
+            yield piece
+        self.store(text, "".join(pieces), note_id, chunk_hashes)
+
+    def _prepare(self, text: str, note_id: int | None):
+        """Get the messages for the final summary of a text, summarizing chunks first if the
+        text is too long. Also returns the hashes of the chunks that were used."""
+        chunk_hashes: set[str] = set()
+        if estimate_tokens(text) <= self.context_tokens:
+            return summary_messages(text), chunk_hashes
+
+        for _ in range(MAX_REDUCE_ROUNDS):
+            chunks = split_markdown(text, self.chunk_tokens)
+            chunk_hashes.update(_hash(chunk) for chunk in chunks)
+            text = "\n\n".join(self._summarize_chunks(chunks, note_id))
+            if estimate_tokens(text) <= self.context_tokens:
+                break
+        return combine_messages(text), chunk_hashes
+
+    def _summarize_chunks(self, chunks: list[str], note_id: int | None) -> list[str]:
+        summaries = [self.cached(chunk, kind="chunk") for chunk in chunks]
+        missing = [i for i, summary in enumerate(summaries) if summary is None]
+        generated = self._chunk_pool.map(
+            lambda chunk: self.server.ollama_client.chat(chunk_summary_messages(chunk)),
+            [chunks[i] for i in missing],
+        )
+        for i, response in zip(missing, generated):
+            summaries[i] = response["message"]["content"]
+            self.store(chunks[i], summaries[i], note_id, kind="chunk")  # type: ignore
+        return summaries  # type: ignore
+
+    def store(
+        self,
+        text: str,
+        summary: str,
+        note_id: int | None = None,
+        chunk_hashes: set[str] | None = None,
+        kind: str = "note",
+    ):
+        """Cache the summary of a text.
+
+        When the summary of a whole note is stored, the summaries of the note's previous
+        contents are dropped, along with the summaries of chunks not in `chunk_hashes`.
+        """
+        from .db_model import Summary
+
+        db = self.server.db
+        content_hash = _hash(text)
+        if note_id is not None and kind == "note":
+            Summary.query.filter(
+                Summary.note_id == note_id,
+                db.or_(
+                    db.and_(Summary.kind == "note", Summary.content_hash != content_hash),
+                    db.and_(
+                        Summary.kind == "chunk",
+                        Summary.content_hash.not_in(chunk_hashes or set()),
+                    ),
+                ),
+            ).delete()
+        db.session.add(
+            Summary(
+                kind=kind,
+                content_hash=content_hash,
+                chat_model=self.server.ollama_client.chat_model,
+                prompt_version=PROMPT_VERSION,
+                note_id=note_id,
+                summary=summary,
+                created_at=datetime.datetime.now(),
+            )
+        )
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Another request cached the same text in the meantime
+            db.session.rollback()
+
+    def precompute(self, note_ids: list[int]):
+        """Summarize notes in the background, if precomputing summaries is enabled."""
+        if self.precompute_enabled:
+            for note_id in note_ids:
+                self._precompute_pool.submit(self._precompute, note_id)
+
+    def _precompute(self, note_id: int):
+        from .db_model import Note
+
+        if not self.server.jobs["chat_model"].ready:
+            return
+        try:
+            with self.server.app.app_context():
+                note = self.server.db.session.get(Note, note_id)
+                if note is not None and note.content:
+                    self.summarize(note.content, note.id)
+        except Exception:
+            traceback.print_exc()
@@ -0,0 +1,207 @@
+from concurrent.futures import ThreadPoolExecutor
+import datetime
+import multiprocessing
+import threading
+import time
+import traceback
+from typing import Any, Iterator
+
+from sqlalchemy import event
+
+__all__ = ["TranscriptionQueue"]
+
+
+class TranscriptionQueue:
+    """Transcribes media files in the background, on a bounded pool of workers.
+
+    Jobs are stored in the database, so they can be submitted from any worker process of
+    a production server and survive restarts, but they are only run by the main process.
+    The pool is sized to what the whisper server can process at once, so that concurrent
+    uploads queue up here instead of piling up inside the whisper server. Finished
+    transcripts are stored for their media file, so each file is only transcribed once.
+    """
+
+    def __init__(self, server):
+        self.server = server
+        config = server.config["transcription"]
+        self.workers: int = config["workers"]
+        self.poll_interval: float = config["poll_interval"]
+        self._pool = ThreadPoolExecutor(
+            max_workers=self.workers, thread_name_prefix="transcribe"
+        )
+        self._in_flight = 0
+        self._in_flight_lock = threading.Lock()
+        # Shared with forked worker processes, whose submissions wake the dispatcher
+        self._wake = multiprocessing.Event()
+        self._submitted = False
+
+        # Wake the dispatcher once new jobs are visible to it
+        event.listen(server.db.session, "after_commit", self._after_commit)
+
+    def submit(self, media_id: int):
+        """Get the unfinished job for a media file, or create a new one.
+
+        Must be followed by a commit. If the media file was already transcribed, the new
+        job is created as done.
+        """
+        from .db_model import Transcript, TranscriptionJob
+
+        db = self.server.db
+        job = TranscriptionJob.query.filter(
+            TranscriptionJob.media_id == media_id,
+            TranscriptionJob.status.in_(
+                [TranscriptionJob.PENDING, TranscriptionJob.RUNNING]
+            ),
+        ).first()
+        if job is not None:
+            return job
+
+        now = datetime.datetime.now()
+        job = TranscriptionJob(media_id=media_id, created_at=now)
+        if db.session.get(Transcript, media_id) is not None:
+            job.status = TranscriptionJob.DONE
+            job.finished_at = now
+        else:
+            job.status = TranscriptionJob.PENDING
+            self._submitted = True
+        db.session.add(job)
+        return job
+
+    def watch(self, job_id: int) -> Iterator[Any]:
+        """Yield a job whenever its status or progress changes, until it has finished."""
+        from .db_model import TranscriptionJob
+
+        db = self.server.db
+        last_state = None
+        while True:
+            job = db.session.get(TranscriptionJob, job_id, populate_existing=True)
+            if job is None:
+                return
+            if (job.status, job.segments_done) != last_state:
+                last_state = (job.status, job.segments_done)
+                yield job
+            if job.finished:
+                return
+            # End the read transaction, so that the next poll sees new commits
+            db.session.rollback()
+            time.sleep(0.5)
+
+    def _after_commit(self, session):
+        if self._submitted:
+            self._submitted = False
+            self._wake.set()
+
+    def start(self):
+        """Start running jobs on a background thread."""
+        from .db_model import TranscriptionJob
+
+        with self.server.app.app_context():
+            # Jobs that were running when the server stopped have to start over
+            TranscriptionJob.query.filter_by(status=TranscriptionJob.RUNNING).update(
+                {"status": TranscriptionJob.PENDING, "started_at": None}
+            )
+            self.server.db.session.commit()
+        threading.Thread(
+            target=self._run, name="transcription-queue", daemon=True
+        ).start()
+
+    def _run(self):
+        while True:
+            self._wake.clear()
+            try:
+                with self.server.app.app_context():
+                    self._dispatch()
+            except Exception:
+                traceback.print_exc()
+            self._wake.wait(self.poll_interval)
+
+    def _dispatch(self):
+        """Hand pending jobs to the pool, oldest first, while it has idle workers."""
+        from .db_model import TranscriptionJob
+
+        db = self.server.db
+        idle = self.workers - self._in_flight
+        if idle <= 0:
+            return
+        jobs = (
+            TranscriptionJob.query.filter_by(status=TranscriptionJob.PENDING)
+            .order_by(TranscriptionJob.id)
+            .limit(idle)
+            .all()
+        )
+        for job in jobs:
+            job.status = TranscriptionJob.RUNNING
+            job.started_at = datetime.datetime.now()
+        db.session.commit()
+        for job in jobs:
+            with self._in_flight_lock:
+                self._in_flight += 1
+            self._pool.submit(self._transcribe, job.id)
+
+    def _transcribe(self, job_id: int):
+        from .db_model import Media, Transcript, TranscriptionJob
+
+        db = self.server.db
+        try:
+            with self.server.app.app_context():
+                job = db.session.get(TranscriptionJob, job_id)
+                media_id = job.media_id
+                media = db.session.get(Media, media_id)
+                try:
+                    if media is None:
+                        raise Exception(f"Media {media_id} does not exist")
+                    path = media.file_path
+                    # End the read transaction so that writers are not blocked meanwhile
+                    db.session.rollback()
+
+                    def on_progress(segments, done: int, total: int):
+                        job.partial_text = " ".join(s["text"] for s in segments)
+                        job.segments_done = done
+                        job.segments_total = total
+                        db.session.commit()
+
+                    segments = self.server.whisper_client.transcribe_segments(
+                        path, on_progress
+                    )
+                    db.session.merge(
+                        Transcript(
+                            media_id=media_id,
+                            text=" ".join(segment["text"] for segment in segments),
+                            segments=segments,
+                            created_at=datetime.datetime.now(),
+                        )
+                    )
+                    job.partial_text = None
+                    job.status = TranscriptionJob.DONE
+                except Exception as e:
+                    traceback.print_exc()
+                    db.session.rollback()
+                    job.status = TranscriptionJob.FAILED
+                    job.error = str(e)
+                job.finished_at = datetime.datetime.now()
+                db.session.commit()
+        finally:
+            with self._in_flight_lock:
+                self._in_flight -= 1
+            self._wake.set()
+
+    def stats(self) -> dict[str, int]:
+        """The number of jobs waiting for a worker and the number being transcribed."""
+        from .db_model import TranscriptionJob
+
+        db = self.server.db
+        counts = dict(
+            db.session.query(TranscriptionJob.status, db.func.count())
+            .filter(
+                TranscriptionJob.status.in_(
+                    [TranscriptionJob.PENDING, TranscriptionJob.RUNNING]
+                )
+            )
+            .group_by(TranscriptionJob.status)
+            .all()
+        )
+        return {
+            "pending": counts.get(TranscriptionJob.PENDING, 0),
+            "running": counts.get(TranscriptionJob.RUNNING, 0),
+            "workers": self.workers,
+        }
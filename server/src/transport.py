@@ -0,0 +1,252 @@
+import os
+import threading
+import time
+from typing import Any, Callable, TypeVar
+from urllib.parse import urlsplit
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+__all__ = [
+    "BackendUnavailable",
+    "CircuitBreaker",
+    "TransportPolicy",
+    "RequestsTransport",
+    "HttpxTransport",
+    "probe",
+]
+
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE"})
+RETRY_STATUSES = frozenset({502, 503, 504})
+
+PROBE_TIMEOUT = (1.0, 2.0)
+"""Connect and read timeout of health checks, in seconds."""
+
+Response = TypeVar("Response")
+
+
+class BackendUnavailable(Exception):
+    """Raised instead of sending a request while the circuit of a backend is open."""
+
+
+class CircuitBreaker:
+    """Fails calls to a backend fast while it is down, instead of letting them time out.
+
+    After `failure_threshold` failures in a row the circuit opens, and calls fail
+    immediately for `reset_timeout` seconds. Then a single trial call is let through,
+    which closes the circuit if it succeeds or opens it again if it fails.
+    """
+
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at: float | None = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        """"closed", "open" or "half-open"."""
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at < self.reset_timeout:
+            return "open"
+        return "half-open"
+
+    def before(self):
+        """Raise `BackendUnavailable` unless a call may be made now."""
+        with self._lock:
+            if self._opened_at is None:
+                return
+            if time.monotonic() - self._opened_at >= self.reset_timeout and not self._trial:
+                self._trial = True
+                return
+        raise BackendUnavailable(f"{self.name} is unavailable")
+
+    def success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial = False
+
+    def failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+            self._trial = False
+
+    def release(self):
+        """End a trial call that neither succeeded nor failed, such as one that raised an
+        error which does not tell whether the backend is up, so that another may be made.
+        """
+        with self._lock:
+            self._trial = False
+
+
+class TransportPolicy:
+    """Timeouts, retries and the circuit breaker of the connections to one backend.
+
+    `timeouts` maps URL paths to read timeouts in seconds (None to wait forever); the
+    longest matching prefix applies, and "" is the default. Requests with an idempotent
+    method, or a POST to a path ending in one of `idempotent_posts`, are retried with
+    exponential backoff when they fail to connect, time out or get a 502, 503 or 504.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        config,
+        timeouts: dict[str, float | None],
+        idempotent_posts: tuple[str, ...] = (),
+    ):
+        self.name = name
+        self.pool_size: int = config["pool_size"]
+        self.connect_timeout: float = config["connect_timeout"]
+        self.retries: int = config["retries"]
+        self.backoff: float = config["backoff"]
+        self.timeouts = timeouts
+        self.idempotent_posts = idempotent_posts
+        self.breaker = CircuitBreaker(
+            name, config["failure_threshold"], config["reset_timeout"]
+        )
+
+    def timeout(self, path: str) -> tuple[float, float | None]:
+        """The connect and read timeout of requests to a path."""
+        prefix = max((p for p in self.timeouts if path.startswith(p)), key=len)
+        return self.connect_timeout, self.timeouts[prefix]
+
+    def retryable(self, method: str, path: str) -> bool:
+        return method in IDEMPOTENT_METHODS or (
+            method == "POST" and path.endswith(self.idempotent_posts)
+        )
+
+    def call(
+        self,
+        method: str,
+        path: str,
+        send: Callable[[], Response],
+        status: Callable[[Response], int],
+        close: Callable[[Response], None],
+        transient: tuple[type[Exception], ...],
+    ) -> Response:
+        """Send a request through the circuit breaker, retrying it if it may be."""
+        self.breaker.before()
+        attempts = 1 + (self.retries if self.retryable(method, path) else 0)
+        for attempt in range(attempts):
+            if attempt:
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+            try:
+                response = send()
+            except transient:
+                self.breaker.failure()
+                if attempt + 1 == attempts:
+                    raise
+                continue
+            except BaseException:
+                self.breaker.release()
+                raise
+            if status(response) not in RETRY_STATUSES:
+                self.breaker.success()
+                return response
+            self.breaker.failure()
+            if attempt + 1 == attempts:
+                return response
+            close(response)
+        raise AssertionError("unreachable")
+
+
+class RequestsTransport(HTTPAdapter):
+    """A `requests` adapter that applies a `TransportPolicy`.
+
+    Mounted on a session, it keeps up to `pool_size` connections per host alive between
+    requests. Requests without an explicit timeout get the one for their path.
+    """
+
+    def __init__(self, policy: TransportPolicy):
+        self.policy = policy
+        super().__init__(pool_maxsize=policy.pool_size, max_retries=0)
+
+    def send(self, request, stream=False, timeout=None, **kwargs):  # type: ignore
+        path = urlsplit(request.url).path
+        if timeout is None:
+            timeout = self.policy.timeout(path)
+        return self.policy.call(
+            request.method,
+            path,
+            lambda: super(RequestsTransport, self).send(
+                request, stream=stream, timeout=timeout, **kwargs
+            ),
+            status=lambda response: response.status_code,
+            close=lambda response: response.close(),
+            transient=(requests.ConnectionError, requests.Timeout),
+        )
+
+    @classmethod
+    def session(cls, policy: TransportPolicy) -> requests.Session:
+        """A new session that sends all requests through a `RequestsTransport`."""
+        session = requests.Session()
+        transport = cls(policy)
+        session.mount("http://", transport)
+        session.mount("https://", transport)
+        return session
+
+
+class HttpxTransport(httpx.BaseTransport):
+    """An `httpx` transport that applies a `TransportPolicy`.
+
+    Keeps up to `pool_size` connections alive between requests. Every request gets the
+    timeout for its path, since the clients built on `httpx` do not set one per call.
+    """
+
+    def __init__(self, policy: TransportPolicy):
+        self.policy = policy
+        self._transport = httpx.HTTPTransport(
+            limits=httpx.Limits(
+                max_connections=None, max_keepalive_connections=policy.pool_size
+            )
+        )
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        connect, read = self.policy.timeout(request.url.path)
+        request.extensions["timeout"] = httpx.Timeout(
+            read, connect=connect, pool=connect
+        ).as_dict()
+        return self.policy.call(
+            request.method,
+            request.url.path,
+            lambda: self._transport.handle_request(request),
+            status=lambda response: response.status_code,
+            close=lambda response: response.close(),
+            transient=(httpx.TransportError,),
+        )
+
+    def close(self):
+        self._transport.close()
+
+
+_probe_session = requests.Session()
+
+
+def _reset_probe_session():
+    global _probe_session
+    _probe_session = requests.Session()
+
+
+# Forked worker processes must not share the parent's HTTP connections
+os.register_at_fork(after_in_child=_reset_probe_session)
+
+
+def probe(url: str, timeout: Any = PROBE_TIMEOUT) -> bool:
+    """Whether a GET request to a URL succeeds, without retries or a circuit breaker.
+
+    Used for health checks, which must neither wait long nor be short-circuited.
+    """
+    try:
+        _probe_session.get(url, timeout=timeout).raise_for_status()
+        return True
+    except Exception:
+        return False
@@ -0,0 +1,513 @@
+from abc import ABC
+import os
+import sqlite3
+import threading
+from typing import Any, Sequence
+
+import numpy as np
+
+from .metrics import timed
+
+try:
+    import hnswlib
+except ImportError:
+    hnswlib = None
+
+__all__ = ["VectorStore", "LocalVectorStore"]
+
+
+def _params(values) -> str:
+    """Placeholders for the values of an IN clause."""
+    return ",".join("?" * len(values))
+
+
+class VectorStore(ABC):
+    """Abstract base class for stores of note chunk embeddings.
+
+    Every chunk has a string ID, its text, and metadata with the ID of its note. Distances
+    are squared L2 distances.
+    """
+
+    CHUNKS_PER_NOTE = 4
+    """How many chunks to fetch per requested note when querying."""
+
+    def add(
+        self,
+        ids: list[str],
+        docs: list[str],
+        embeddings: list[Sequence[float]],
+        metadatas: list[dict[str, Any]] | None = None,
+    ) -> None:
+        """Add chunks, replacing any chunks with the same IDs."""
+        raise NotImplementedError
+
+    def remove(self, ids: list[str]) -> None:
+        """Remove chunks by ID."""
+        raise NotImplementedError
+
+    def remove_notes(self, note_ids: list[int]) -> None:
+        """Remove all chunks of the given notes."""
+        raise NotImplementedError
+
+    def clear(self) -> None:
+        """Remove all chunks."""
+        raise NotImplementedError
+
+    def query_chunks(
+        self,
+        query_embedding: Sequence[float],
+        n_results: int = 10,
+        max_distance: float | None = None,
+    ) -> list[tuple[int, str, float]]:
+        """Find the chunks nearest to an embedding, as (note ID, text, distance) tuples."""
+        raise NotImplementedError
+
+    def note_chunk_ids(
+        self, note_ids: list[int] | None = None
+    ) -> dict[int | None, set[str]]:
+        """Get the IDs of the chunks of the given notes, or of all notes.
+
+        Chunks without a note ID, such as the whole-note embeddings stored by earlier
+        versions, are listed under None.
+        """
+        raise NotImplementedError
+
+    def get(self, id: str) -> Sequence[float] | None:
+        """Get the embedding of a chunk, or None if there is no chunk with that ID."""
+        raise NotImplementedError
+
+    def alive(self) -> bool:
+        """Check if the store is usable."""
+        raise NotImplementedError
+
+    def query(
+        self,
+        query_embedding: Sequence[float],
+        n_results: int = 10,
+        max_distance: float | None = None,
+    ) -> tuple[list[int], list[float]]:
+        """Find the notes nearest to an embedding.
+
+        Documents are chunks of notes, so more chunks than `n_results` are fetched and
+        each note is scored by the distance of its nearest chunk.
+        """
+        nearest: dict[int, float] = {}
+        for note_id, _, distance in self.query_chunks(
+            query_embedding, n_results * self.CHUNKS_PER_NOTE, max_distance
+        ):
+            # Chunks are ordered by distance, so the first chunk of a note is its nearest
+            nearest.setdefault(note_id, distance)
+            if len(nearest) == n_results:
+                break
+        return list(nearest.keys()), list(nearest.values())
+
+
+class LocalVectorStore(VectorStore):
+    """Vector store that runs in the server process, without a database server.
+
+    Embeddings are rows of a memory-mapped float32 matrix, and the ID, note and text of
+    each row are kept in a SQLite database next to it. Queries scan the whole matrix with
+    NumPy while the store is small. Once it holds `ann_threshold` vectors, an HNSW index
+    is built in the background, if hnswlib is installed, and used for queries from then
+    on. The index is kept in memory only and rebuilt after a restart.
+
+    Every write stamps the rows it touches with a new version, and each process applies
+    the rows with newer versions than it has seen before it answers a query. Worker
+    processes forked by a production server therefore see the writes of the main process
+    without reloading the whole store.
+    """
+
+    _PARAMS_PER_QUERY = 500
+
+    def __init__(self, path: str, ann_threshold: int):
+        self.path = path
+        self.ann_threshold = ann_threshold
+        os.makedirs(path, exist_ok=True)
+        self._connect()
+
+        # SQLite connections must not be used across a fork, and a fork must not land in
+        # the middle of a write, which would leave the child with SQLite's record of the
+        # lock. The lock is held across the fork to wait for writes and queries.
+        os.register_at_fork(
+            before=self._lock_for_fork,
+            after_in_parent=self._unlock_after_fork,
+            after_in_child=self._after_fork,
+        )
+
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS slot (
+                    row INTEGER PRIMARY KEY,
+                    id TEXT UNIQUE,
+                    note_id INTEGER,
+                    doc TEXT,
+                    version INTEGER NOT NULL
+                )"""
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS slot_note_id ON slot (note_id)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS slot_version ON slot (version)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER)"
+            )
+            self._conn.execute(
+                """INSERT OR IGNORE INTO meta VALUES
+                    ('version', 0), ('epoch', 0), ('dim', 0)"""
+            )
+        self._epoch = -1
+        self._ann_building = False
+        self._sync()
+
+    def _connect(self):
+        self._lock = threading.RLock()
+        # Transactions are managed explicitly, see `_write`
+        self._conn = sqlite3.connect(
+            os.path.join(self.path, "vectors.sqlite3"),
+            check_same_thread=False,
+            timeout=30,
+            isolation_level=None,
+        )
+
+    def _lock_for_fork(self):
+        self._lock.acquire()
+
+    def _unlock_after_fork(self):
+        self._lock.release()
+
+    def _after_fork(self):
+        self._connect()
+        # Threads do not survive a fork, so a build that was running never finishes here
+        self._ann_building = False
+
+    def _meta(self, key: str) -> int:
+        (value,) = self._conn.execute(
+            "SELECT value FROM meta WHERE key = ?", (key,)
+        ).fetchone()
+        return value
+
+    def _matrix_path(self, epoch: int) -> str:
+        # Each clear starts a new file, since processes may still have the old one mapped
+        return os.path.join(self.path, f"vectors-{epoch}.f32")
+
+    def _reset(self, epoch: int, dim: int):
+        """Forget all in-memory state, for a store that was cleared or not loaded yet."""
+        self._epoch = epoch
+        self._version = -1
+        self._dim = dim
+        self._capacity = 0
+        self._matrix = None
+        self._live = np.zeros(0, dtype=bool)
+        self._note_ids = np.zeros(0, dtype=np.int64)
+        self._count = 0
+        self._ann = None
+
+    def _map(self):
+        """Map the matrix file, which may have been grown by another process."""
+        path = self._matrix_path(self._epoch)
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        capacity = size // (4 * self._dim) if self._dim else 0
+        if capacity <= self._capacity:
+            return
+        self._matrix = np.memmap(
+            path, dtype=np.float32, mode="r+", shape=(capacity, self._dim)
+        )
+        live = np.zeros(capacity, dtype=bool)
+        live[: self._capacity] = self._live
+        note_ids = np.full(capacity, -1, dtype=np.int64)
+        note_ids[: self._capacity] = self._note_ids
+        self._live, self._note_ids, self._capacity = live, note_ids, capacity
+        if self._ann is not None:
+            self._ann.resize_index(capacity)
+
+    def _sync(self):
+        """Apply the rows written since this process last looked at the store."""
+        epoch, dim, version = (self._meta(key) for key in ("epoch", "dim", "version"))
+        if epoch != self._epoch:
+            self._reset(epoch, dim)
+        self._dim = dim
+        if version == self._version:
+            return
+        changed = self._conn.execute(
+            "SELECT row, id IS NOT NULL, note_id FROM slot WHERE version > ?",
+            (self._version,),
+        ).fetchall()
+        self._version = version
+        if not changed:
+            return
+        self._map()
+        rows = np.array([row for row, _, _ in changed], dtype=np.int64)
+        live = np.array([bool(is_live) for _, is_live, _ in changed])
+        self._count += int(live.sum()) - int(self._live[rows].sum())
+        self._live[rows] = live
+        self._note_ids[rows] = [
+            -1 if note_id is None else note_id for _, _, note_id in changed
+        ]
+        if self._ann is not None:
+            self._apply_to_ann(self._ann, rows, live)
+
+    def _apply_to_ann(self, ann, rows: np.ndarray, live: np.ndarray):
+        for row in rows[~live]:
+            try:
+                ann.mark_deleted(int(row))
+            except RuntimeError:
+                # The row was never added, or is already deleted
+                pass
+        if live.any():
+            # Re-adding a deleted label replaces its vector and undeletes it
+            ann.add_items(self._matrix[rows[live]], rows[live])
+
+    def _build_ann(self):
+        """Build the HNSW index on a background thread, then catch up with new writes."""
+        try:
+            with self._lock:
+                epoch, version = self._epoch, self._version
+                matrix, capacity = self._matrix, self._capacity
+                rows = np.flatnonzero(self._live)
+            print(f"Building vector index for {len(rows)} vectors")
+            ann = hnswlib.Index(space="l2", dim=matrix.shape[1])  # type: ignore
+            ann.init_index(max_elements=capacity, ef_construction=200, M=16)
+            ann.add_items(matrix[rows], rows)  # type: ignore
+            with self._lock:
+                if self._epoch != epoch:
+                    # The store was cleared in the meantime
+                    return
+                if self._capacity > capacity:
+                    ann.resize_index(self._capacity)
+                changed = self._conn.execute(
+                    "SELECT row, id IS NOT NULL FROM slot WHERE version > ?",
+                    (version,),
+                ).fetchall()
+                if changed:
+                    self._apply_to_ann(
+                        ann,
+                        np.array([row for row, _ in changed], dtype=np.int64),
+                        np.array([bool(is_live) for _, is_live in changed]),
+                    )
+                self._ann = ann
+            print("Built vector index")
+        finally:
+            self._ann_building = False
+
+    def _write(self, write):
+        """Run `write(version)` in a transaction that stamps rows with a new version."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Catch up first, another process may have written in the meantime
+                self._sync()
+                version = self._meta("version") + 1
+                write(version)
+                self._conn.execute(
+                    "UPDATE meta SET value = ? WHERE key = 'version'", (version,)
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._sync()
+
+    def _batches(self, values: list) -> list[list]:
+        step = self._PARAMS_PER_QUERY
+        return [values[i : i + step] for i in range(0, len(values), step)]
+
+    @timed("local", "add")
+    def add(
+        self,
+        ids: list[str],
+        docs: list[str],
+        embeddings: list[Sequence[float]],
+        metadatas: list[dict[str, Any]] | None = None,
+    ):
+        if not ids:
+            return
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        note_ids = [(m or {}).get("note_id") for m in metadatas or [None] * len(ids)]
+
+        def write(version: int):
+            dim = self._meta("dim")
+            if dim == 0:
+                dim = self._dim = vectors.shape[1]
+                self._conn.execute(
+                    "UPDATE meta SET value = ? WHERE key = 'dim'", (dim,)
+                )
+            elif vectors.shape[1] != dim:
+                raise ValueError(
+                    f"Embeddings have {vectors.shape[1]} dimensions, not {dim}"
+                )
+
+            # Reuse the rows of existing chunks with the same IDs, then free rows, and
+            # only then grow the matrix
+            rows: dict[str, int] = {}
+            for batch in self._batches(ids):
+                rows.update(
+                    self._conn.execute(
+                        f"SELECT id, row FROM slot WHERE id IN ({_params(batch)})",
+                        batch,
+                    ).fetchall()
+                )
+            new_ids = [id for id in dict.fromkeys(ids) if id not in rows]
+            free = self._conn.execute(
+                "SELECT row FROM slot WHERE id IS NULL LIMIT ?", (len(new_ids),)
+            ).fetchall()
+            (next_row,) = self._conn.execute(
+                "SELECT COALESCE(MAX(row) + 1, 0) FROM slot"
+            ).fetchone()
+            for i, id in enumerate(new_ids):
+                rows[id] = free[i][0] if i < len(free) else next_row + i - len(free)
+
+            self._grow(max(rows.values()) + 1)
+            self._matrix[[rows[id] for id in ids]] = vectors  # type: ignore
+            self._matrix.flush()  # type: ignore
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO slot VALUES (?, ?, ?, ?, ?)",
+                [
+                    (rows[id], id, note_id, doc, version)
+                    for id, note_id, doc in zip(ids, note_ids, docs)
+                ],
+            )
+
+        self._write(write)
+
+    def _grow(self, n_rows: int):
+        """Make room for at least `n_rows` rows in the matrix file."""
+        self._map()
+        if n_rows <= self._capacity:
+            return
+        capacity = max(n_rows, 2 * self._capacity, 1024)
+        with open(self._matrix_path(self._epoch), "ab") as f:
+            f.truncate(capacity * self._dim * 4)
+        self._map()
+
+    @timed("local", "remove")
+    def remove(self, ids: list[str]):
+        def write(version: int):
+            for batch in self._batches(ids):
+                self._conn.execute(
+                    f"""UPDATE slot SET id = NULL, note_id = NULL, doc = NULL, version = ?
+                    WHERE id IN ({_params(batch)})""",
+                    [version, *batch],
+                )
+
+        if ids:
+            self._write(write)
+
+    @timed("local", "remove_notes")
+    def remove_notes(self, note_ids: list[int]):
+        def write(version: int):
+            for batch in self._batches(note_ids):
+                self._conn.execute(
+                    f"""UPDATE slot SET id = NULL, note_id = NULL, doc = NULL, version = ?
+                    WHERE note_id IN ({_params(batch)})""",
+                    [version, *batch],
+                )
+
+        if note_ids:
+            self._write(write)
+
+    @timed("local", "clear")
+    def clear(self):
+        def write(version: int):
+            self._conn.execute("DELETE FROM slot")
+            self._conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'epoch'")
+            self._conn.execute("UPDATE meta SET value = 0 WHERE key = 'dim'")
+            # Deleting the file is safe while it is mapped, the data stays until unmapped
+            path = self._matrix_path(self._epoch)
+            if os.path.exists(path):
+                os.remove(path)
+
+        self._write(write)
+
+    @timed("local", "query")
+    def query_chunks(
+        self,
+        query_embedding: Sequence[float],
+        n_results: int = 10,
+        max_distance: float | None = None,
+    ) -> list[tuple[int, str, float]]:
+        with self._lock:
+            self._sync()
+            k = min(n_results, self._count)
+            if k == 0:
+                return []
+            query = np.asarray(query_embedding, dtype=np.float32)
+            if self._ann is not None:
+                self._ann.set_ef(max(2 * k, 64))
+                labels, distances = self._ann.knn_query(query, k=k)
+                rows, distances = labels[0].astype(np.int64), distances[0]
+            else:
+                rows, distances = self._brute_force(query, k)
+                if (
+                    self._count >= self.ann_threshold
+                    and hnswlib is not None
+                    and not self._ann_building
+                ):
+                    self._ann_building = True
+                    threading.Thread(
+                        target=self._build_ann, name="vector-index", daemon=True
+                    ).start()
+
+            if max_distance is not None:
+                keep = distances <= max_distance
+                rows, distances = rows[keep], distances[keep]
+            if len(rows) == 0:
+                return []
+            docs = dict(
+                self._conn.execute(
+                    f"SELECT row, doc FROM slot WHERE row IN ({_params(rows)})",
+                    rows.tolist(),
+                ).fetchall()
+            )
+            return [
+                (int(self._note_ids[row]), docs[row], float(distance))
+                for row, distance in zip(rows.tolist(), distances)
+                if self._note_ids[row] >= 0 and docs.get(row) is not None
+            ]
+
+    def _brute_force(self, query: np.ndarray, k: int):
+        n = int(np.flatnonzero(self._live)[-1]) + 1
+        matrix = self._matrix[:n]  # type: ignore
+        # |m - q|^2 = |m|^2 - 2 m.q + |q|^2, without a temporary copy of the matrix
+        distances = np.einsum("ij,ij->i", matrix, matrix) - 2 * (matrix @ query)
+        distances += query @ query
+        distances[~self._live[:n]] = np.inf
+        nearest = np.argpartition(distances, k - 1)[:k]
+        nearest = nearest[np.argsort(distances[nearest])]
+        return nearest, np.maximum(distances[nearest], 0)
+
+    @timed("local", "note_chunk_ids")
+    def note_chunk_ids(
+        self, note_ids: list[int] | None = None
+    ) -> dict[int | None, set[str]]:
+        with self._lock:
+            if note_ids is None:
+                result = self._conn.execute(
+                    "SELECT id, note_id FROM slot WHERE id IS NOT NULL"
+                ).fetchall()
+            else:
+                result = []
+                for batch in self._batches(note_ids):
+                    result += self._conn.execute(
+                        f"SELECT id, note_id FROM slot WHERE note_id IN ({_params(batch)})",
+                        batch,
+                    ).fetchall()
+        chunk_ids: dict[int | None, set[str]] = {}
+        for id, note_id in result:
+            chunk_ids.setdefault(note_id, set()).add(id)
+        return chunk_ids
+
+    def get(self, id: str) -> Sequence[float] | None:
+        with self._lock:
+            hit = self._conn.execute(
+                "SELECT row FROM slot WHERE id = ?", (id,)
+            ).fetchone()
+            if hit is None:
+                return None
+            self._sync()
+            return self._matrix[hit[0]].tolist()  # type: ignore
+
+    def alive(self):
+        return True
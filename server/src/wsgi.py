@@ -0,0 +1,48 @@
+import os
+import sys
+
+from flask import Flask
+
+__all__ = ["serve_gunicorn"]
+
+
+def serve_gunicorn(app: Flask, config) -> None:
+    """Serve the app with gunicorn, using the worker settings from the `api` config.
+
+    The app is handed to gunicorn fully initialized, so routes, clients and background
+    jobs are set up once in the master process and then forked into the workers. The
+    backends and background jobs keep running in the master process only.
+    """
+    # gunicorn is not available on Windows, so only import it when it is used
+    from gunicorn.app.base import BaseApplication
+
+    class Application(BaseApplication):
+        def load_config(self):
+            self.cfg.set("bind", f"{config['host']}:{config['port']}")
+            self.cfg.set("workers", config["workers"])
+            self.cfg.set("threads", config["threads"])
+            self.cfg.set("worker_class", "gthread")
+            # Chat and transcription requests can take a long time on CPU-only machines
+            self.cfg.set("timeout", config["timeout"])
+            self.cfg.set("accesslog", "-")
+            self.cfg.set("worker_exit", _exit_worker)
+
+        def load(self):
+            return app
+
+    Application().run()
+
+
+def _exit_worker(server, worker) -> None:
+    """Exit a worker process without finalizing the interpreter.
+
+    chromadb loads onnxruntime when it is imported, which starts native threads in the
+    master process. Forked workers do not have those threads, and tearing down
+    onnxruntime at interpreter exit then crashes or hangs the worker. gunicorn calls
+    this hook while the exit of the worker is under way, with its SystemExit.
+    """
+    error = sys.exc_info()[1]
+    code = error.code if isinstance(error, SystemExit) else 1
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os._exit(code if isinstance(code, int) else 1)
@@ -0,0 +1,49 @@
+import os
+import tomllib
+
+import pytest
+
+import src
+
+SERVER_DIR = os.path.join(os.path.dirname(__file__), "..")
+
+
+@pytest.fixture(scope="session")
+def server(tmp_path_factory):
+    """A server with a fresh database and the routes registered, but no backends.
+
+    The routes bind to the server when they are imported, so there is one server for the
+    whole test session. Tests that write to the database should use `clear_db`.
+    """
+    tmp = tmp_path_factory.mktemp("server")
+    with open(os.path.join(SERVER_DIR, "config.toml"), "rb") as f:
+        config = tomllib.load(f)
+    config["settings"]["instance_path"] = str(tmp / "instance")
+    config["settings"]["debug"] = False
+    config["database"]["uri"] = f"sqlite:///{tmp / 'notes.db'}"
+    config["vectors"]["store"] = "local"
+    config["api"]["media_path"] = str(tmp / "media")
+
+    server = src.Server(config)
+    src._server = server
+    server.setup()
+    return server
+
+
+@pytest.fixture
+def client(server):
+    return server.app.test_client()
+
+
+@pytest.fixture
+def clear_db(server):
+    """A function that deletes all rows from the database, called before the test."""
+
+    def clear():
+        with server.app.app_context():
+            with server.db.engine.begin() as conn:
+                for table in reversed(server.db.metadata.sorted_tables):
+                    conn.execute(table.delete())
+
+    clear()
+    return clear
@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+
+from src.audio import SAMPLE_RATE, pcm_segments
+
+
+def speech(seconds: float, gaps: list[float]) -> bytes:
+    """Noise with 0.4 s of silence around each time in `gaps`."""
+    rng = np.random.default_rng(0)
+    samples = (rng.normal(size=int(seconds * SAMPLE_RATE)) * 3000).astype(np.int16)
+    for t in gaps:
+        samples[int((t - 0.2) * SAMPLE_RATE) : int((t + 0.2) * SAMPLE_RATE)] = 0
+    return samples.tobytes()
+
+
+def chunked(pcm: bytes, size: int) -> list[bytes]:
+    return [pcm[i : i + size] for i in range(0, len(pcm), size)]
+
+
+def test_segments_are_cut_at_silences():
+    pcm = speech(70, [27, 55])
+    segments = list(pcm_segments(chunked(pcm, 12345), 30.0, 1.0))
+    cuts = [cut / SAMPLE_RATE for _, cut, _ in segments]
+    assert cuts[0] == 0 and abs(cuts[1] - 27) < 0.2 and abs(cuts[2] - 55) < 0.2
+    for start, cut, segment in segments:
+        assert start == max(cut - SAMPLE_RATE, 0)
+        assert segment == pcm[2 * start : 2 * start + len(segment)]
+    # Together the segments cover the whole recording
+    start, _, last = segments[-1]
+    assert 2 * start + len(last) == len(pcm)
+
+
+@pytest.mark.parametrize("segment_duration", [0.001, 0.015, 0.03])
+def test_short_segments_do_not_fail(segment_duration):
+    pcm = speech(1, [])
+    segments = list(pcm_segments(chunked(pcm, 1000), segment_duration, 0.0))
+    assert sum(len(segment) for _, _, segment in segments) == len(pcm)
+
+
+def test_empty_recording_is_one_empty_segment():
+    assert list(pcm_segments([], 30.0, 1.0)) == [(0, 0, b"")]
+
+
+def test_whole_recordings_are_decoded_once(server, monkeypatch):
+    pcm = speech(3, [])
+    decodes = []
+
+    def decode_pcm(path, max_duration=None):
+        decodes.append(path)
+        yield from chunked(pcm, 1000)
+
+    def transcribe(content, length, endpoint):
+        assert length == len(pcm)
+        assert b"".join(content) == pcm
+        return {"text": "hello"}
+
+    client = server.whisper_client
+    monkeypatch.setattr("src.audio.decode_pcm", decode_pcm)
+    monkeypatch.setattr(client, "segment_duration", 0.0)
+    monkeypatch.setattr(client, "_transcribe", transcribe)
+    segments = client.transcribe_segments("recording.mp3")
+    assert segments == [{"start": 0.0, "end": 3.0, "text": "hello"}]
+    assert decodes == ["recording.mp3"]
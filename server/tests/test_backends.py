@@ -0,0 +1,31 @@
+import copy
+
+import pytest
+
+from src.backends import BackendManager, WhisperBackend
+
+
+def test_whisper_ports(server):
+    whisper = {**server.config["whisper"], "port": 8002, "extra_ports": [8010, 8011]}
+    assert WhisperBackend.ports(whisper) == [8002, 8010, 8011]
+
+
+@pytest.mark.parametrize(
+    "extra_ports, conflict",
+    [([8003], "ollama"), ([8002], "whisper"), ([8000], "the API")],
+)
+def test_backends_must_not_share_ports(server, extra_ports, conflict):
+    config = copy.deepcopy(server.config)
+    config["vectors"]["store"] = "chromadb"
+    config["api"]["port"] = 8000
+    for name, port in [("chromadb", 8001), ("whisper", 8002), ("ollama", 8003)]:
+        config[name].update(port=port, external=False)
+    config["whisper"]["extra_ports"] = extra_ports
+    with pytest.raises(Exception, match=f"already used by {conflict}"):
+        BackendManager(config)
+
+
+def test_shipped_ports_are_free(server):
+    config = copy.deepcopy(server.config)
+    config["vectors"]["store"] = "chromadb"
+    BackendManager(config)
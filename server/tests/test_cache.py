@@ -0,0 +1,66 @@
+import os
+import signal
+import sqlite3
+import threading
+import time
+
+from src.cache import EmbeddingCache
+
+
+def fork_and_put(cache: EmbeddingCache) -> int:
+    """Fork and put an entry in the child. Returns the exit code of the child."""
+    pid = os.fork()
+    if pid == 0:
+        try:
+            cache._conn.execute("PRAGMA busy_timeout=2000")
+            cache.put("from the child", [1.0])
+            os._exit(0)
+        except BaseException:
+            os._exit(1)
+    # A child that inherited a lock in the middle of a write may hang instead of failing
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        done, status = os.waitpid(pid, os.WNOHANG)
+        if done:
+            return os.waitstatus_to_exitcode(status)
+        time.sleep(0.01)
+    os.kill(pid, signal.SIGKILL)
+    os.waitpid(pid, 0)
+    return -1
+
+
+def test_put_and_evict(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "cache.db"), "model", 10)
+    for i in range(12):
+        cache.put(f"text {i}", [float(i)])
+    assert cache.get("text 11") == [11.0]
+    assert cache.get("text 0") is None
+    assert cache.stats()["entries"] <= 10
+
+
+def test_fork_during_writes(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "cache.db"), "model", 1000)
+    cache._conn.execute("PRAGMA busy_timeout=2000")
+    stop = threading.Event()
+    errors: list[Exception] = []
+
+    def write():
+        i = 0
+        while not stop.is_set():
+            try:
+                cache.put(f"text {i % 500}", [float(i)] * 64)
+            except sqlite3.OperationalError as e:
+                errors.append(e)
+            i += 1
+            # Pause so that the child is not starved of the write lock
+            time.sleep(0.0005)
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    try:
+        codes = [fork_and_put(cache) for _ in range(20)]
+    finally:
+        stop.set()
+        writer.join()
+    assert codes == [0] * 20
+    assert not errors
@@ -0,0 +1,76 @@
+import os
+import signal
+import threading
+import time
+
+import sqlalchemy as sa
+
+from src.database import engine_options, tune_sqlite, wait_for_writes_on_fork
+
+CONFIG = {
+    "pool_size": 5,
+    "max_overflow": 10,
+    "pool_timeout": 30,
+    "pool_recycle": 3600,
+    "sqlite_synchronous": "NORMAL",
+    "sqlite_busy_timeout": 2000,
+    "sqlite_cache_size": -2000,
+    "sqlite_mmap_size": 0,
+}
+
+
+def fork_and_write(engine: sa.Engine) -> int:
+    """Fork and write in the child like a worker would. Returns its exit code."""
+    pid = os.fork()
+    if pid == 0:
+        try:
+            engine.dispose(close=False)
+            with engine.begin() as conn:
+                conn.execute(sa.text("INSERT INTO item (value) VALUES ('child')"))
+            os._exit(0)
+        except BaseException:
+            os._exit(1)
+    # A child that inherited a lock in the middle of a write may hang instead of failing
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        done, status = os.waitpid(pid, os.WNOHANG)
+        if done:
+            return os.waitstatus_to_exitcode(status)
+        time.sleep(0.01)
+    os.kill(pid, signal.SIGKILL)
+    os.waitpid(pid, 0)
+    return -1
+
+
+def test_fork_waits_for_writes(tmp_path):
+    config = {**CONFIG, "uri": f"sqlite:///{tmp_path / 'test.db'}"}
+    engine = sa.create_engine(config["uri"], **engine_options(config))
+    tune_sqlite(engine, config)
+    wait_for_writes_on_fork(engine)
+    with engine.begin() as conn:
+        conn.execute(sa.text("CREATE TABLE item (id INTEGER PRIMARY KEY, value TEXT)"))
+
+    stop = threading.Event()
+    errors: list[Exception] = []
+
+    def write():
+        while not stop.is_set():
+            try:
+                with engine.begin() as conn:
+                    conn.execute(sa.text("INSERT INTO item (value) VALUES ('parent')"))
+            except sa.exc.OperationalError as e:
+                errors.append(e)
+            # Pause so that the child is not starved of the write lock
+            time.sleep(0.0005)
+
+    writers = [threading.Thread(target=write) for _ in range(2)]
+    for writer in writers:
+        writer.start()
+    try:
+        codes = [fork_and_write(engine) for _ in range(20)]
+    finally:
+        stop.set()
+        for writer in writers:
+            writer.join()
+    assert codes == [0] * 20
+    assert not errors
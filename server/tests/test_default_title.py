@@ -0,0 +1,41 @@
+import datetime
+
+
+def add_titles(server, titles):
+    from src.db_model import Note
+
+    now = datetime.datetime(2024, 1, 1)
+    with server.app.app_context():
+        for title in titles:
+            server.db.session.add(
+                Note(title=title, content="", created_at=now, last_modified=now)
+            )
+        server.db.session.commit()
+
+
+def next_title(server):
+    from src.db_model import Note
+
+    with server.app.app_context():
+        return Note.next_default_title()
+
+
+def test_default_title_is_free(server, clear_db):
+    assert next_title(server) == "Untitled Note"
+    add_titles(server, ["Untitled Note 4", "Other"])
+    assert next_title(server) == "Untitled Note"
+
+
+def test_default_title_gets_the_next_number(server, clear_db):
+    add_titles(server, ["Untitled Note"])
+    assert next_title(server) == "Untitled Note 1"
+    add_titles(server, ["Untitled Note 2", "Untitled Note 10", "Untitled Note 9"])
+    assert next_title(server) == "Untitled Note 11"
+
+
+def test_default_title_ignores_other_suffixes(server, clear_db):
+    add_titles(
+        server,
+        ["Untitled Note", "Untitled Note 3", "Untitled Note 99b", "Untitled Notes 50"],
+    )
+    assert next_title(server) == "Untitled Note 4"
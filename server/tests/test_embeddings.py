@@ -0,0 +1,51 @@
+import datetime
+
+
+def add_notes(server, contents: list[str]) -> list[int]:
+    from src.db_model import Note
+
+    with server.app.app_context():
+        notes = []
+        for i, content in enumerate(contents):
+            note = Note.new_note()
+            note.title = f"Note {i}"
+            note.content = content
+            server.db.session.add(note)
+            notes.append(note)
+        server.db.session.flush()
+        for note in notes:
+            server.embedding_queue.enqueue(note.id, delay=False)
+        server.db.session.commit()
+        return [note.id for note in notes]
+
+
+def test_failing_note_does_not_block_the_queue(server, clear_db, monkeypatch):
+    from src.db_model import EmbeddingTask
+
+    def embed(text: str):
+        if "broken" in text:
+            raise Exception("cannot embed")
+        return [1.0, 0.0, 0.0]
+
+    monkeypatch.setattr(server.ollama_client, "embed", embed)
+    good, broken, other = add_notes(server, ["fine", "broken", "also fine"])
+    server.vector_store.remove_notes([good, broken, other])
+
+    with server.app.app_context():
+        server.embedding_queue._process_due()
+        stored = server.vector_store.note_chunk_ids([good, broken, other])
+        assert set(stored) == {good, other}
+        tasks = EmbeddingTask.query.all()
+        assert [task.note_id for task in tasks] == [broken]
+        assert tasks[0].attempts == 1
+        assert tasks[0].due_at > datetime.datetime.now()
+        server.db.session.rollback()
+
+        # The failed note is not due again right away, so nothing is claimed
+        server.embedding_queue._process_due()
+        assert EmbeddingTask.query.one().attempts == 1
+
+        # Editing the note makes it due at once, without the earlier failures
+        server.embedding_queue.enqueue(broken, delay=False)
+        server.db.session.commit()
+        assert EmbeddingTask.query.one().attempts == 0
@@ -0,0 +1,91 @@
+import datetime
+import hashlib
+import io
+import os
+
+import pytest
+
+
+@pytest.fixture
+def media_dir(server):
+    from src.db_model import Media
+
+    with server.app.app_context():
+        directory = Media.directory()
+    os.makedirs(directory, exist_ok=True)
+    for name in os.listdir(directory):
+        os.remove(os.path.join(directory, name))
+    return directory
+
+
+def upload_form(client, content: bytes, filename: str = "recording.webm", **fields):
+    data = {"webm": (io.BytesIO(content), filename), **fields}
+    return client.post("/api/media", data=data, content_type="multipart/form-data")
+
+
+def test_form_upload_is_saved_by_hash(client, clear_db, media_dir):
+    content = os.urandom(3 * 1024 * 1024)
+    response = upload_form(client, content, extra=(io.BytesIO(b"other"), "other.txt"))
+    assert response.status_code == 200
+    # Other files of the form are discarded with the temporary files
+    assert os.listdir(media_dir) == [f"{hashlib.sha256(content).hexdigest()}.webm"]
+    media = client.get(f"/api/media/{response.json['id']}")
+    assert media.data == content
+
+
+def test_same_content_shares_one_row(client, clear_db, media_dir):
+    first = upload_form(client, b"recording")
+    second = client.post("/api/media", data=b"recording", content_type="audio/webm")
+    assert first.json["id"] == second.json["id"]
+    assert len(os.listdir(media_dir)) == 1
+
+
+def test_form_without_file_is_rejected(client, clear_db, media_dir):
+    response = client.post(
+        "/api/media", data={"other": "value"}, content_type="multipart/form-data"
+    )
+    assert response.status_code == 400
+    assert os.listdir(media_dir) == []
+
+
+def test_too_large_upload_is_rejected(server, client, clear_db, media_dir):
+    max_size = server.config["api"]["max_upload_size"]
+    server.config["api"]["max_upload_size"] = 1024
+    try:
+        response = upload_form(client, b"x" * 2048)
+    finally:
+        server.config["api"]["max_upload_size"] = max_size
+    assert response.status_code == 413
+    assert os.listdir(media_dir) == []
+
+
+def test_media_paths_are_unique(server, clear_db):
+    import sqlalchemy as sa
+    from src.db_model import Media
+
+    with server.app.app_context():
+        server.db.session.add(Media.new_media("recording.webm"))
+        server.db.session.commit()
+        server.db.session.add(Media.new_media("recording.webm"))
+        with pytest.raises(sa.exc.IntegrityError):
+            server.db.session.commit()
+        server.db.session.rollback()
+
+
+def test_legacy_transcribe_answers_without_waiting(server, client, clear_db, media_dir):
+    from src.db_model import Transcript
+
+    pending = upload_form(client, b"pending").json["id"]
+    response = client.post(f"/api/transcribe/{pending}")
+    assert response.status_code == 202
+    assert response.json["status"] == "pending"
+
+    done = upload_form(client, b"done").json["id"]
+    with server.app.app_context():
+        server.db.session.add(
+            Transcript(media_id=done, text="Hello", created_at=datetime.datetime.now())
+        )
+        server.db.session.commit()
+    response = client.post(f"/api/transcribe/{done}")
+    assert response.status_code == 200
+    assert response.json == {"text": "Hello"}
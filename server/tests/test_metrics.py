@@ -0,0 +1,31 @@
+from src.backends import OllamaClient
+from src.cache import EmbeddingCache
+
+
+def scrape(client) -> str:
+    response = client.get("/api/metrics")
+    assert response.status_code == 200
+    return response.get_data(as_text=True)
+
+
+def embed_calls(client) -> float:
+    for line in scrape(client).splitlines():
+        if line.startswith("backend_call_duration_seconds_count") and '"embed"' in line:
+            return float(line.split()[-1])
+    return 0.0
+
+
+def test_only_api_routes_are_recorded(client):
+    exposed = scrape(client)
+    assert 'route="/api/notes"' in exposed
+    assert 'route="/admin' not in exposed
+
+
+def test_embedding_cache_hits_are_not_timed(server, client, tmp_path, monkeypatch):
+    cache = EmbeddingCache(str(tmp_path / "cache.db"), "model", 10)
+    ollama = OllamaClient(server.client_config("ollama"), cache)
+    monkeypatch.setattr(ollama, "client", None)
+    cache.put("text", [1.0, 2.0])
+    before = embed_calls(client)
+    assert ollama.embed("text") == [1.0, 2.0]
+    assert embed_calls(client) == before
@@ -0,0 +1,104 @@
+import sqlalchemy as sa
+
+
+def replace_table(server, name: str, ddl: str, rows: list[str] = ()):
+    with server.app.app_context(), server.db.engine.begin() as conn:
+        conn.execute(sa.text(f"DROP TABLE {name}"))
+        conn.execute(sa.text(ddl))
+        for row in rows:
+            conn.execute(sa.text(row))
+
+
+def migrate(server):
+    from src import db_model
+
+    with server.app.app_context():
+        db_model.add_missing_columns()
+        db_model.create_indexes()
+        return sa.inspect(server.db.engine)
+
+
+def test_missing_columns_are_added(server, clear_db):
+    replace_table(
+        server,
+        "embedding_task",
+        """CREATE TABLE embedding_task (
+            note_id INTEGER PRIMARY KEY,
+            enqueued_at DATETIME NOT NULL,
+            due_at DATETIME NOT NULL
+        )""",
+        ["INSERT INTO embedding_task VALUES (1, '2024-01-01', '2024-01-01')"],
+    )
+    inspector = migrate(server)
+    columns = {column["name"] for column in inspector.get_columns("embedding_task")}
+    assert "version" in columns
+    with server.app.app_context():
+        rows = server.db.session.execute(
+            sa.text("SELECT note_id, version FROM embedding_task")
+        ).all()
+    assert rows == [(1, 0)]
+
+
+def test_changed_cache_tables_are_recreated(server, clear_db):
+    replace_table(
+        server,
+        "summary",
+        """CREATE TABLE summary (
+            id INTEGER PRIMARY KEY,
+            content_hash VARCHAR(64) NOT NULL,
+            chat_model VARCHAR(80) NOT NULL,
+            prompt_version INTEGER NOT NULL,
+            note_id INTEGER,
+            summary TEXT NOT NULL,
+            created_at DATETIME NOT NULL,
+            UNIQUE (content_hash, chat_model, prompt_version)
+        )""",
+    )
+    inspector = migrate(server)
+    columns = {column["name"] for column in inspector.get_columns("summary")}
+    assert "kind" in columns
+    unique = [set(c["column_names"]) for c in inspector.get_unique_constraints("summary")]
+    assert unique == [{"kind", "content_hash", "chat_model", "prompt_version"}]
+
+
+def test_transcription_columns_are_added(server, clear_db):
+    replace_table(
+        server,
+        "transcription_job",
+        """CREATE TABLE transcription_job (
+            id INTEGER PRIMARY KEY,
+            media_id INTEGER NOT NULL,
+            status VARCHAR(16) NOT NULL,
+            error TEXT,
+            created_at DATETIME NOT NULL,
+            started_at DATETIME,
+            finished_at DATETIME
+        )""",
+    )
+    replace_table(
+        server,
+        "transcript",
+        """CREATE TABLE transcript (
+            media_id INTEGER PRIMARY KEY,
+            text TEXT NOT NULL,
+            created_at DATETIME NOT NULL
+        )""",
+    )
+    inspector = migrate(server)
+    job = {column["name"] for column in inspector.get_columns("transcription_job")}
+    assert {"partial_text", "segments_done", "segments_total"} <= job
+    assert "segments" in {c["name"] for c in inspector.get_columns("transcript")}
+
+
+def test_media_path_index_is_made_unique(server, clear_db):
+    replace_table(
+        server,
+        "media",
+        "CREATE TABLE media (id INTEGER PRIMARY KEY, path VARCHAR(255) NOT NULL)",
+    )
+    with server.app.app_context(), server.db.engine.begin() as conn:
+        conn.execute(sa.text("CREATE INDEX ix_media_path ON media (path)"))
+    inspector = migrate(server)
+    indexes = {index["name"]: index for index in inspector.get_indexes("media")}
+    assert "ix_media_path" not in indexes
+    assert indexes["ux_media_path"]["unique"]
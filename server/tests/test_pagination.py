@@ -0,0 +1,81 @@
+import datetime
+
+import pytest
+
+from src.pagination import decode_offset, encode_cursor
+
+
+def test_decode_offset():
+    assert decode_offset("") == 0
+    assert decode_offset(encode_cursor({"offset": 20})) == 20
+
+
+@pytest.mark.parametrize(
+    "position",
+    [{"offset": "x"}, {"offset": -10}, {"offset": 1.5}, {"key": "a", "id": 1}],
+)
+def test_decode_offset_rejects_invalid_cursors(position):
+    with pytest.raises(ValueError):
+        decode_offset(encode_cursor(position))
+
+
+def add_note(server, i: int, title: str, minute: int, opened: bool = True) -> int:
+    from src.db_model import Note
+
+    time = datetime.datetime(2024, 1, 1) + datetime.timedelta(minutes=minute)
+    note = Note(
+        title=title,
+        content=f"Note {i}",
+        created_at=time,
+        last_modified=time,
+        last_opened=time if opened else None,
+    )
+    server.db.session.add(note)
+    server.db.session.commit()
+    return note.id
+
+
+@pytest.mark.parametrize("sort", ["created", "modified", "opened", "title", None])
+def test_keyset_pages_have_no_duplicates_or_gaps(server, client, clear_db, sort):
+    from src.routes.crud import SORT_KEYS
+
+    with server.app.app_context():
+        # Few distinct keys, so that most notes tie on the sort key. Some notes were
+        # never opened, which sorts them by creation time.
+        ids = [
+            add_note(server, i, f"Title {i % 3}", i % 4, opened=i % 5 != 0)
+            for i in range(23)
+        ]
+
+    query = f"/api/notes?n=4&sort={sort}" if sort else "/api/notes?n=4"
+    seen: list[int] = []
+    cursor = ""
+    while True:
+        response = client.get(f"{query}&cursor={cursor}")
+        assert response.status_code == 200
+        seen += [note["id"] for note in response.json["notes"]]
+        cursor = response.json["next_cursor"]
+        if len(seen) == 4:
+            # A note written between pages must not shift the pages that follow
+            with server.app.app_context():
+                add_note(server, 99, "Title 1", 2)
+        if cursor is None:
+            break
+
+    assert len(seen) == len(set(seen))
+    assert set(ids) <= set(seen)
+
+    key, descending = SORT_KEYS.get(sort, (None, True))
+    with server.app.app_context():
+        from src.db_model import Note
+
+        if key is None:
+            expected = sorted(seen, reverse=True)
+        else:
+            rows = (
+                server.db.session.query(Note.id, key).filter(Note.id.in_(seen)).all()
+            )
+            order = sorted(rows, key=lambda row: (row[1], row[0]), reverse=descending)
+            expected = [id for id, _ in order]
+    # Notes that sort before the page they were written during are not shown
+    assert seen == [id for id in expected if id in seen]
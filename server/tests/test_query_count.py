@@ -0,0 +1,56 @@
+import datetime
+
+import pytest
+
+from src.querycount import count_queries
+
+
+def add_notes(server, n: int) -> int:
+    """Add `n` notes with two tags and a media file each. Returns the ID of a tag."""
+    from src.db_model import Media, Note, Tag
+
+    db = server.db
+    with server.app.app_context():
+        tags = [Tag.new_tag(f"tag-{i}", "#000000") for i in range(2)]
+        media = Media.new_media("recording.webm")
+        now = datetime.datetime(2024, 1, 1)
+        for i in range(n):
+            note = Note(
+                title=f"Note {i}",
+                content="",
+                created_at=now + datetime.timedelta(minutes=i),
+                last_modified=now + datetime.timedelta(minutes=i),
+            )
+            note.tags = tags
+            note.media = [media]
+            db.session.add(note)
+        db.session.commit()
+        return tags[0].id
+
+
+def queries(client, url: str) -> int:
+    with count_queries() as count:
+        response = client.get(url)
+    assert response.status_code == 200
+    return count[0]
+
+
+@pytest.mark.parametrize(
+    "url",
+    [
+        "/api/notes?n={n}",
+        "/api/notes?n={n}&sort=title",
+        "/api/notes?n={n}&cursor=",
+        "/api/notes?n={n}&tags={tag_id}",
+        "/api/tags/{tag_id}/notes?n={n}",
+        "/api/tags/{tag_id}/notes?n={n}&count=1",
+    ],
+)
+def test_note_lists_run_a_constant_number_of_queries(server, client, clear_db, url):
+    """Serializing the tags and media of a page of notes must not query once per note."""
+    counts = {}
+    for n in (1, 5, 25):
+        clear_db()
+        tag_id = add_notes(server, n)
+        counts[n] = queries(client, url.format(n=n, tag_id=tag_id))
+    assert counts[1] == counts[5] == counts[25], counts
@@ -0,0 +1,17 @@
+def test_context_keeps_within_the_token_budget(server):
+    retriever = server.retriever
+    snippets = {1: ["alpha " * 50, "beta " * 50], 2: ["gamma " * 50]}
+    titles = {1: "First", 2: "Second"}
+    context = retriever.context(snippets, titles)
+    assert "Note ID: 1" in context and "Note ID: 2" in context
+    assert "alpha" in context and "gamma" in context
+
+
+def test_context_is_empty_when_nothing_fits(server, monkeypatch):
+    retriever = server.retriever
+    monkeypatch.setattr(retriever, "context_tokens", 5)
+    assert retriever.context({1: ["word " * 100]}, {1: "Title"}) == ""
+
+
+def test_distance_cutoff_is_off_by_default(server):
+    assert server.retriever.max_distance is None
@@ -0,0 +1,33 @@
+from flask import request
+import pytest
+
+from src.streaming import wants_stream
+
+
+@pytest.mark.parametrize(
+    "query, expected",
+    [
+        ("", False),
+        ("?stream=1", True),
+        ("?stream=true", True),
+        ("?stream=True", True),
+        ("?stream=0", False),
+        ("?stream=false", False),
+        ("?stream=", False),
+    ],
+)
+def test_wants_stream_parses_query_values(server, query, expected):
+    with server.app.test_request_context(f"/api/transcriptions/1{query}"):
+        assert wants_stream(request.args) is expected
+
+
+@pytest.mark.parametrize("body, expected", [({"stream": True}, True), ({}, False)])
+def test_wants_stream_reads_json_bodies(server, body, expected):
+    with server.app.test_request_context("/api/chat", method="POST", json=body):
+        assert wants_stream(body) is expected
+
+
+def test_wants_stream_reads_the_accept_header(server):
+    headers = {"Accept": "application/x-ndjson"}
+    with server.app.test_request_context("/api/chat", headers=headers):
+        assert wants_stream({}) is True
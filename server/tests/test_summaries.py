@@ -0,0 +1,30 @@
+import os
+import signal
+import time
+
+
+def test_chunk_pool_works_after_fork(server):
+    summarizer = server.summarizer
+    # Start the threads of the pool in the parent
+    result = list(summarizer._chunk_pool.map(str.upper, ["a", "b", "c"]))
+    assert result == ["A", "B", "C"]
+
+    pid = os.fork()
+    if pid == 0:
+        try:
+            result = list(summarizer._chunk_pool.map(str.upper, ["d", "e", "f"]))
+            os._exit(0 if result == ["D", "E", "F"] else 1)
+        except BaseException:
+            os._exit(1)
+    # Without threads of its own, the child waits for the results forever
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        done, status = os.waitpid(pid, os.WNOHANG)
+        if done:
+            break
+        time.sleep(0.01)
+    else:
+        os.kill(pid, signal.SIGKILL)
+        os.waitpid(pid, 0)
+        status = -1
+    assert status == 0
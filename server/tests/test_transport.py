@@ -0,0 +1,60 @@
+import pytest
+
+from src.transport import BackendUnavailable, TransportPolicy
+
+CONFIG = {
+    "pool_size": 1,
+    "connect_timeout": 1.0,
+    "retries": 0,
+    "backoff": 0.0,
+    "failure_threshold": 1,
+    "reset_timeout": 0.0,
+}
+
+
+class Transient(Exception):
+    pass
+
+
+def call(policy: TransportPolicy, send):
+    return policy.call("POST", "/", send, lambda r: r, lambda r: None, (Transient,))
+
+
+def fail():
+    raise Transient()
+
+
+def test_breaker_opens_and_closes():
+    policy = TransportPolicy("backend", {**CONFIG, "reset_timeout": 60.0}, {"": None})
+    with pytest.raises(Transient):
+        call(policy, fail)
+    assert policy.breaker.state == "open"
+    with pytest.raises(BackendUnavailable):
+        call(policy, lambda: 200)
+    policy.breaker.reset_timeout = 0.0
+    assert call(policy, lambda: 200) == 200
+    assert policy.breaker.state == "closed"
+
+
+def test_trial_ending_in_other_error_allows_another_trial():
+    policy = TransportPolicy("backend", CONFIG, {"": None})
+    with pytest.raises(Transient):
+        call(policy, fail)
+
+    def broken():
+        raise ValueError()
+
+    with pytest.raises(ValueError):
+        call(policy, broken)
+    assert call(policy, lambda: 200) == 200
+    assert policy.breaker.state == "closed"
+
+
+def test_routes_answer_503_while_a_backend_is_unavailable(server, client, monkeypatch):
+    def unavailable(*args, **kwargs):
+        raise BackendUnavailable("ollama is unavailable")
+
+    monkeypatch.setattr(server.hybrid_search, "search", unavailable)
+    response = client.get("/api/notes?q=test&mode=hybrid")
+    assert response.status_code == 503
+    assert response.json == {"error": "ollama is unavailable"}
@@ -0,0 +1,76 @@
+import os
+import signal
+import sqlite3
+import threading
+import time
+
+from src.vectorstore import LocalVectorStore
+
+
+def fork_and_add(store: LocalVectorStore) -> int:
+    """Fork and add a chunk in the child. Returns the exit code of the child."""
+    pid = os.fork()
+    if pid == 0:
+        try:
+            store._conn.execute("PRAGMA busy_timeout=2000")
+            store.add(["child"], ["from the child"], [[1.0] * 8], [{"note_id": 0}])
+            assert store.note_chunk_ids([0]) == {0: {"child"}}
+            os._exit(0)
+        except BaseException:
+            os._exit(1)
+    # A child that inherited a lock in the middle of a write may hang instead of failing
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        done, status = os.waitpid(pid, os.WNOHANG)
+        if done:
+            return os.waitstatus_to_exitcode(status)
+        time.sleep(0.01)
+    os.kill(pid, signal.SIGKILL)
+    os.waitpid(pid, 0)
+    return -1
+
+
+def test_add_and_query(tmp_path):
+    store = LocalVectorStore(str(tmp_path), ann_threshold=1000)
+    store.add(
+        ["1:a", "1:b", "2:a"],
+        ["one a", "one b", "two a"],
+        [[0.0, 0.0], [0.0, 1.0], [3.0, 0.0]],
+        [{"note_id": 1}, {"note_id": 1}, {"note_id": 2}],
+    )
+    assert store.query([0.0, 0.5], n_results=2) == ([1, 2], [0.25, 9.25])
+    store.remove_notes([1])
+    assert store.note_chunk_ids() == {2: {"2:a"}}
+
+
+def test_fork_during_add(tmp_path):
+    store = LocalVectorStore(str(tmp_path), ann_threshold=1000)
+    store._conn.execute("PRAGMA busy_timeout=2000")
+    stop = threading.Event()
+    errors: list[Exception] = []
+
+    def add():
+        i = 0
+        while not stop.is_set():
+            try:
+                store.add(
+                    [f"{i % 50 + 1}:{i}"],
+                    [f"text {i}"],
+                    [[float(i)] * 8],
+                    [{"note_id": i % 50 + 1}],
+                )
+            except sqlite3.OperationalError as e:
+                errors.append(e)
+            i += 1
+            # Pause so that the child is not starved of the write lock
+            time.sleep(0.0005)
+
+    writer = threading.Thread(target=add)
+    writer.start()
+    try:
+        codes = [fork_and_add(store) for _ in range(20)]
+    finally:
+        stop.set()
+        writer.join()
+    assert codes == [0] * 20
+    assert not errors